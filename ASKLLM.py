@@ -3,13 +3,18 @@ import os
 import re
 import sys
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from google import genai
 from google.genai import types
 
+import atomic_io
 import cache_utils as cache
+import endpoint_registry
+import fanout
 import persistent_memory as pmem
+import skill_registry
+import skill_router
 from condition_prediction import (
     run_askcos_condition_prediction,
     run_askcos_condition_prediction_compare,
@@ -40,6 +45,7 @@ from policies import (
     extract_top_score,
     is_tool_empty,
     is_tool_error,
+    keyword_skill_files,
     looks_like_smiles,
     recent_effective_evidence,
 )
@@ -51,6 +57,7 @@ from route_recommendation import (
 )
 from retrosynthesis import (
     run_askcos_retrosynthesis,
+    run_askcos_retrosynthesis_batch,
     run_askcos_retrosynthesis_compare,
     run_askcos_retrosynthesis_pistachio,
     run_askcos_retrosynthesis_template_enum,
@@ -87,6 +94,10 @@ CRITIC_PROVIDER = os.environ.get("ASKLLM_CRITIC_PROVIDER", AUX_PROVIDER).lower()
 SKILL_ROUTER_PROVIDER = os.environ.get("ASKLLM_SKILL_ROUTER_PROVIDER", AUX_PROVIDER).lower()
 
 PLANNER_TIMEOUT_SEC = int(os.environ.get("ASKLLM_PLANNER_TIMEOUT_SEC", "60"))
+# 回合前階段（AI skill 路由 / adaptive planner / 名稱解析）並行執行，各自 deadline，逾時改用啟發式結果
+PRETURN_SKILL_DEADLINE_SEC = float(os.environ.get("ASKLLM_PRETURN_SKILL_DEADLINE_SEC", "15"))
+PRETURN_PLANNER_DEADLINE_SEC = float(os.environ.get("ASKLLM_PRETURN_PLANNER_DEADLINE_SEC", str(PLANNER_TIMEOUT_SEC)))
+PRETURN_RESOLVE_DEADLINE_SEC = float(os.environ.get("ASKLLM_PRETURN_RESOLVE_DEADLINE_SEC", "20"))
 TOOL_RESULT_MAX_CHARS = int(os.environ.get("ASKLLM_TOOL_RESULT_MAX_CHARS", "2200"))
 
 ENABLE_AI_SKILL_ROUTER = os.environ.get("ASKLLM_ENABLE_AI_SKILL_ROUTER", "1") == "1"
@@ -97,19 +108,19 @@ ENABLE_ADAPTIVE_POLICY = os.environ.get("ASKLLM_ENABLE_ADAPTIVE_POLICY", "1") ==
 
 SKILLS_DIR = os.path.join(os.path.dirname(__file__), "skills")
 SKILL_FALLBACK_FILE = os.path.join(SKILLS_DIR, "00-core.md")
+DEFAULT_SYSTEM_INSTRUCTION = (
+    "You are a professional chemistry assistant using the provided tools. "
+    "Always respond in Traditional Chinese (繁體中文)."
+)
+# skills/*.md 啟動時整批讀入，依 mtime 重讀；系統指令依選檔組合 + 記憶段落快取
+_skill_registry = skill_registry.SkillRegistry(SKILLS_DIR)
+
 BASE_SKILL_FILES = [
     "00-core.md",
     "01-language.md",
     "08-cmem.md",
     "07-completion.md",
 ]
-CONDITIONAL_SKILL_RULES = [
-    ("02-ambiguity.md", ["co", "no", " p ", "smiles", "分子式", "結構式", "歧義", "縮寫"]),
-    ("03-name-resolution.md", ["名稱", "name", "翻譯", "smiles", "化合物", "compound", "分子"]),
-    ("04-condition-priority.md", ["條件", "condition", "yield", "產率", "buchwald", "grignard", "chan-lam"]),
-    ("05-task-routing.md", ["逆合成", "retrosynthesis", "forward", "正向", "雜質", "impurity", "路徑", "mcts"]),
-    ("06-formatting.md", ["輸出", "格式", "temperature", "probability", "score", "top 5", "攝氏", "表格"]),
-]
 
 MEMORY_DIR = pmem.MEMORY_DIR
 EVIDENCE_LOG_PATH = os.path.join(MEMORY_DIR, "evidence_logs.jsonl")
@@ -126,44 +137,24 @@ def _ensure_memory_dir() -> None:
     os.makedirs(MEMORY_DIR, exist_ok=True)
 
 
-def _read_text_file(path: str) -> str:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read().strip()
-    except Exception:
-        return ""
-
-
-def _read_json_file(path: str, default: Any) -> Any:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return default
-
-
-def _write_json_file(path: str, data: Any) -> None:
+def append_tool_trace(record: Dict[str, Any]) -> None:
     _ensure_memory_dir()
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
 
+    # 持鎖 read-modify-write：Flask 多 thread 同時追加時不會互相蓋掉紀錄
+    def _append(data: Any) -> Dict[str, Any]:
+        if not isinstance(data, dict):
+            data = {"session_started_at": utc_now_iso(), "items": []}
+        items = data.get("items", [])
+        items.append(record)
+        data["items"] = items
+        return data
 
-def append_tool_trace(record: Dict[str, Any]) -> None:
-    _ensure_memory_dir()
-    data = _read_json_file(
-        TOOL_TRACE_PATH,
-        {"session_started_at": utc_now_iso(), "items": []},
-    )
-    items = data.get("items", [])
-    items.append(record)
-    data["items"] = items
-    _write_json_file(TOOL_TRACE_PATH, data)
+    atomic_io.update_json(TOOL_TRACE_PATH, _append)
 
 
 def write_evidence_log(record: Dict[str, Any]) -> None:
     _ensure_memory_dir()
-    with open(EVIDENCE_LOG_PATH, "a", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    atomic_io.append_jsonl(EVIDENCE_LOG_PATH, record)
 
 
 def _extract_json_block(text: str) -> Dict[str, Any]:
@@ -303,6 +294,10 @@ def _route_skills_with_ai(user_prompt: str) -> List[str]:
     if not ENABLE_AI_SKILL_ROUTER:
         return []
     available_files = ["02-ambiguity.md", "03-name-resolution.md", "04-condition-priority.md", "05-task-routing.md", "06-formatting.md"]
+    # 本地分類器有把握就不呼叫 LLM（約數百 µs vs 一次模型往返）
+    local_files = skill_router.predict(user_prompt, available_files)
+    if local_files is not None:
+        return local_files
     provider = SKILL_ROUTER_PROVIDER
     model = (
         _pick_groq_model_for_task(user_prompt=user_prompt, task_type="planner")
@@ -319,19 +314,19 @@ def _route_skills_with_ai(user_prompt: str) -> List[str]:
         text = _generate_text(prompt=prompt, model=model, provider=provider, timeout_sec=30)
         data = _extract_json_block(text)
         files = data.get("files", [])
-        return [x for x in files if x in available_files]
+        selected = [x for x in files if x in available_files]
+        if "files" in data:
+            skill_router.record_decision(user_prompt, selected, available_files, model=model)
+        return selected
     except Exception:
         return []
 
 
-def _select_skill_files(user_prompt: str) -> List[str]:
-    normalized = f" {str(user_prompt).lower()} "
+def _select_skill_files(user_prompt: str, routed_files: Optional[List[str]] = None) -> List[str]:
+    """routed_files 為已取得的 AI 路由結果（回合前階段並行算好）；None 時當場呼叫 AI 路由。"""
     selected = list(BASE_SKILL_FILES)
-    selected.extend(_route_skills_with_ai(user_prompt))
-
-    for filename, keywords in CONDITIONAL_SKILL_RULES:
-        if any(keyword in normalized for keyword in keywords):
-            selected.append(filename)
+    selected.extend(_route_skills_with_ai(user_prompt) if routed_files is None else routed_files)
+    selected.extend(keyword_skill_files(user_prompt))
 
     deduped = []
     seen = set()
@@ -342,28 +337,21 @@ def _select_skill_files(user_prompt: str) -> List[str]:
     return deduped
 
 
-def load_system_instruction_from_skill(user_prompt: str, state: Dict[str, Any]) -> str:
-    selected_files = _select_skill_files(user_prompt)
-    fragments = []
-    for filename in selected_files:
-        content = _read_text_file(os.path.join(SKILLS_DIR, filename))
-        if content:
-            fragments.append(f"[SKILL:{filename}]\n{content}")
-
-    if not fragments:
-        fallback = _read_text_file(SKILL_FALLBACK_FILE)
-        if fallback:
-            fragments.append(fallback)
-
-    if not fragments:
-        fragments.append(
-            "You are a professional chemistry assistant using the provided tools. "
-            "Always respond in Traditional Chinese (繁體中文)."
-        )
-
-    fragments.append(pmem.format_summary_for_system(state.get("summary_zh", "")))
-    fragments.append(pmem.format_topic_summary_for_system(state))
-    return "\n\n".join([x for x in fragments if x.strip()])
+def load_system_instruction_from_skill(
+    user_prompt: str,
+    state: Dict[str, Any],
+    routed_files: Optional[List[str]] = None,
+) -> str:
+    selected_files = _select_skill_files(user_prompt, routed_files)
+    return _skill_registry.assemble(
+        selected_files,
+        suffix_parts=[
+            pmem.format_summary_for_system(state.get("summary_zh", "")),
+            pmem.format_topic_summary_for_system(state),
+        ],
+        fallback_file=os.path.basename(SKILL_FALLBACK_FILE),
+        default=DEFAULT_SYSTEM_INSTRUCTION,
+    )
 
 
 def _explicit_compare_request(user_prompt: str) -> bool:
@@ -384,6 +372,8 @@ def _build_heuristic_plan(user_prompt: str, available_tool_names: List[str]) ->
     candidates = ["resolve_smiles_from_name"]
     if any(k in lower for k in ["逆合成", "retrosynthesis", "合成路徑"]):
         candidates.extend(["run_askcos_retrosynthesis"])
+        if any(k in lower for k in ["批次", "batch", "大量", "篩選"]):
+            candidates.append("run_askcos_retrosynthesis_batch")
         if multistep:
             candidates.extend(
                 [
@@ -436,10 +426,13 @@ def _build_heuristic_plan(user_prompt: str, available_tool_names: List[str]) ->
             ]
         )
 
+    unavailable = set(endpoint_registry.unavailable_tools())
     filtered = []
     for name in candidates:
         if name not in available_tool_names:
             continue
+        if name in unavailable:
+            continue
         if not compare_allowed and name.endswith("_compare"):
             continue
         if not multistep and name.startswith("run_askcos_multistep_retrosynthesis"):
@@ -460,11 +453,18 @@ def _build_heuristic_plan(user_prompt: str, available_tool_names: List[str]) ->
         "multistep_requested": multistep,
         "max_tool_calls": 3 if compare_allowed or multistep else 2,
         "reasoning": "heuristic fallback",
+        "unavailable_tools": sorted(unavailable),
     }
 
 
+def _available_tool_names(tools_to_use: list) -> List[str]:
+    # 已知離線（circuit open）的 AskCOS 端點對應工具不交給 planner，避免整輪卡在 timeout
+    unavailable = set(endpoint_registry.unavailable_tools())
+    return [getattr(t, "__name__", str(t)) for t in tools_to_use if getattr(t, "__name__", str(t)) not in unavailable]
+
+
 def _build_adaptive_plan(user_prompt: str, tools_to_use: list) -> Dict[str, Any]:
-    available_tool_names = [getattr(t, "__name__", str(t)) for t in tools_to_use]
+    available_tool_names = _available_tool_names(tools_to_use)
     heuristic = _build_heuristic_plan(user_prompt, available_tool_names)
     if not ENABLE_ADAPTIVE_POLICY:
         heuristic["planner_enabled"] = False
@@ -504,6 +504,7 @@ def _build_adaptive_plan(user_prompt: str, tools_to_use: list) -> Dict[str, Any]
             data["tool_candidates"] = tool_candidates or heuristic["tool_candidates"]
         data["compare_allowed"] = bool(data.get("compare_allowed", heuristic["compare_allowed"]))
         data["max_tool_calls"] = int(data.get("max_tool_calls", heuristic["max_tool_calls"]))
+        data["unavailable_tools"] = heuristic["unavailable_tools"]
         data["planner_enabled"] = True
         return data
     except Exception:
@@ -511,6 +512,58 @@ def _build_adaptive_plan(user_prompt: str, tools_to_use: list) -> Dict[str, Any]
         return heuristic
 
 
+def _fallback_adaptive_plan(user_prompt: str, tools_to_use: list) -> Dict[str, Any]:
+    """planner 超過回合前 deadline 時改用的 heuristic plan。"""
+    heuristic = _build_heuristic_plan(user_prompt, _available_tool_names(tools_to_use))
+    heuristic["planner_enabled"] = ENABLE_ADAPTIVE_POLICY
+    heuristic["reasoning"] = "heuristic fallback (planner deadline exceeded)"
+    return heuristic
+
+
+def _pre_turn_name_candidate(user_prompt: str) -> str:
+    """與 run_groq_turn 開頭的名稱解析同條件：提示中沒有 SMILES 時才取名稱。"""
+    if extract_smiles_candidate(user_prompt) or looks_like_smiles(user_prompt):
+        return ""
+    return extract_name_candidate(user_prompt)
+
+
+def _run_pre_turn(user_prompt: str, tools_to_use: list) -> Dict[str, Any]:
+    """
+    回合前階段：AI skill 路由、adaptive planner、（Groq 路徑）名稱解析彼此無依賴，並行執行後 join，
+    第一個工具開始前的等待約為三者中最慢者而非總和。
+
+    各自有 deadline，逾時或失敗時分別退回：只用關鍵字 skill 規則、heuristic plan、不預先解析名稱
+    （交給 planner 決定是否呼叫 resolve 工具）。逾時的工作不會被中斷，名稱解析完成後照常寫入快取。
+    """
+    tasks: List[fanout.GatherTask] = [
+        ("skills", lambda: _route_skills_with_ai(user_prompt), PRETURN_SKILL_DEADLINE_SEC, list),
+        (
+            "planner",
+            lambda: _build_adaptive_plan(user_prompt, tools_to_use),
+            PRETURN_PLANNER_DEADLINE_SEC,
+            lambda: _fallback_adaptive_plan(user_prompt, tools_to_use),
+        ),
+    ]
+    name_candidate = _pre_turn_name_candidate(user_prompt) if DECISION_PROVIDER == "groq" else ""
+    if name_candidate:
+        tasks.append(
+            (
+                "resolve",
+                lambda: str(resolve_smiles_from_name(compound_name=name_candidate)),
+                PRETURN_RESOLVE_DEADLINE_SEC,
+                lambda: None,
+            )
+        )
+    results = fanout.gather(tasks, thread_name_prefix="askllm-preturn")
+    resolve = results.get("resolve")
+    return {
+        "routed_files": results["skills"]["value"],
+        "adaptive_plan": results["planner"]["value"],
+        "name_resolution": {"compound_name": name_candidate, "text": resolve["value"]} if resolve else None,
+        "timings": {name: {"status": r["status"], "elapsed_sec": r["elapsed_sec"]} for name, r in results.items()},
+    }
+
+
 def _filter_tools_for_turn(user_prompt: str, tools_to_use: list, adaptive_plan: Dict[str, Any]) -> list:
     requested = set(adaptive_plan.get("tool_candidates", []))
     compare_allowed = bool(adaptive_plan.get("compare_allowed"))
@@ -535,6 +588,10 @@ def _filter_tools_for_turn(user_prompt: str, tools_to_use: list, adaptive_plan:
 
     if not compare_allowed:
         selected = [tool for tool in selected if not getattr(tool, "__name__", str(tool)).endswith("_compare")]
+    unavailable = set(adaptive_plan.get("unavailable_tools", []))
+    if unavailable:
+        alive = [tool for tool in selected if getattr(tool, "__name__", str(tool)) not in unavailable]
+        selected = alive or selected
     if not multistep_requested:
         selected = [
             tool
@@ -825,8 +882,10 @@ def _summarize_tool_output(tool_name: str, raw_output: str) -> str:
         provider=provider,
         timeout_sec=45,
     )
+    # 摘要失敗時退回截斷原文，只短暫快取，恢復後重新摘要
+    outcome = cache.OUTCOME_SUCCESS if summary else cache.OUTCOME_TRANSIENT_ERROR
     summary = (summary or text[:TOOL_RESULT_MAX_CHARS]).strip()
-    cache.set(cache_key, summary)
+    cache.set(cache_key, summary, outcome=outcome)
     return summary[:TOOL_RESULT_MAX_CHARS]
 
 
@@ -1071,8 +1130,9 @@ def run_interactive_agent(
     if not history:
         history.extend(pmem.state_to_gemini_history(state))
 
-    system_instruction = load_system_instruction_from_skill(user_prompt, state)
-    adaptive_plan = _build_adaptive_plan(user_prompt, tools_to_use)
+    pre_turn = _run_pre_turn(user_prompt, tools_to_use)
+    system_instruction = load_system_instruction_from_skill(user_prompt, state, pre_turn["routed_files"])
+    adaptive_plan = pre_turn["adaptive_plan"]
     tools_for_turn = _filter_tools_for_turn(user_prompt, tools_to_use, adaptive_plan)
 
     current_user_content = types.Content(role="user", parts=[types.Part(text=str(user_prompt))])
@@ -1123,6 +1183,7 @@ def run_interactive_agent(
                 groq_aux_model=GROQ_AUX_MODEL,
                 primary_model=groq_decision_model_for_turn,
                 planner_timeout_sec=PLANNER_TIMEOUT_SEC,
+                prefetched_name_resolution=pre_turn["name_resolution"],
             )
         else:
             final_response_text, raw_tool_outputs, current_model = _run_gemini_turn(
@@ -1141,6 +1202,7 @@ def run_interactive_agent(
                     "decision_model_for_turn": current_model,
                     "planner_on": ENABLE_ADAPTIVE_POLICY,
                     "planner_output": adaptive_plan,
+                    "pre_turn": pre_turn["timings"],
                     "compare_allowed": bool(adaptive_plan.get("compare_allowed")),
                     "tool_call_count": len(raw_tool_outputs),
                     "tool_names": tool_names,
@@ -1245,6 +1307,7 @@ askcos_tools = [
     run_askcos_retrosynthesis_pistachio,
     run_askcos_retrosynthesis_template_enum,
     run_askcos_retrosynthesis_compare,
+    run_askcos_retrosynthesis_batch,
     run_askcos_multistep_retrosynthesis,
     run_askcos_multistep_retrosynthesis_retro_star,
     run_askcos_multistep_retrosynthesis_compare,
@@ -0,0 +1,239 @@
+"""
+原子寫檔與 advisory lock：threaded Flask API 與背景 multistep_async_runner 行程同時讀寫
+快取 / job / 記憶檔時，讀者不會看到寫一半的檔案，追加的 JSONL 行也不會交錯。
+
+- write_bytes / write_text / write_json / open_atomic：同目錄暫存檔 → flush（+ fsync）→ os.replace。
+  同一檔案系統上 rename 為原子操作，讀者只會看到舊檔或新檔。
+- append_line / append_jsonl：O_APPEND 開檔、持 flock(LOCK_EX) 寫入整行，跨行程不交錯。
+- update_json：持 <path>.lock 的 flock 做 read-modify-write（job 狀態、tool trace），
+  兩個寫者不會互相蓋掉對方的欄位。
+- sweep_temp：清除寫到一半就中斷（行程被殺）留下的暫存檔。
+- sweep_lock_files：刪除閒置且沒人持有的 *.lock 檔（每個 key 一個鎖檔時，避免 inode 無限增長）；
+  以鎖檔互斥的一方須在取得 flock 後用 lock_is_current() 確認鎖檔沒被換掉。
+
+flock 以 open file description 為單位，同行程的不同 thread 各自 open 也會互斥；
+無 fcntl 的平台退化為行程內 threading.Lock（仍保有 os.replace 的原子性）。
+
+環境變數：
+  ASKLLM_ATOMIC_FSYNC=0   write_* 預設不 fsync（較快；斷電可能遺失最後一次寫入，但不會讀到半份檔案）
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Callable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+
+FSYNC = os.environ.get("ASKLLM_ATOMIC_FSYNC", "1") != "0"
+
+TEMP_SUFFIX = ".tmp"
+
+_thread_lock = threading.RLock()
+
+_umask_lock = threading.Lock()
+_file_mode: Optional[int] = None
+
+
+def _default_mode() -> int:
+    """mkstemp 建出的是 0600；改成一般 open() 會得到的權限（0666 & ~umask）。"""
+    global _file_mode
+    with _umask_lock:
+        if _file_mode is None:
+            umask = os.umask(0)
+            os.umask(umask)
+            _file_mode = 0o666 & ~umask
+        return _file_mode
+
+
+def _ensure_parent(path: str) -> str:
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    return parent
+
+
+@contextmanager
+def open_atomic(path: str, fsync: Optional[bool] = None) -> Iterator[BinaryIO]:
+    """
+    以二進位模式開同目錄暫存檔，區塊正常結束才 os.replace 成 path（可 seek，適合串流寫大檔）；
+    區塊拋出例外時刪除暫存檔、原檔不受影響。
+    """
+    parent = _ensure_parent(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=TEMP_SUFFIX, dir=parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            f.flush()
+            if FSYNC if fsync is None else fsync:
+                os.fsync(f.fileno())
+        os.chmod(tmp_path, _default_mode())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_bytes(path: str, data: bytes, fsync: Optional[bool] = None) -> None:
+    """以暫存檔 + os.replace 整份取代 path；失敗時不留下暫存檔、原檔不受影響。"""
+    with open_atomic(path, fsync=fsync) as f:
+        f.write(data)
+
+
+def write_text(path: str, text: str, fsync: Optional[bool] = None) -> None:
+    write_bytes(path, text.encode("utf-8"), fsync=fsync)
+
+
+def write_json(path: str, data: Any, indent: Optional[int] = 2, fsync: Optional[bool] = None) -> None:
+    write_text(path, json.dumps(data, ensure_ascii=False, indent=indent), fsync=fsync)
+
+
+def read_json(path: str, default: Any = None) -> Any:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+@contextmanager
+def locked(path: str) -> Iterator[None]:
+    """持有 <path>.lock 的排他 flock（跨行程 / 跨 thread）；用於 read-modify-write。"""
+    _ensure_parent(path)
+    if fcntl is None:
+        with _thread_lock:
+            yield
+        return
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def update_json(path: str, mutate: Callable[[Any], Any], default: Any = None, indent: Optional[int] = 2) -> Any:
+    """
+    鎖住 path 後讀出 JSON、交給 mutate() 修改並原子寫回，回傳寫入的資料。
+
+    mutate 可就地修改並回傳 None，或回傳新物件；讀檔失敗時以 default 起始。
+    """
+    with locked(path):
+        data = read_json(path, default)
+        updated = mutate(data)
+        if updated is not None:
+            data = updated
+        write_json(path, data, indent=indent)
+        return data
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+def append_line(path: str, line: str) -> None:
+    """追加一行（自動補換行）；持 flock 寫完整行，不會與其他寫者交錯。"""
+    _ensure_parent(path)
+    data = (line if line.endswith("\n") else line + "\n").encode("utf-8")
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if fcntl is None:
+            with _thread_lock:
+                _write_all(fd, data)
+            return
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            _write_all(fd, data)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def append_jsonl(path: str, record: Any) -> None:
+    append_line(path, json.dumps(record, ensure_ascii=False))
+
+
+def sweep_temp(directory: str, older_than_sec: float = 3600) -> int:
+    """刪除 directory 下超過 older_than_sec 未更新的暫存檔（中斷的寫入），回傳刪除數。"""
+    cutoff = time.time() - older_than_sec
+    count = 0
+    try:
+        it = os.scandir(directory)
+    except OSError:
+        return 0
+    with it:
+        for item in it:
+            if not (item.name.startswith(".") and item.name.endswith(TEMP_SUFFIX)):
+                continue
+            try:
+                if item.stat().st_mtime < cutoff:
+                    os.remove(item.path)
+                    count += 1
+            except OSError:
+                pass
+    return count
+
+
+def lock_is_current(fd: int, path: str) -> bool:
+    """fd 對應的鎖檔仍是 path 目前指向的檔案（未被 sweep_lock_files 刪除 / 重建）。"""
+    try:
+        held = os.fstat(fd)
+        current = os.stat(path)
+    except OSError:
+        return False
+    return (held.st_dev, held.st_ino) == (current.st_dev, current.st_ino)
+
+
+def sweep_lock_files(directory: str, older_than_sec: float) -> int:
+    """
+    刪除 directory 下超過 older_than_sec 未使用（mtime）且目前沒被持有的 *.lock，回傳刪除數。
+    先以 LOCK_NB 取得鎖再刪除；已開檔、正在等鎖的一方拿到的會是已刪除的檔案，須以 lock_is_current() 重試。
+    """
+    if fcntl is None:
+        return 0
+    cutoff = time.time() - older_than_sec
+    count = 0
+    try:
+        it = os.scandir(directory)
+    except OSError:
+        return 0
+    with it:
+        for item in it:
+            if not item.name.endswith(".lock"):
+                continue
+            try:
+                if item.stat().st_mtime >= cutoff:
+                    continue
+                fd = os.open(item.path, os.O_RDWR)
+            except OSError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue  # 有人持有中
+            try:
+                if lock_is_current(fd, item.path):
+                    os.remove(item.path)
+                    count += 1
+            except OSError:
+                pass
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+    return count
@@ -0,0 +1,740 @@
+"""
+cache_utils 的儲存後端。cache_utils 負責 TTL 判斷與 API，後端只負責存取「entry」：
+
+  {"key": 原始 key（可能為 None）, "namespace": str, "created_at": int, "ttl_sec": int, "value": Any}
+
+讀出的 entry["value"] 可能是 cache_codec.LazyValue（尚未解壓），取值前以 cache_codec.materialize() 解開。
+
+每筆 entry 以 sha256(key) 定位（與舊版檔案快取的檔名相同），因此舊檔案可無損搬到其他後端。
+
+  file    每個 key 一個檔（<cache dir>/<sha256>.json，格式見 cache_codec.py；舊版 indent JSON 照常讀）；
+          檔案 mtime 即最後存取時間（命中時更新）；以暫存檔 + os.replace 寫入，讀者不會讀到半份檔
+  sqlite  單一 SQLite 檔（WAL，多行程可同時讀寫），namespace / expires_at / accessed_at 皆有索引，
+          set_many 以單一 transaction 批次寫入
+  redis   共用的 Redis 協定伺服器（resp_client.py），多個 API 節點共享命中；value 格式同 file 後端，
+          以 SET EX 交給伺服器依 entry 到期時間自動過期、淘汰交給伺服器的 maxmemory 政策；
+          get_many / set_many 以 MGET / pipeline 批次。連不上時改用本機備援後端（file），
+          RETRY 秒後再試；共用層未命中時也查備援，斷線期間寫在本機的結果仍可用
+
+容量管理（cache_utils 的 sweeper 與 stats 指令使用）：
+  scan()             逐筆列出 metadata（hash, namespace, size, accessed_at, expires_at）
+  purge_expired(now) 批次刪除已過期 entry
+  evict_to(max)      依最後存取時間由舊到新刪除，直到總量低於 max
+  usage(now)         各 namespace 的筆數 / 位元組 / 已過期筆數
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+import atomic_io
+import cache_codec
+import resp_client
+
+
+Entry = Dict[str, Any]
+Meta = Dict[str, Any]
+
+# 命中時最多每隔這麼久更新一次最後存取時間，避免每次讀取都寫入
+TOUCH_INTERVAL_SEC = 60
+
+# 舊版檔案沒有記錄 key / namespace，搬移後歸到這個 namespace
+LEGACY_NAMESPACE = "legacy"
+
+
+def key_hash(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def expires_at(entry: Entry) -> int:
+    """entry 依寫入時 TTL 的到期時間（0 表示不過期）。"""
+    ttl = int(entry.get("ttl_sec") or 0)
+    created = int(entry.get("created_at") or 0)
+    return created + ttl if ttl > 0 and created else 0
+
+
+class CacheBackend:
+    name = "base"
+
+    def get(self, key: str) -> Optional[Entry]:
+        raise NotImplementedError
+
+    def get_many(self, keys: List[str]) -> Dict[str, Entry]:
+        out = {}
+        for key in keys:
+            entry = self.get(key)
+            if entry is not None:
+                out[key] = entry
+        return out
+
+    def set(self, key: str, entry: Entry) -> bool:
+        raise NotImplementedError
+
+    def set_many(self, items: Dict[str, Entry]) -> int:
+        return sum(1 for key, entry in items.items() if self.set(key, entry))
+
+    def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def clear(self) -> int:
+        raise NotImplementedError
+
+    def iter_entries(self) -> Iterator[Tuple[str, Entry]]:
+        """逐筆列出 (key_hash, entry)，供搬移 / 統計使用。"""
+        raise NotImplementedError
+
+    def get_hashed(self, hashed: str) -> Optional[Entry]:
+        """以 key_hash 直接讀取（不更新最後存取時間），供快照匯入比較新舊。"""
+        raise NotImplementedError
+
+    def put_hashed(self, hashed: str, entry: Entry) -> bool:
+        """以 key_hash 直接寫入（搬移舊資料時原始 key 未知）。"""
+        raise NotImplementedError
+
+    def put_many_hashed(self, rows: Iterable[Tuple[str, Entry]]) -> int:
+        return sum(1 for hashed, entry in rows if self.put_hashed(hashed, entry))
+
+    def scan(self) -> Iterator[Meta]:
+        raise NotImplementedError
+
+    def remove_hashed(self, hashes: List[str]) -> int:
+        raise NotImplementedError
+
+    def purge_expired(self, now: int) -> int:
+        return self.remove_hashed([m["hash"] for m in self.scan() if 0 < m["expires_at"] <= now])
+
+    def evict_to(self, max_bytes: int) -> int:
+        metas = list(self.scan())
+        total = sum(m["size"] for m in metas)
+        if total <= max_bytes:
+            return 0
+        victims = []
+        for meta in sorted(metas, key=lambda m: m["accessed_at"]):
+            if total <= max_bytes:
+                break
+            victims.append(meta["hash"])
+            total -= meta["size"]
+        return self.remove_hashed(victims)
+
+    def usage(self, now: int) -> Dict[str, Dict[str, int]]:
+        out: Dict[str, Dict[str, int]] = {}
+        for meta in self.scan():
+            row = out.setdefault(meta["namespace"], {"entries": 0, "bytes": 0, "expired": 0})
+            row["entries"] += 1
+            row["bytes"] += meta["size"]
+            if 0 < meta["expires_at"] <= now:
+                row["expired"] += 1
+        return out
+
+
+# 檔案開頭的 metadata（寫入時放在 value 之前），sweeper 只需讀檔頭不必整份 parse
+_HEAD_BYTES = 2048
+_HEAD_INT_RE = {name: re.compile(rf'"{name}":\s*(\d+)') for name in ("created_at", "ttl_sec")}
+_HEAD_NS_RE = re.compile(r'"namespace":\s*"((?:[^"\\]|\\.)*)"')
+
+
+class FileBackend(CacheBackend):
+    name = "file"
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def _ensure_dir(self) -> str:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return self.cache_dir
+
+    def _path(self, hashed: str) -> str:
+        return os.path.join(self._ensure_dir(), f"{hashed}.json")
+
+    def _read(self, path: str) -> Optional[Entry]:
+        try:
+            with open(path, "rb") as f:
+                return cache_codec.decode_entry(f.read())
+        except Exception:
+            return None
+
+    def get(self, key: str) -> Optional[Entry]:
+        path = self._path(key_hash(key))
+        if not os.path.exists(path):
+            return None
+        entry = self._read(path)
+        if entry is not None:
+            self._touch(path)
+        return entry
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        try:
+            now = time.time()
+            if now - os.stat(path).st_mtime > TOUCH_INTERVAL_SEC:
+                os.utime(path, (now, now))
+        except OSError:
+            pass
+
+    def get_hashed(self, hashed: str) -> Optional[Entry]:
+        path = self._path(hashed)
+        return self._read(path) if os.path.exists(path) else None
+
+    def put_hashed(self, hashed: str, entry: Entry) -> bool:
+        # metadata 一行放在 value 前面，scan() 讀檔頭即可取得
+        try:
+            # 快取可重算，不 fsync；os.replace 已保證不會讀到半份檔
+            atomic_io.write_bytes(self._path(hashed), cache_codec.encode_entry(entry), fsync=False)
+            return True
+        except Exception:
+            return False
+
+    def set(self, key: str, entry: Entry) -> bool:
+        return self.put_hashed(key_hash(key), entry)
+
+    def delete(self, key: str) -> bool:
+        path = self._path(key_hash(key))
+        if not os.path.exists(path):
+            return False
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def clear(self) -> int:
+        count = 0
+        cache_dir = self._ensure_dir()
+        for filename in os.listdir(cache_dir):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                os.remove(os.path.join(cache_dir, filename))
+                count += 1
+            except OSError:
+                pass
+        return count
+
+    def iter_entries(self) -> Iterator[Tuple[str, Entry]]:
+        cache_dir = self._ensure_dir()
+        for filename in os.listdir(cache_dir):
+            if not filename.endswith(".json"):
+                continue
+            entry = self._read(os.path.join(cache_dir, filename))
+            if entry is not None:
+                yield filename[: -len(".json")], entry
+
+    def _read_meta(self, path: str) -> Optional[Meta]:
+        try:
+            with open(path, "rb") as f:
+                raw_head = f.read(_HEAD_BYTES)
+        except OSError:
+            return None
+        header = cache_codec.parse_header(raw_head)
+        if header is not None:
+            meta = {name: header.get(name) for name in cache_codec.HEADER_FIELDS}
+            meta["namespace"] = meta.get("namespace") or LEGACY_NAMESPACE
+            return meta
+        # 舊版 indent JSON：以 regex 從檔頭取欄位，取不到才整份 parse
+        head = raw_head.decode("utf-8", errors="replace")
+        ints = {name: regex.search(head) for name, regex in _HEAD_INT_RE.items()}
+        if ints["created_at"] is None:
+            entry = self._read(path)
+            if entry is None:
+                return None
+            meta = {"created_at": entry.get("created_at"), "ttl_sec": entry.get("ttl_sec"), "namespace": entry.get("namespace")}
+        else:
+            ns = _HEAD_NS_RE.search(head)
+            meta = {
+                "created_at": int(ints["created_at"].group(1)),
+                "ttl_sec": int(ints["ttl_sec"].group(1)) if ints["ttl_sec"] else 0,
+                "namespace": json.loads(f'"{ns.group(1)}"') if ns else None,
+            }
+        meta["namespace"] = meta.get("namespace") or LEGACY_NAMESPACE
+        return meta
+
+    def scan(self) -> Iterator[Meta]:
+        cache_dir = self._ensure_dir()
+        with os.scandir(cache_dir) as it:
+            for item in it:
+                if not item.name.endswith(".json") or not item.is_file():
+                    continue
+                try:
+                    st = item.stat()
+                except OSError:
+                    continue
+                meta = self._read_meta(item.path)
+                if meta is None:
+                    continue
+                yield {
+                    "hash": item.name[: -len(".json")],
+                    "namespace": meta["namespace"],
+                    "size": int(st.st_size),
+                    "accessed_at": int(st.st_mtime),
+                    "expires_at": expires_at(meta),
+                }
+
+    def purge_expired(self, now: int) -> int:
+        # 順便清掉寫入中斷（行程被殺）留下的暫存檔
+        atomic_io.sweep_temp(self._ensure_dir())
+        return super().purge_expired(now)
+
+    def remove_hashed(self, hashes: List[str]) -> int:
+        count = 0
+        for hashed in hashes:
+            try:
+                os.remove(self._path(hashed))
+                count += 1
+            except OSError:
+                pass
+        return count
+
+
+class SQLiteBackend(CacheBackend):
+    name = "sqlite"
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key_hash TEXT PRIMARY KEY,
+        key TEXT,
+        namespace TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        ttl_sec INTEGER NOT NULL,
+        expires_at INTEGER NOT NULL,
+        accessed_at INTEGER NOT NULL DEFAULT 0,
+        size INTEGER NOT NULL DEFAULT 0,
+        enc TEXT NOT NULL DEFAULT 'json',
+        value TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_entries_namespace ON entries(namespace);
+    CREATE INDEX IF NOT EXISTS idx_entries_expires_at ON entries(expires_at);
+    """
+    # 早期建立的資料庫沒有 accessed_at / size / enc 欄位，開啟時補上
+    # （enc 預設 json：舊資料的 value 是 JSON 文字；新資料的 value 存 BLOB）
+    _ADDED_COLUMNS = {
+        "accessed_at": "INTEGER NOT NULL DEFAULT 0",
+        "size": "INTEGER NOT NULL DEFAULT 0",
+        "enc": "TEXT NOT NULL DEFAULT 'json'",
+    }
+    _DELETE_CHUNK = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self._SCHEMA)
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            for column, decl in self._ADDED_COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE entries ADD COLUMN {column} {decl}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed_at ON entries(accessed_at)")
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(hashed: str, entry: Entry) -> Tuple[Any, ...]:
+        enc, blob, _ = cache_codec.encode_value(entry.get("value"))
+        return (
+            hashed,
+            entry.get("key"),
+            str(entry.get("namespace") or LEGACY_NAMESPACE),
+            int(entry.get("created_at") or 0),
+            int(entry.get("ttl_sec") or 0),
+            expires_at(entry),
+            int(time.time()),
+            len(blob),
+            enc,
+            sqlite3.Binary(blob),
+        )
+
+    _UPSERT = (
+        "INSERT OR REPLACE INTO entries "
+        "(key_hash, key, namespace, created_at, ttl_sec, expires_at, accessed_at, size, enc, value) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+    _SELECT = "SELECT key_hash, key, namespace, created_at, ttl_sec, value, accessed_at, enc FROM entries"
+
+    @staticmethod
+    def _entry(row: Tuple[Any, ...]) -> Tuple[str, Entry]:
+        hashed, key, namespace, created_at, ttl_sec, value, _, enc = row
+        return hashed, {
+            "key": key,
+            "namespace": namespace,
+            "created_at": int(created_at),
+            "ttl_sec": int(ttl_sec),
+            "value": cache_codec.LazyValue(enc or cache_codec.ENC_JSON, value),
+        }
+
+    def _touch(self, conn: sqlite3.Connection, rows: List[Tuple[Any, ...]]) -> None:
+        now = int(time.time())
+        stale = [(now, row[0]) for row in rows if now - int(row[6] or 0) > TOUCH_INTERVAL_SEC]
+        if not stale:
+            return
+        try:
+            with conn:
+                conn.executemany("UPDATE entries SET accessed_at = ? WHERE key_hash = ?", stale)
+        except sqlite3.Error:
+            pass
+
+    def get(self, key: str) -> Optional[Entry]:
+        try:
+            conn = self._conn()
+            row = conn.execute(f"{self._SELECT} WHERE key_hash = ?", (key_hash(key),)).fetchone()
+            if not row:
+                return None
+            self._touch(conn, [row])
+            return self._entry(row)[1]
+        except (sqlite3.Error, ValueError):
+            return None
+
+    def get_many(self, keys: List[str]) -> Dict[str, Entry]:
+        by_hash = {key_hash(k): k for k in keys}
+        out: Dict[str, Entry] = {}
+        hashes = list(by_hash)
+        try:
+            conn = self._conn()
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i : i + 500]
+                marks = ",".join("?" for _ in chunk)
+                rows = conn.execute(f"{self._SELECT} WHERE key_hash IN ({marks})", chunk).fetchall()
+                self._touch(conn, rows)
+                for row in rows:
+                    hashed, entry = self._entry(row)
+                    out[by_hash[hashed]] = entry
+        except (sqlite3.Error, ValueError):
+            pass
+        return out
+
+    def get_hashed(self, hashed: str) -> Optional[Entry]:
+        try:
+            row = self._conn().execute(f"{self._SELECT} WHERE key_hash = ?", (hashed,)).fetchone()
+            return self._entry(row)[1] if row else None
+        except (sqlite3.Error, ValueError):
+            return None
+
+    def put_hashed(self, hashed: str, entry: Entry) -> bool:
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute(self._UPSERT, self._row(hashed, entry))
+            return True
+        except (sqlite3.Error, TypeError, ValueError):
+            return False
+
+    def set(self, key: str, entry: Entry) -> bool:
+        return self.put_hashed(key_hash(key), entry)
+
+    def set_many(self, items: Dict[str, Entry]) -> int:
+        return self.put_many_hashed((key_hash(k), e) for k, e in items.items())
+
+    def put_many_hashed(self, rows: Iterable[Tuple[str, Entry]]) -> int:
+        try:
+            conn = self._conn()
+            with conn:
+                cur = conn.executemany(self._UPSERT, (self._row(h, e) for h, e in rows))
+            return max(0, cur.rowcount)
+        except (sqlite3.Error, TypeError, ValueError):
+            return 0
+
+    def delete(self, key: str) -> bool:
+        try:
+            conn = self._conn()
+            with conn:
+                cur = conn.execute("DELETE FROM entries WHERE key_hash = ?", (key_hash(key),))
+            return cur.rowcount > 0
+        except sqlite3.Error:
+            return False
+
+    def clear(self) -> int:
+        try:
+            conn = self._conn()
+            with conn:
+                cur = conn.execute("DELETE FROM entries")
+            return max(0, cur.rowcount)
+        except sqlite3.Error:
+            return 0
+
+    def iter_entries(self) -> Iterator[Tuple[str, Entry]]:
+        for row in self._conn().execute(self._SELECT):
+            yield self._entry(row)
+
+    def scan(self) -> Iterator[Meta]:
+        for hashed, namespace, size, accessed_at, exp in self._conn().execute(
+            "SELECT key_hash, namespace, size, accessed_at, expires_at FROM entries"
+        ):
+            yield {
+                "hash": hashed,
+                "namespace": namespace,
+                "size": int(size),
+                "accessed_at": int(accessed_at),
+                "expires_at": int(exp),
+            }
+
+    def remove_hashed(self, hashes: List[str]) -> int:
+        count = 0
+        conn = self._conn()
+        for i in range(0, len(hashes), self._DELETE_CHUNK):
+            chunk = hashes[i : i + self._DELETE_CHUNK]
+            marks = ",".join("?" for _ in chunk)
+            try:
+                with conn:
+                    count += conn.execute(f"DELETE FROM entries WHERE key_hash IN ({marks})", chunk).rowcount
+            except sqlite3.Error:
+                pass
+        return count
+
+    def purge_expired(self, now: int) -> int:
+        # 分段刪除，每段一個短 transaction，不長時間佔住寫鎖
+        count = 0
+        conn = self._conn()
+        while True:
+            try:
+                with conn:
+                    deleted = conn.execute(
+                        "DELETE FROM entries WHERE key_hash IN (SELECT key_hash FROM entries "
+                        "WHERE expires_at > 0 AND expires_at <= ? LIMIT ?)",
+                        (int(now), self._DELETE_CHUNK),
+                    ).rowcount
+            except sqlite3.Error:
+                break
+            count += deleted
+            if deleted < self._DELETE_CHUNK:
+                break
+        return count
+
+    def evict_to(self, max_bytes: int) -> int:
+        conn = self._conn()
+        total = int(conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0])
+        count = 0
+        while total > max_bytes:
+            rows = conn.execute(
+                "SELECT key_hash, size FROM entries ORDER BY accessed_at LIMIT ?", (self._DELETE_CHUNK,)
+            ).fetchall()
+            if not rows:
+                break
+            victims = []
+            for hashed, size in rows:
+                if total <= max_bytes:
+                    break
+                victims.append(hashed)
+                total -= int(size)
+            count += self.remove_hashed(victims)
+        return count
+
+    def usage(self, now: int) -> Dict[str, Dict[str, int]]:
+        out: Dict[str, Dict[str, int]] = {}
+        for namespace, entries, size, expired in self._conn().execute(
+            "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0), "
+            "SUM(CASE WHEN expires_at > 0 AND expires_at <= ? THEN 1 ELSE 0 END) "
+            "FROM entries GROUP BY namespace",
+            (int(now),),
+        ):
+            out[namespace] = {"entries": int(entries), "bytes": int(size), "expired": int(expired or 0)}
+        return out
+
+
+_T = TypeVar("_T")
+
+
+class RedisBackend(CacheBackend):
+    name = "redis"
+
+    _CHUNK = 500
+
+    def __init__(
+        self,
+        url: str,
+        fallback: CacheBackend,
+        prefix: str = "askllm:cache:",
+        retry_sec: float = 30.0,
+        client: Optional[resp_client.Client] = None,
+    ):
+        self.url = url
+        self.fallback = fallback
+        self.prefix = prefix
+        self.retry_sec = retry_sec
+        self.client = client or resp_client.Client(url)
+        self._down_until = 0.0
+
+    def _rkey(self, hashed: str) -> str:
+        return f"{self.prefix}{hashed}"
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _shared(self, op: Callable[[], _T], fallback_op: Callable[[], _T]) -> _T:
+        """先走共用層；連線失敗時標記 RETRY 秒內不再嘗試，改走本機備援。"""
+        if self.available:
+            try:
+                return op()
+            except resp_client.RespConnectionError:
+                self._down_until = time.monotonic() + self.retry_sec
+            except resp_client.RespPoolExhausted:
+                pass  # 本行程同時請求過多：只有這次走備援，共用層照常使用
+            except resp_client.RespError:
+                pass  # 伺服器拒絕（例如 OOM）：這次改用備援，不視為斷線
+        return fallback_op()
+
+    @staticmethod
+    def _decode(blob: Optional[bytes]) -> Optional[Entry]:
+        return cache_codec.decode_entry(blob) if blob else None
+
+    @staticmethod
+    def _set_command(rkey: str, entry: Entry) -> Optional[Tuple[Any, ...]]:
+        exp = expires_at(entry)
+        data = cache_codec.encode_entry(entry)
+        if not exp:
+            return ("SET", rkey, data)
+        remaining = exp - int(time.time())
+        return ("SET", rkey, data, "EX", remaining) if remaining > 0 else None
+
+    def get_hashed(self, hashed: str) -> Optional[Entry]:
+        def _op() -> Optional[Entry]:
+            entry = self._decode(self.client.execute("GET", self._rkey(hashed)))
+            return entry if entry is not None else self.fallback.get_hashed(hashed)
+
+        return self._shared(_op, lambda: self.fallback.get_hashed(hashed))
+
+    def get(self, key: str) -> Optional[Entry]:
+        def _op() -> Optional[Entry]:
+            entry = self._decode(self.client.execute("GET", self._rkey(key_hash(key))))
+            return entry if entry is not None else self.fallback.get(key)
+
+        return self._shared(_op, lambda: self.fallback.get(key))
+
+    def get_many(self, keys: List[str]) -> Dict[str, Entry]:
+        def _op() -> Dict[str, Entry]:
+            out: Dict[str, Entry] = {}
+            for i in range(0, len(keys), self._CHUNK):
+                chunk = keys[i : i + self._CHUNK]
+                blobs = self.client.execute("MGET", *(self._rkey(key_hash(k)) for k in chunk))
+                for key, blob in zip(chunk, blobs or []):
+                    entry = self._decode(blob)
+                    if entry is not None:
+                        out[key] = entry
+            missing = [k for k in keys if k not in out]
+            if missing:
+                out.update(self.fallback.get_many(missing))
+            return out
+
+        return self._shared(_op, lambda: self.fallback.get_many(keys))
+
+    def put_many_hashed(self, rows: Iterable[Tuple[str, Entry]]) -> int:
+        rows = list(rows)
+
+        def _op() -> int:
+            count = 0
+            for i in range(0, len(rows), self._CHUNK):
+                commands = [self._set_command(self._rkey(h), e) for h, e in rows[i : i + self._CHUNK]]
+                commands = [c for c in commands if c is not None]
+                count += len(self.client.pipeline(commands))
+            return count
+
+        return self._shared(_op, lambda: self.fallback.put_many_hashed(rows))
+
+    def put_hashed(self, hashed: str, entry: Entry) -> bool:
+        return self.put_many_hashed([(hashed, entry)]) > 0
+
+    def set(self, key: str, entry: Entry) -> bool:
+        return self.put_hashed(key_hash(key), entry)
+
+    def set_many(self, items: Dict[str, Entry]) -> int:
+        return self.put_many_hashed((key_hash(k), e) for k, e in items.items())
+
+    def remove_hashed(self, hashes: List[str]) -> int:
+        local = self.fallback.remove_hashed(hashes)
+
+        def _op() -> int:
+            count = 0
+            for i in range(0, len(hashes), self._CHUNK):
+                count += int(self.client.execute("DEL", *(self._rkey(h) for h in hashes[i : i + self._CHUNK])))
+            return max(count, local)
+
+        return self._shared(_op, lambda: local) if hashes else 0
+
+    def delete(self, key: str) -> bool:
+        return self.remove_hashed([key_hash(key)]) > 0
+
+    def _scan_keys(self) -> Iterator[List[bytes]]:
+        cursor = b"0"
+        while True:
+            cursor, keys = self.client.execute("SCAN", cursor, "MATCH", f"{self.prefix}*", "COUNT", self._CHUNK)
+            if keys:
+                yield keys
+            if cursor in (b"0", 0, "0"):
+                return
+
+    def clear(self) -> int:
+        count = self.fallback.clear()
+
+        def _op() -> int:
+            removed = 0
+            for keys in self._scan_keys():
+                removed += int(self.client.execute("DEL", *keys))
+            return removed
+
+        return count + self._shared(_op, lambda: 0)
+
+    # 以下為管理用途（搬移 / 快照 / stats）：直接對共用層操作，連不上就拋出，不默默改用備援
+    def iter_entries(self) -> Iterator[Tuple[str, Entry]]:
+        skip = len(self.prefix)
+        for keys in self._scan_keys():
+            for rkey, blob in zip(keys, self.client.execute("MGET", *keys)):
+                entry = self._decode(blob)
+                if entry is not None:
+                    yield rkey.decode("utf-8")[skip:], entry
+
+    def scan(self) -> Iterator[Meta]:
+        skip = len(self.prefix)
+        for keys in self._scan_keys():
+            commands = []
+            for rkey in keys:
+                commands.append(("GETRANGE", rkey, 0, _HEAD_BYTES - 1))
+                commands.append(("STRLEN", rkey))
+            replies = self.client.pipeline(commands)
+            for i, rkey in enumerate(keys):
+                head, size = replies[2 * i], replies[2 * i + 1]
+                header = cache_codec.parse_header(head or b"")
+                if header is None:
+                    continue
+                yield {
+                    "hash": rkey.decode("utf-8")[skip:],
+                    "namespace": header.get("namespace") or LEGACY_NAMESPACE,
+                    "size": int(size or 0),
+                    "accessed_at": 0,
+                    "expires_at": expires_at(header),
+                }
+
+    def purge_expired(self, now: int) -> int:
+        # 共用層由伺服器依 EX 自動過期；只需清本機備援
+        return self.fallback.purge_expired(now)
+
+    def evict_to(self, max_bytes: int) -> int:
+        # 共用層的容量交給伺服器的 maxmemory 政策；MAX_BYTES 只約束本機備援
+        return self.fallback.evict_to(max_bytes)
+
+
+def create(
+    name: str,
+    cache_dir: str,
+    db_path: Optional[str] = None,
+    redis_url: Optional[str] = None,
+    redis_retry_sec: float = 30.0,
+) -> CacheBackend:
+    name = (name or "file").strip().lower()
+    if name == "sqlite":
+        return SQLiteBackend(db_path or os.path.join(cache_dir, "cache.sqlite3"))
+    if name == "file":
+        return FileBackend(cache_dir)
+    if name == "redis":
+        return RedisBackend(redis_url or "redis://127.0.0.1:6379/0", FileBackend(cache_dir), retry_sec=redis_retry_sec)
+    raise ValueError(f"未知的快取後端: {name}（可用：file, sqlite, redis）")
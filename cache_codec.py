@@ -0,0 +1,138 @@
+"""
+快取 value 的二進位編碼：compact JSON，超過門檻再以 zlib 壓縮。
+
+file 後端的檔案格式（副檔名仍為 .json，舊檔照常讀取）：
+
+  ASKC1\\n
+  {"created_at": ..., "ttl_sec": ..., "namespace": ..., "enc": "zlib", "n": 原始長度, "key": ...}\\n
+  <value 位元組：enc=json 為 UTF-8 compact JSON，enc=zlib 為其 zlib 壓縮>
+
+metadata 一行不壓縮，sweeper / stats 讀檔頭即可；沒有 magic 的檔案視為舊版 indent JSON。
+sqlite 後端把同樣的 (enc, 位元組) 存在 enc / value 欄位。
+
+讀取時 value 先包成 LazyValue，TTL 判斷、搬移、快照都不必解壓；
+真正取值（cache_utils.get）時才解壓並回寫到 entry，L1 之後的命中不再解壓。
+
+環境變數：
+  ASKLLM_CACHE_COMPRESS_MIN_BYTES  超過此長度才壓縮（預設 1024；0 表示一律壓縮）
+  ASKLLM_CACHE_COMPRESS_LEVEL      zlib 壓縮等級（預設 6）
+"""
+
+import json
+import os
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+MAGIC = b"ASKC1\n"
+COMPRESS_MIN_BYTES = int(os.environ.get("ASKLLM_CACHE_COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.environ.get("ASKLLM_CACHE_COMPRESS_LEVEL", "6"))
+
+ENC_JSON = "json"
+ENC_ZLIB = "zlib"
+
+# file 後端檔頭的 metadata 欄位（key 放最後：可能很長，其餘欄位一定落在檔頭內）
+HEADER_FIELDS = ("created_at", "ttl_sec", "namespace")
+
+
+class LazyValue:
+    """尚未解碼的 value；load() 只解一次。"""
+
+    __slots__ = ("enc", "blob", "size", "_value", "_loaded")
+
+    def __init__(self, enc: str, blob: bytes, size: Optional[int] = None):
+        self.enc = enc
+        self.blob = blob
+        self.size = int(size) if size else len(blob)
+        self._value: Any = None
+        self._loaded = False
+
+    def load(self) -> Any:
+        if not self._loaded:
+            blob = self.blob
+            if self.enc == ENC_ZLIB:
+                blob = zlib.decompress(blob)
+                self.size = len(blob)
+            self._value = decode_value(ENC_JSON if self.enc == ENC_ZLIB else self.enc, blob)
+            self._loaded = True
+        return self._value
+
+
+def encode_value(value: Any, min_bytes: Optional[int] = None) -> Tuple[str, bytes, int]:
+    """
+    value -> (enc, 位元組, 未壓縮長度)；LazyValue 直接沿用原位元組，不重新編碼。
+
+    min_bytes 覆寫壓縮門檻（快照用較低門檻）；有給時未壓縮的 LazyValue 若超過門檻也會壓縮。
+    """
+    limit = COMPRESS_MIN_BYTES if min_bytes is None else min_bytes
+    if isinstance(value, LazyValue):
+        if min_bytes is None or value.enc != ENC_JSON or len(value.blob) < limit:
+            return value.enc, value.blob, value.size
+        blob = value.blob
+        raw = blob.encode("utf-8") if isinstance(blob, str) else bytes(blob)
+    else:
+        raw = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(raw) >= limit:
+        packed = zlib.compress(raw, COMPRESS_LEVEL)
+        if len(packed) < len(raw):
+            return ENC_ZLIB, packed, len(raw)
+    return ENC_JSON, raw, len(raw)
+
+
+def decode_value(enc: str, blob: Any) -> Any:
+    if enc == ENC_ZLIB:
+        blob = zlib.decompress(blob)
+    elif enc != ENC_JSON:
+        raise ValueError(f"未知的快取編碼: {enc}")
+    if isinstance(blob, (bytes, bytearray, memoryview)):
+        blob = bytes(blob).decode("utf-8")
+    return json.loads(blob)
+
+
+def materialize(entry: Dict[str, Any]) -> Any:
+    """取出 entry 的 value（必要時解壓），並把解碼結果回寫到 entry。"""
+    value = entry.get("value")
+    if isinstance(value, LazyValue):
+        value = value.load()
+        entry["value"] = value
+    return value
+
+
+def encode_entry(entry: Dict[str, Any], min_bytes: Optional[int] = None) -> bytes:
+    enc, blob, size = encode_value(entry.get("value"), min_bytes)
+    header = {name: entry.get(name) for name in HEADER_FIELDS}
+    header.update({"enc": enc, "n": size, "key": entry.get("key")})
+    line = json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return MAGIC + line + b"\n" + blob
+
+
+def parse_header(head: bytes) -> Optional[Dict[str, Any]]:
+    """讀新版檔頭的 metadata 行；不是新版格式或檔頭不完整回傳 None。"""
+    if not head.startswith(MAGIC):
+        return None
+    end = head.find(b"\n", len(MAGIC))
+    if end < 0:
+        return None
+    try:
+        header = json.loads(head[len(MAGIC) : end].decode("utf-8"))
+    except ValueError:
+        return None
+    return header if isinstance(header, dict) else None
+
+
+def decode_entry(data: bytes, lazy: bool = True) -> Optional[Dict[str, Any]]:
+    """file 後端的整份檔案 -> entry；新舊格式皆可，格式錯誤回傳 None。"""
+    if not data.startswith(MAGIC):
+        try:
+            entry = json.loads(data.decode("utf-8"))
+        except ValueError:
+            return None
+        return entry if isinstance(entry, dict) else None
+    end = data.find(b"\n", len(MAGIC))
+    header = parse_header(data[: end + 1]) if end >= 0 else None
+    if header is None:
+        return None
+    value = LazyValue(str(header.get("enc") or ENC_JSON), data[end + 1 :], header.get("n"))
+    entry = {name: header.get(name) for name in HEADER_FIELDS}
+    entry["key"] = header.get("key")
+    entry["value"] = value if lazy else value.load()
+    return entry
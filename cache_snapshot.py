@@ -0,0 +1,182 @@
+"""
+快取快照：把快取（可依 namespace 前綴 / 年齡過濾）匯出成單一檔案，新節點匯入或直接掛成唯讀層，
+不必從空的 .askllm_cache 開始付好幾個小時的冷啟動延遲。
+
+檔案格式（可 mmap；整數皆 little-endian）：
+
+  ASKS1\\n\\0\\0                      8 bytes magic
+  count, index_offset, created_at   struct "<QQQ"
+  records                           每筆即 cache_codec.encode_entry() 的位元組（ASKC1 檔頭 + value），
+                                    value 超過 SNAPSHOT_COMPRESS_MIN_BYTES 一律 zlib 壓縮
+  index                             count 筆 struct "<32sQI"（sha256(key)、record 起點、長度），依 hash 排序
+
+查詢直接在 mmap 上二分搜尋 index，不必把 index 載入記憶體；多個行程 mmap 同一份快照時共用
+page cache（例如唯讀的 PubChem 危害資料），每次命中只複製該筆 record，value 仍是讀到才解壓。
+
+entry 保留原本的 created_at / ttl_sec：到期時間不因匯出或匯入而延長，已過期的 entry 不匯出也不匯入。
+匯入時與既有 entry 比較 created_at，較新者留下（newer-wins）。
+"""
+
+import mmap
+import struct
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import atomic_io
+import cache_backends
+import cache_codec
+
+
+MAGIC = b"ASKS1\n\0\0"
+SNAPSHOT_COMPRESS_MIN_BYTES = 256
+
+_HEADER = struct.Struct("<QQQ")
+_INDEX = struct.Struct("<32sQI")
+_DATA_START = len(MAGIC) + _HEADER.size
+
+Entry = Dict[str, Any]
+
+
+def _matches(entry: Entry, namespaces: Optional[Sequence[str]], min_created: int, now: int) -> bool:
+    exp = cache_backends.expires_at(entry)
+    if exp and exp <= now:
+        return False
+    if min_created and int(entry.get("created_at") or 0) < min_created:
+        return False
+    if namespaces:
+        namespace = str(entry.get("namespace") or cache_backends.LEGACY_NAMESPACE)
+        return any(namespace.startswith(prefix) for prefix in namespaces)
+    return True
+
+
+def _min_created(max_age_sec: Optional[int], now: int) -> int:
+    return now - int(max_age_sec) if max_age_sec else 0
+
+
+def export_snapshot(
+    entries: Iterable[Tuple[str, Entry]],
+    path: str,
+    namespaces: Optional[Sequence[str]] = None,
+    max_age_sec: Optional[int] = None,
+) -> int:
+    """把 (key_hash, entry) 依條件寫成快照檔（暫存檔寫完才取代 path），回傳筆數。"""
+    now = int(time.time())
+    min_created = _min_created(max_age_sec, now)
+    index: List[Tuple[bytes, int, int]] = []
+    seen = set()
+    with atomic_io.open_atomic(path) as f:
+        f.write(MAGIC + _HEADER.pack(0, 0, 0))
+        offset = _DATA_START
+        for hashed, entry in entries:
+            if hashed in seen or not _matches(entry, namespaces, min_created, now):
+                continue
+            seen.add(hashed)
+            record = cache_codec.encode_entry(entry, SNAPSHOT_COMPRESS_MIN_BYTES)
+            f.write(record)
+            index.append((bytes.fromhex(hashed), offset, len(record)))
+            offset += len(record)
+        index.sort()
+        for row in index:
+            f.write(_INDEX.pack(*row))
+        f.seek(len(MAGIC))
+        f.write(_HEADER.pack(len(index), offset, now))
+    return len(index)
+
+
+class Snapshot:
+    """唯讀 mmap 快照；get() / get_hashed() 可多 thread 同時呼叫。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[: len(MAGIC)] != MAGIC or len(self._mm) < _DATA_START:
+            self._mm.close()
+            raise ValueError(f"不是快取快照檔: {path}")
+        self.count, self._index_offset, self.created_at = _HEADER.unpack_from(self._mm, len(MAGIC))
+        if self._index_offset + self.count * _INDEX.size > len(self._mm):
+            self._mm.close()
+            raise ValueError(f"快照檔不完整: {path}")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _row(self, i: int) -> Tuple[bytes, int, int]:
+        return _INDEX.unpack_from(self._mm, self._index_offset + i * _INDEX.size)
+
+    def _record(self, offset: int, length: int) -> Optional[Entry]:
+        return cache_codec.decode_entry(self._mm[offset : offset + length])
+
+    def get_hashed(self, hashed: str) -> Optional[Entry]:
+        target = bytes.fromhex(hashed)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            digest, offset, length = self._row(mid)
+            if digest < target:
+                lo = mid + 1
+            elif digest > target:
+                hi = mid
+            else:
+                return self._record(offset, length)
+        return None
+
+    def get(self, key: str) -> Optional[Entry]:
+        return self.get_hashed(cache_backends.key_hash(key))
+
+    def iter_entries(self) -> Iterator[Tuple[str, Entry]]:
+        for i in range(self.count):
+            digest, offset, length = self._row(i)
+            entry = self._record(offset, length)
+            if entry is not None:
+                yield digest.hex(), entry
+
+    def usage(self, now: int) -> Dict[str, Dict[str, int]]:
+        out: Dict[str, Dict[str, int]] = {}
+        for i in range(self.count):
+            _, offset, length = self._row(i)
+            header = cache_codec.parse_header(self._mm[offset : offset + length])
+            if header is None:
+                continue
+            row = out.setdefault(header.get("namespace") or cache_backends.LEGACY_NAMESPACE, {"entries": 0, "bytes": 0, "expired": 0})
+            row["entries"] += 1
+            row["bytes"] += length
+            exp = cache_backends.expires_at(header)
+            if exp and exp <= now:
+                row["expired"] += 1
+        return out
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+def import_snapshot(
+    snapshot: Snapshot,
+    backend: cache_backends.CacheBackend,
+    namespaces: Optional[Sequence[str]] = None,
+    max_age_sec: Optional[int] = None,
+    batch_size: int = 1000,
+) -> Dict[str, int]:
+    """
+    把快照併入 backend：只寫入既有快取沒有、或比既有 entry 新的 entry（newer-wins）。
+    回傳 {"imported", "kept_existing", "filtered"}。
+    """
+    now = int(time.time())
+    min_created = _min_created(max_age_sec, now)
+    stats = {"imported": 0, "kept_existing": 0, "filtered": 0}
+    batch: List[Tuple[str, Entry]] = []
+    for hashed, entry in snapshot.iter_entries():
+        if not _matches(entry, namespaces, min_created, now):
+            stats["filtered"] += 1
+            continue
+        current = backend.get_hashed(hashed)
+        if current is not None and int(current.get("created_at") or 0) >= int(entry.get("created_at") or 0):
+            stats["kept_existing"] += 1
+            continue
+        batch.append((hashed, entry))
+        if len(batch) >= batch_size:
+            stats["imported"] += backend.put_many_hashed(batch)
+            batch = []
+    if batch:
+        stats["imported"] += backend.put_many_hashed(batch)
+    return stats
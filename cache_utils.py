@@ -1,17 +1,74 @@
 """
 簡單磁碟快取（避免重複打 PubChem / AskCOS / 工具摘要）。
 
+儲存後端見 cache_backends.py（file：每 key 一個檔；sqlite：單一 WAL 資料庫）；
+value 以 compact JSON 存放、較大者 zlib 壓縮（cache_codec.py），讀到且未過期才解壓。
+
 環境變數：
   ASKLLM_CACHE_DIR          快取目錄（預設：<repo>/.askllm_cache）
   ASKLLM_CACHE_DISABLE=1    關閉快取
-  ASKLLM_CACHE_TTL_SEC      預設 TTL（秒，預設 86400）
+  ASKLLM_CACHE_TTL_SEC      預設 TTL（秒，預設 86400；未列在 TTL 政策表的 namespace 使用）
+  ASKLLM_CACHE_TTL_POLICY   TTL 政策覆寫：JSON 字串或 JSON 檔路徑，
+                            例如 {"pubchem:": {"success": 2592000, "transient_error": 120}}
+  ASKLLM_CACHE_SWR=0        關閉 stale-while-revalidate
+  ASKLLM_CACHE_SWR_POLICY   SWR soft TTL 覆寫：JSON 字串或檔案路徑，{"namespace 前綴": 秒數}（0 表示該前綴不用 SWR）
+  ASKLLM_CACHE_SWR_MAX_INFLIGHT  同時進行的背景刷新上限（預設 4；超過時該次不刷新，下次讀取再試）
+  ASKLLM_CACHE_BACKEND      file（預設）/ sqlite / redis
+  ASKLLM_CACHE_DB           sqlite 後端的資料庫路徑（預設：<cache dir>/cache.sqlite3）
+  ASKLLM_CACHE_REDIS_URL    redis 後端位址（預設 redis://127.0.0.1:6379/0；可含 :password@ 與 /db）
+  ASKLLM_CACHE_REDIS_RETRY_SEC  共用層連不上時改用本機 file 備援，多久後再試（預設 30）
+  ASKLLM_CACHE_L1_MAX_BYTES 行程內 L1 LRU 的容量（位元組，預設 32 MiB；0 關閉）
+  ASKLLM_CACHE_L1_TTL_SEC   L1 條目最長保留秒數（預設 300；限制其他行程 / 節點更新或刪除後的落差）
+  ASKLLM_CACHE_STATS=1      啟用 L1 命中/未命中計數（亦可呼叫 enable_stats()）
+  ASKLLM_CACHE_MAX_BYTES    快取總容量上限（位元組，0 表示不限；超過時依最後存取時間淘汰）
+  ASKLLM_CACHE_SWEEP_INTERVAL_SEC  背景 sweeper 週期（預設 600；0 關閉）
+  ASKLLM_CACHE_COMPRESS_MIN_BYTES  value 超過此長度才壓縮（預設 1024）
+  ASKLLM_CACHE_SNAPSHOT     唯讀快照層：快照檔路徑（多個以 os.pathsep 分隔，依序查）；
+                            後端未命中時才查，命中只進 L1、不寫回後端
+
+TTL 政策：依 namespace 前綴（最長者優先）與寫入結果（outcome）決定 TTL，寫入時記在 entry 上，
+讀取時依各自記錄的 TTL 判斷過期。outcome：
+  success          正常結果
+  empty            呼叫成功但沒有結果（例如查無前體）
+  not_found        外部服務明確回報不存在（PubChem 404 / 無 CID）
+  transient_error  逾時、連線失敗、5xx；只短暫快取，擋住重試風暴又不會把故障記上一整天
+
+Stale-while-revalidate（get_or_revalidate，逐 namespace 開啟）：entry 年齡超過 soft TTL 時
+仍立即回傳舊值，並在背景呼叫 revalidate() 更新；超過 hard TTL（entry 的 TTL）才視為未命中、
+由呼叫端同步重算。背景刷新若只得到 transient_error，不覆蓋仍有效的舊值。
+
+快照（cache_snapshot.py）：export 把後端 entry 依 namespace 前綴 / 年齡寫成單一 mmap 檔，
+import 以 newer-wins 併入後端；也可不匯入，直接以 ASKLLM_CACHE_SNAPSHOT 掛成唯讀層（多行程共用 page cache）。
+
+背景 sweeper 在第一次 set() 時啟動（daemon thread），每輪批次刪除已過期 entry，
+若設定了 MAX_BYTES 則把總量壓到 90% 以下；多行程時以 <cache dir>/.sweep.lock 確保同時只有一個在跑。
+
+CLI：
+  python cache_utils.py migrate --from file --to sqlite   把既有快取搬到另一個後端
+  python cache_utils.py stats                              各 namespace 佔用空間
+  python cache_utils.py sweep                              立即執行一輪清理
+  python cache_utils.py policy                             目前生效的 TTL 政策表
+  python cache_utils.py export snap.askc [--namespace pubchem: ...] [--max-age-sec N]   匯出快照
+  python cache_utils.py import snap.askc [--namespace ...] [--max-age-sec N]            併入快照（newer-wins）
 """
 
-import hashlib
+import argparse
 import json
 import os
+import threading
 import time
-from typing import Any, Optional
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+import atomic_io
+import cache_backends
+import cache_codec
+import cache_snapshot
 
 
 CACHE_DIR = os.environ.get(
@@ -20,98 +77,641 @@ CACHE_DIR = os.environ.get(
 )
 DISABLE = os.environ.get("ASKLLM_CACHE_DISABLE", "0") == "1"
 DEFAULT_TTL_SEC = int(os.environ.get("ASKLLM_CACHE_TTL_SEC", "86400"))
+BACKEND_NAME = os.environ.get("ASKLLM_CACHE_BACKEND", "file")
+DB_PATH = os.environ.get("ASKLLM_CACHE_DB") or None
+REDIS_URL = os.environ.get("ASKLLM_CACHE_REDIS_URL", "redis://127.0.0.1:6379/0")
+REDIS_RETRY_SEC = float(os.environ.get("ASKLLM_CACHE_REDIS_RETRY_SEC", "30"))
+SNAPSHOT_PATHS = [p.strip() for p in os.environ.get("ASKLLM_CACHE_SNAPSHOT", "").split(os.pathsep) if p.strip()]
+L1_MAX_BYTES = int(os.environ.get("ASKLLM_CACHE_L1_MAX_BYTES", str(32 * 1024 * 1024)))
+L1_TTL_SEC = int(os.environ.get("ASKLLM_CACHE_L1_TTL_SEC", "300"))
+MAX_BYTES = int(os.environ.get("ASKLLM_CACHE_MAX_BYTES", "0"))
+SWEEP_INTERVAL_SEC = float(os.environ.get("ASKLLM_CACHE_SWEEP_INTERVAL_SEC", "600"))
+SINGLEFLIGHT_LOCK_DIR = os.path.join(CACHE_DIR, "singleflight")
+# singleflight 鎖檔閒置超過此秒數（且沒人持有）時由 sweep() 刪除
+SINGLEFLIGHT_LOCK_IDLE_SEC = 3600
+OUTCOME_SUCCESS = "success"
+OUTCOME_EMPTY = "empty"
+OUTCOME_NOT_FOUND = "not_found"
+OUTCOME_TRANSIENT_ERROR = "transient_error"
 
+_DAY = 86400
+# namespace 前綴 -> 各 outcome 的 TTL（秒；0 表示不過期）；未列出的 outcome 沿用同一前綴的 success
+_DEFAULT_TTL_POLICY: Dict[str, Dict[str, int]] = {
+    "": {
+        OUTCOME_SUCCESS: DEFAULT_TTL_SEC,
+        OUTCOME_EMPTY: DEFAULT_TTL_SEC,
+        OUTCOME_NOT_FOUND: DEFAULT_TTL_SEC,
+        OUTCOME_TRANSIENT_ERROR: 60,
+    },
+    # PubChem 資料幾乎不變；暫時性錯誤稍長一點，配合其限流
+    "pubchem:": {
+        OUTCOME_SUCCESS: 30 * _DAY,
+        OUTCOME_EMPTY: 7 * _DAY,
+        OUTCOME_NOT_FOUND: 7 * _DAY,
+        OUTCOME_TRANSIENT_ERROR: 300,
+    },
+    # 單步模型輸出在模型不換版時固定
+    "askcos:": {
+        OUTCOME_SUCCESS: 7 * _DAY,
+        OUTCOME_EMPTY: _DAY,
+        OUTCOME_NOT_FOUND: _DAY,
+        OUTCOME_TRANSIENT_ERROR: 60,
+    },
+    # tree search / 多步 / 路線推薦受 buyables 與模板更新影響，維持一天
+    "askcos:tree_search:": {OUTCOME_SUCCESS: _DAY, OUTCOME_EMPTY: 6 * 3600, OUTCOME_TRANSIENT_ERROR: 60},
+    "askcos:multistep:": {OUTCOME_SUCCESS: _DAY, OUTCOME_EMPTY: 6 * 3600, OUTCOME_TRANSIENT_ERROR: 60},
+    "askcos:route_reco:": {OUTCOME_SUCCESS: _DAY, OUTCOME_EMPTY: 6 * 3600, OUTCOME_TRANSIENT_ERROR: 60},
+    "tool_summary:": {OUTCOME_SUCCESS: 7 * _DAY, OUTCOME_TRANSIENT_ERROR: 300},
+}
 
-def _ensure_dir() -> str:
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    return CACHE_DIR
 
+# 逐 namespace 開啟的 stale-while-revalidate：前綴 -> soft TTL（秒）。
+# 只放變動很慢的外部資料；hard TTL 仍是上表的 TTL
+_DEFAULT_SWR_POLICY: Dict[str, int] = {
+    "pubchem:hazard_assess:": 7 * _DAY,
+    "pubchem:hazard_record:": 7 * _DAY,
+    "pubchem:smiles_from_name:": 7 * _DAY,
+    "pubchem:cid:": 7 * _DAY,
+    "askcos:retro:raw:": _DAY,
+    "askcos:forward:raw:": _DAY,
+    "askcos:condition:": _DAY,
+    "askcos:quarc:": _DAY,
+    "askcos:impurity:": _DAY,
+}
+SWR_ENABLED = os.environ.get("ASKLLM_CACHE_SWR", "1") == "1"
+SWR_MAX_INFLIGHT = int(os.environ.get("ASKLLM_CACHE_SWR_MAX_INFLIGHT", "4"))
+
+
+def _policy_override(env_name: str) -> Dict[str, Any]:
+    """讀 JSON 字串或 JSON 檔路徑形式的政策覆寫；未設定或格式錯誤回傳空 dict。"""
+    raw = os.environ.get(env_name, "").strip()
+    if not raw:
+        return {}
+    try:
+        if not raw.startswith("{"):
+            with open(raw, "r", encoding="utf-8") as f:
+                raw = f.read()
+        override = json.loads(raw)
+    except (OSError, ValueError):
+        return {}
+    return override if isinstance(override, dict) else {}
+
+
+def _load_ttl_policy() -> Dict[str, Dict[str, int]]:
+    policy = {prefix: dict(row) for prefix, row in _DEFAULT_TTL_POLICY.items()}
+    for prefix, row in _policy_override("ASKLLM_CACHE_TTL_POLICY").items():
+        if isinstance(row, dict):
+            policy.setdefault(str(prefix), {}).update({str(k): int(v) for k, v in row.items()})
+    return policy
+
+
+def _load_swr_policy() -> Dict[str, int]:
+    policy = dict(_DEFAULT_SWR_POLICY)
+    for prefix, soft in _policy_override("ASKLLM_CACHE_SWR_POLICY").items():
+        try:
+            policy[str(prefix)] = int(soft)
+        except (TypeError, ValueError):
+            continue
+    return policy
+
+
+TTL_POLICY = _load_ttl_policy()
+SWR_POLICY = _load_swr_policy()
+
+# 超過容量時一次淘汰到這個比例，避免每輪都只刪一點點
+_EVICT_LOW_WATERMARK = 0.9
+
+_backend = cache_backends.create(BACKEND_NAME, CACHE_DIR, DB_PATH, REDIS_URL, REDIS_RETRY_SEC)
+
+
+def _copy_json(value: Any) -> Any:
+    """快取值都是 JSON 形狀；只複製 dict/list，避免呼叫端改到 L1 內的物件（比 deepcopy 快）。"""
+    if isinstance(value, dict):
+        return {k: _copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(v) for v in value]
+    return value
+
+
+def _approx_size(value: Any) -> int:
+    try:
+        return len(json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str))
+    except (TypeError, ValueError):
+        return 1024
+
+
+class _L1Cache:
+    """以位元組計容量的 LRU；條目保存 backend entry 與載入時間，thread-safe。"""
+
+    def __init__(self, max_bytes: int, max_age_sec: int):
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_age_sec = max(0, int(max_age_sec))
+        self._items: "OrderedDict[str, Tuple[Dict[str, Any], int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.stats_enabled = os.environ.get("ASKLLM_CACHE_STATS", "0") == "1"
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _count(self, name: str) -> None:
+        if self.stats_enabled:
+            self._stats[name] += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.max_bytes <= 0:
+            return None
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self._count("misses")
+                return None
+            entry, size, loaded_at = item
+            if self.max_age_sec and time.monotonic() - loaded_at > self.max_age_sec:
+                self._drop_locked(key)
+                self._count("misses")
+                return None
+            self._items.move_to_end(key)
+            self._count("hits")
+            return entry
 
-def _normalize_key(key: str) -> str:
-    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+    def put(self, key: str, entry: Dict[str, Any], value_size: Optional[int] = None) -> None:
+        if self.max_bytes <= 0:
+            return
+        size = (value_size if value_size is not None else _approx_size(entry.get("value"))) + len(key)
+        if size > self.max_bytes // 4:
+            # 單筆過大（例如整棵 tree）不佔 L1，避免把其他熱 key 擠掉
+            self.pop(key)
+            return
+        with self._lock:
+            self._drop_locked(key)
+            self._items[key] = (entry, size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._items:
+                old_key = next(iter(self._items))
+                self._drop_locked(old_key)
+                self._count("evictions")
 
+    def _drop_locked(self, key: str) -> None:
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._bytes -= item[1]
 
-def _cache_path(key: str) -> str:
-    return os.path.join(_ensure_dir(), f"{_normalize_key(key)}.json")
+    def pop(self, key: str) -> None:
+        with self._lock:
+            self._drop_locked(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self._stats)
+            out.update(
+                {
+                    "enabled": self.stats_enabled,
+                    "entries": len(self._items),
+                    "bytes": self._bytes,
+                    "max_bytes": self.max_bytes,
+                }
+            )
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+        return out
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+
+_l1 = _L1Cache(L1_MAX_BYTES, L1_TTL_SEC)
+
+_snapshots_lock = threading.Lock()
+_snapshots: Optional[List[cache_snapshot.Snapshot]] = None
+
+
+def _snapshot_tier() -> List[cache_snapshot.Snapshot]:
+    """ASKLLM_CACHE_SNAPSHOT 指定的唯讀快照（第一次查詢時 mmap；打不開的檔案略過）。"""
+    global _snapshots
+    if _snapshots is None:
+        with _snapshots_lock:
+            if _snapshots is None:
+                opened = []
+                for path in SNAPSHOT_PATHS:
+                    try:
+                        opened.append(cache_snapshot.Snapshot(path))
+                    except (OSError, ValueError):
+                        pass
+                _snapshots = opened
+    return _snapshots
+
+
+def _snapshot_get(key: str) -> Optional[Dict[str, Any]]:
+    for snapshot in _snapshot_tier():
+        entry = snapshot.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+def enable_stats(enabled: bool = True) -> None:
+    _l1.stats_enabled = bool(enabled)
+
+
+def l1_stats(reset: bool = False) -> Dict[str, Any]:
+    """L1 命中統計（hits/misses/evictions/hit_rate 與目前容量）。"""
+    out = _l1.snapshot()
+    if reset:
+        _l1.reset_stats()
+    return out
 
 
 def _utc_now() -> int:
     return int(time.time())
 
 
+def namespace_of(key: str) -> str:
+    """build_key 產生的 key 形如 '<namespace>:{json}'；取出 namespace。"""
+    idx = key.find(":{")
+    return key[:idx] if idx >= 0 else key
+
+
+def ttl_for(key: str, outcome: str = OUTCOME_SUCCESS) -> int:
+    """依 TTL 政策表取 key 的 TTL：最長符合的 namespace 前綴，該前綴沒列此 outcome 時用其 success。"""
+    namespace = namespace_of(key)
+    for prefix in sorted(TTL_POLICY, key=len, reverse=True):
+        if namespace.startswith(prefix):
+            row = TTL_POLICY[prefix]
+            if outcome in row:
+                return int(row[outcome])
+            if OUTCOME_SUCCESS in row:
+                return int(row[OUTCOME_SUCCESS])
+    return DEFAULT_TTL_SEC
+
+
+def soft_ttl_for(key: str) -> int:
+    """key 的 SWR soft TTL（最長符合前綴）；0 表示此 namespace 未開啟 SWR。"""
+    if not SWR_ENABLED:
+        return 0
+    namespace = namespace_of(key)
+    for prefix in sorted(SWR_POLICY, key=len, reverse=True):
+        if namespace.startswith(prefix):
+            return max(0, int(SWR_POLICY[prefix]))
+    return 0
+
+
+def _entry_ttl(entry: Dict[str, Any], ttl_sec: Optional[int]) -> int:
+    """讀取時的 TTL：呼叫端指定者優先，否則用寫入時記錄的 TTL。"""
+    if ttl_sec is not None:
+        return int(ttl_sec)
+    return int(entry.get("ttl_sec", DEFAULT_TTL_SEC) or 0)
+
+
+def _is_expired(entry: Dict[str, Any], ttl: int, now: int) -> bool:
+    created_at = int(entry.get("created_at", 0))
+    return bool(ttl > 0 and created_at and (now - created_at) > ttl)
+
+
+def _load_value(key: str, entry: Dict[str, Any], from_l1: bool) -> Any:
+    """解開 entry 的 value（必要時解壓）並放進 L1；資料損毀時刪除並視為未命中。"""
+    lazy = entry.get("value")
+    try:
+        value = cache_codec.materialize(entry)
+    except Exception:
+        _l1.pop(key)
+        _backend.delete(key)
+        return None
+    if not from_l1:
+        size = lazy.size if isinstance(lazy, cache_codec.LazyValue) else None
+        _l1.put(key, entry, size)
+    return value
+
+
+def _read(key: str, ttl_sec: Optional[int]) -> Tuple[Optional[Dict[str, Any]], Any]:
+    """回傳 (entry, value)；未命中、已過 hard TTL 或資料損毀時為 (None, None)。"""
+    entry = _l1.get(key)
+    from_l1 = entry is not None
+    if entry is None:
+        entry = _backend.get(key)
+    if entry is None and SNAPSHOT_PATHS:
+        entry = _snapshot_get(key)
+    if entry is None:
+        return None, None
+
+    if _is_expired(entry, _entry_ttl(entry, ttl_sec), _utc_now()):
+        _l1.pop(key)
+        _backend.delete(key)
+        return None, None
+
+    value = _load_value(key, entry, from_l1)
+    return (None, None) if value is None else (entry, value)
+
+
 def get(key: str, ttl_sec: Optional[int] = None) -> Any:
+    """ttl_sec 不給時依 entry 寫入時的 TTL（見 TTL 政策）判斷過期。"""
     if DISABLE:
         return None
+    _, value = _read(key, ttl_sec)
+    return None if value is None else _copy_json(value)
 
-    ttl = DEFAULT_TTL_SEC if ttl_sec is None else int(ttl_sec)
-    path = _cache_path(key)
-    if not os.path.exists(path):
-        return None
 
+_revalidate_lock = threading.Lock()
+_revalidating: Dict[str, threading.Thread] = {}
+# 背景刷新 thread 自己設的旗標；set() 據此判斷寫入是否來自刷新，不看共享的 _revalidating
+_revalidate_ctx = threading.local()
+
+
+def _run_revalidate(key: str, revalidate: Callable[[], Any]) -> None:
+    _revalidate_ctx.active = True
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            payload = json.load(f)
+        revalidate()
     except Exception:
-        return None
+        pass  # 刷新失敗就繼續用舊值，直到 hard TTL
+    finally:
+        _revalidate_ctx.active = False
+        with _revalidate_lock:
+            _revalidating.pop(key, None)
 
-    created_at = int(payload.get("created_at", 0))
-    if ttl > 0 and created_at and (_utc_now() - created_at) > ttl:
-        try:
-            os.remove(path)
-        except OSError:
-            pass
-        return None
 
-    return payload.get("value")
+def _schedule_revalidate(key: str, revalidate: Callable[[], Any]) -> bool:
+    with _revalidate_lock:
+        if key in _revalidating or len(_revalidating) >= SWR_MAX_INFLIGHT:
+            return False
+        thread = threading.Thread(
+            target=_run_revalidate,
+            args=(key, revalidate),
+            name="askllm-cache-revalidate",
+            daemon=True,
+        )
+        _revalidating[key] = thread
+    thread.start()
+    return True
 
 
-def set(key: str, value: Any, ttl_sec: Optional[int] = None) -> bool:
+def get_or_revalidate(key: str, revalidate: Callable[[], Any], ttl_sec: Optional[int] = None) -> Any:
+    """
+    與 get() 相同，但 namespace 開啟 SWR 且 entry 超過 soft TTL 時，回傳舊值並在背景執行
+    revalidate()（由它自行寫回快取；同一 key 同時只刷新一次）。未命中 / 超過 hard TTL 回傳 None。
+    """
     if DISABLE:
-        return False
+        return None
+    entry, value = _read(key, ttl_sec)
+    if value is None:
+        return None
+    soft = soft_ttl_for(key)
+    if soft > 0 and _utc_now() - int(entry.get("created_at") or 0) > soft:
+        _schedule_revalidate(key, revalidate)
+    return _copy_json(value)
+
+
+def get_many(keys: List[str], ttl_sec: Optional[int] = None) -> Dict[str, Any]:
+    """一次查多個 key，只回傳命中者 {key: value}（sqlite 後端為單次查詢）。"""
+    if DISABLE or not keys:
+        return {}
+    now = _utc_now()
+    entries: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
+    for key in dict.fromkeys(keys):
+        entry = _l1.get(key)
+        if entry is None:
+            missing.append(key)
+        else:
+            entries[key] = entry
+    loaded = _backend.get_many(missing) if missing else {}
+    if SNAPSHOT_PATHS:
+        for key in missing:
+            if key not in loaded:
+                entry = _snapshot_get(key)
+                if entry is not None:
+                    loaded[key] = entry
+    entries.update(loaded)
+
+    out: Dict[str, Any] = {}
+    for key, entry in entries.items():
+        if _is_expired(entry, _entry_ttl(entry, ttl_sec), now):
+            _l1.pop(key)
+            _backend.delete(key)
+            continue
+        value = _load_value(key, entry, key not in loaded)
+        if value is not None:
+            out[key] = _copy_json(value)
+    return out
+
 
-    path = _cache_path(key)
-    payload = {
-        "created_at": _utc_now(),
-        "ttl_sec": DEFAULT_TTL_SEC if ttl_sec is None else int(ttl_sec),
+def _entry(key: str, value: Any, ttl_sec: Optional[int], now: int, outcome: str) -> Dict[str, Any]:
+    return {
+        "key": key,
+        "namespace": namespace_of(key),
+        "created_at": now,
+        "ttl_sec": ttl_for(key, outcome) if ttl_sec is None else int(ttl_sec),
         "value": value,
     }
-    try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception:
-        return False
 
 
-def delete(key: str) -> bool:
+def set(key: str, value: Any, ttl_sec: Optional[int] = None, outcome: str = OUTCOME_SUCCESS) -> bool:
+    """寫入快取；ttl_sec 不給時依 TTL 政策表（namespace 前綴 + outcome）決定。"""
     if DISABLE:
         return False
-    path = _cache_path(key)
-    if not os.path.exists(path):
+    if outcome == OUTCOME_TRANSIENT_ERROR and getattr(_revalidate_ctx, "active", False):
+        # 背景刷新失敗：保留仍在 hard TTL 內的舊值，不以錯誤覆蓋（前景呼叫端的結果照常寫入）
         return False
-    try:
-        os.remove(path)
-        return True
-    except OSError:
+    _ensure_sweeper()
+    entry = _entry(key, _copy_json(value), ttl_sec, _utc_now(), outcome)
+    ok = _backend.set(key, entry)
+    if ok:
+        _l1.put(key, entry)
+    else:
+        _l1.pop(key)
+    return ok
+
+
+def set_many(items: Dict[str, Any], ttl_sec: Optional[int] = None, outcome: str = OUTCOME_SUCCESS) -> int:
+    """批次寫入 {key: value}，回傳寫入筆數（sqlite 後端為單一 transaction）。"""
+    if DISABLE or not items:
+        return 0
+    _ensure_sweeper()
+    now = _utc_now()
+    entries = {key: _entry(key, _copy_json(value), ttl_sec, now, outcome) for key, value in items.items()}
+    count = _backend.set_many(entries)
+    for key, entry in entries.items():
+        if count:
+            _l1.put(key, entry)
+        else:
+            _l1.pop(key)
+    return count
+
+
+def delete(key: str) -> bool:
+    if DISABLE:
         return False
+    _l1.pop(key)
+    return _backend.delete(key)
 
 
 def clear() -> int:
     if DISABLE:
         return 0
-    count = 0
-    cache_dir = _ensure_dir()
-    for filename in os.listdir(cache_dir):
-        if not filename.endswith(".json"):
-            continue
+    _l1.clear()
+    return _backend.clear()
+
+
+_sweeper_lock = threading.Lock()
+_sweeper_thread: Optional[threading.Thread] = None
+
+
+def sweep(max_bytes: Optional[int] = None) -> Dict[str, int]:
+    """刪除已過期 entry，並在超過容量上限時依最後存取時間淘汰；順帶清掉閒置的 singleflight 鎖檔。回傳各自刪除筆數。"""
+    limit = MAX_BYTES if max_bytes is None else int(max_bytes)
+    expired = _backend.purge_expired(_utc_now())
+    evicted = _backend.evict_to(int(limit * _EVICT_LOW_WATERMARK)) if limit > 0 else 0
+    if evicted:
+        # 被淘汰的 key 無法逐一對應，直接清空 L1 讓後續讀取回到後端確認
+        _l1.clear()
+    lock_files = atomic_io.sweep_lock_files(SINGLEFLIGHT_LOCK_DIR, SINGLEFLIGHT_LOCK_IDLE_SEC)
+    return {"expired": expired, "evicted": evicted, "lock_files": lock_files}
+
+
+def _sweep_exclusive() -> None:
+    if fcntl is None:
+        sweep()
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd = os.open(os.path.join(CACHE_DIR, ".sweep.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
         try:
-            os.remove(os.path.join(cache_dir, filename))
-            count += 1
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
         except OSError:
+            return  # 其他行程正在清理
+        try:
+            sweep()
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def _sweep_loop() -> None:
+    while True:
+        time.sleep(SWEEP_INTERVAL_SEC)
+        try:
+            _sweep_exclusive()
+        except Exception:
             pass
-    return count
+
+
+def _ensure_sweeper() -> None:
+    global _sweeper_thread
+    if _sweeper_thread is not None or SWEEP_INTERVAL_SEC <= 0:
+        return
+    with _sweeper_lock:
+        if _sweeper_thread is not None:
+            return
+        _sweeper_thread = threading.Thread(target=_sweep_loop, name="askllm-cache-sweeper", daemon=True)
+        _sweeper_thread.start()
+
+
+def usage() -> Dict[str, Dict[str, int]]:
+    """各 namespace 的 {entries, bytes, expired}。"""
+    return _backend.usage(_utc_now())
 
 
 def build_key(namespace: str, **kwargs: Any) -> str:
     normalized = json.dumps(kwargs, ensure_ascii=False, sort_keys=True, default=str)
     return f"{namespace}:{normalized}"
+
+
+def migrate(src_name: str, dst_name: str, batch_size: int = 1000) -> int:
+    """把 src 後端的所有 entry 複製到 dst 後端（以 key hash 對應，原 key 未知的舊檔歸入 legacy）。"""
+    src = cache_backends.create(src_name, CACHE_DIR, DB_PATH, REDIS_URL, REDIS_RETRY_SEC)
+    dst = cache_backends.create(dst_name, CACHE_DIR, DB_PATH, REDIS_URL, REDIS_RETRY_SEC)
+    if src.name == dst.name:
+        raise ValueError("來源與目的後端相同")
+    count = 0
+    batch = []
+    for hashed, entry in src.iter_entries():
+        entry.setdefault("key", None)
+        entry.setdefault("namespace", cache_backends.LEGACY_NAMESPACE)
+        batch.append((hashed, entry))
+        if len(batch) >= batch_size:
+            count += dst.put_many_hashed(batch)
+            batch = []
+    if batch:
+        count += dst.put_many_hashed(batch)
+    return count
+
+
+def export_snapshot(path: str, namespaces: Optional[List[str]] = None, max_age_sec: Optional[int] = None) -> int:
+    """把目前後端的未過期 entry（可依 namespace 前綴 / 年齡過濾）匯出成快照檔，回傳筆數。"""
+    return cache_snapshot.export_snapshot(_backend.iter_entries(), path, namespaces, max_age_sec)
+
+
+def import_snapshot(path: str, namespaces: Optional[List[str]] = None, max_age_sec: Optional[int] = None) -> Dict[str, int]:
+    """把快照檔以 newer-wins 併入目前後端。"""
+    snapshot = cache_snapshot.Snapshot(path)
+    try:
+        stats = cache_snapshot.import_snapshot(snapshot, _backend, namespaces, max_age_sec)
+    finally:
+        snapshot.close()
+    _l1.clear()
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="askllm 快取管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_migrate = sub.add_parser("migrate", help="在快取後端之間搬移資料")
+    p_migrate.add_argument("--from", dest="src", default="file")
+    p_migrate.add_argument("--to", dest="dst", default="sqlite")
+    sub.add_parser("stats", help="各 namespace 的筆數與佔用空間")
+    p_sweep = sub.add_parser("sweep", help="刪除過期 entry 並依容量上限淘汰")
+    p_sweep.add_argument("--max-bytes", type=int, default=None)
+    sub.add_parser("policy", help="目前生效的 TTL 政策表")
+    for name, help_text in (("export", "匯出快照檔"), ("import", "把快照檔併入快取（newer-wins）")):
+        p_snap = sub.add_parser(name, help=help_text)
+        p_snap.add_argument("path")
+        p_snap.add_argument("--namespace", action="append", default=None, help="namespace 前綴，可重複")
+        p_snap.add_argument("--max-age-sec", type=int, default=None, help="只取這段時間內寫入的 entry")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        started = time.time()
+        count = migrate(args.src, args.dst)
+        print(f"搬移完成：{count} 筆（{args.src} → {args.dst}，{time.time() - started:.1f} 秒）")
+    elif args.command == "stats":
+        rows = sorted(usage().items(), key=lambda kv: kv[1]["bytes"], reverse=True)
+        total_entries = sum(r["entries"] for _, r in rows)
+        total_bytes = sum(r["bytes"] for _, r in rows)
+        print(f"後端：{_backend.name}  上限：{MAX_BYTES or '不限'}")
+        print(f"{'namespace':<44} {'entries':>9} {'MiB':>10} {'expired':>8}")
+        for namespace, r in rows:
+            print(f"{namespace:<44} {r['entries']:>9} {r['bytes'] / 1048576:>10.2f} {r['expired']:>8}")
+        print(f"{'(total)':<44} {total_entries:>9} {total_bytes / 1048576:>10.2f}")
+        for snapshot in _snapshot_tier():
+            print(f"唯讀快照：{snapshot.path}（{len(snapshot)} 筆）")
+    elif args.command == "sweep":
+        started = time.time()
+        result = sweep(args.max_bytes)
+        print(f"清理完成：過期 {result['expired']} 筆、淘汰 {result['evicted']} 筆、鎖檔 {result['lock_files']} 個（{time.time() - started:.1f} 秒）")
+    elif args.command == "policy":
+        outcomes = [OUTCOME_SUCCESS, OUTCOME_EMPTY, OUTCOME_NOT_FOUND, OUTCOME_TRANSIENT_ERROR]
+        print(f"{'prefix':<24} " + " ".join(f"{o:>16}" for o in outcomes))
+        for prefix in sorted(TTL_POLICY):
+            probe = f"{prefix}__probe__"
+            print(f"{prefix or '(default)':<24} " + " ".join(f"{ttl_for(probe, o):>16}" for o in outcomes))
+    elif args.command == "export":
+        started = time.time()
+        count = export_snapshot(args.path, args.namespace, args.max_age_sec)
+        size = os.path.getsize(args.path)
+        print(f"匯出完成：{count} 筆、{size / 1048576:.2f} MiB → {args.path}（{time.time() - started:.1f} 秒）")
+    elif args.command == "import":
+        started = time.time()
+        result = import_snapshot(args.path, args.namespace, args.max_age_sec)
+        print(
+            f"匯入完成：寫入 {result['imported']} 筆、保留較新的既有 {result['kept_existing']} 筆、"
+            f"不符條件 {result['filtered']} 筆（{time.time() - started:.1f} 秒）"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+專案開始前的快取預熱：對一份目標清單（SMILES 或化合物名稱）事先跑一遍
+名稱解析 → 單步逆合成 → （選用）tree search → 路線末端前驅物的 PubChem 危害，
+之後互動查詢直接命中快取。
+
+輸入檔每行一個目標，空行與 # 開頭略過；可用前綴指定型別：
+  smiles:CC(=O)Oc1ccccc1C(=O)O
+  name:aspirin
+未加前綴時，以 RDKit（若有）或字元規則判斷是否為 SMILES，否則當作名稱。
+
+可續跑：每個目標完成的階段記在 runtime_jobs/warmup/<輸入檔名>.<選項雜湊>.jsonl，
+中斷後以相同參數重跑會略過已完成的階段（--restart 忽略紀錄從頭開始）。
+
+CLI：
+  python cache_warmup.py targets.txt
+  python cache_warmup.py targets.txt --engines reaxys,uspto_full --tree --expansion-time 180
+  python cache_warmup.py targets.txt --engines none --tree --tree-workers 2 --restart
+
+環境變數：
+  ASKLLM_WARMUP_DIR   續跑紀錄目錄（預設 runtime_jobs/warmup）
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from askcos_tree_utils import parse_uds_paths, route_summary
+import atomic_io
+import cache_utils as cache
+import chem_canon
+import retrosynthesis
+import route_recommendation as reco
+import smiles_resolver
+
+
+WARMUP_DIR = os.environ.get(
+    "ASKLLM_WARMUP_DIR",
+    os.path.join(os.path.dirname(__file__), "runtime_jobs", "warmup"),
+)
+
+# 沒有 RDKit 時的 SMILES 判斷：含 SMILES 專用符號，或整串可切成有機子集原子
+_SMILES_SYMBOL_RE = re.compile(r"[=#\(\)\[\]@/\\%]|\d")
+_ORGANIC_ATOMS_RE = re.compile(r"^(?:Cl|Br|[BCNOPSFIcnosp])+$")
+_RESOLVED_SMILES_RE = re.compile(r"\*\*(.+?)\*\*")
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _looks_like_smiles(text: str) -> bool:
+    if " " in text:
+        return False
+    if chem_canon.Chem is not None:
+        return chem_canon.Chem.MolFromSmiles(text) is not None
+    return bool(_SMILES_SYMBOL_RE.search(text) or _ORGANIC_ATOMS_RE.match(text.replace(".", "")))
+
+
+def read_targets(path: str) -> List[Dict[str, str]]:
+    """讀目標清單 -> [{"input", "kind": "smiles"|"name", "value"}]（依輸入去重、保留順序）。"""
+    out: List[Dict[str, str]] = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            text = line.strip()
+            if not text or text.startswith("#") or text in seen:
+                continue
+            seen.add(text)
+            prefix, _, rest = text.partition(":")
+            if prefix.lower() in ("smiles", "name") and rest.strip():
+                kind, value = prefix.lower(), rest.strip()
+            else:
+                kind, value = ("smiles" if _looks_like_smiles(text) else "name"), text
+            out.append({"input": text, "kind": kind, "value": value})
+    return out
+
+
+class _Progress:
+    """各階段的計數（total / hits / fetched / failed），thread-safe。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Dict[str, int]] = {}
+
+    def add(self, stage: str, *, hit: bool = False, ok: bool = True, count: int = 1) -> None:
+        with self._lock:
+            row = self.stages.setdefault(stage, {"total": 0, "hits": 0, "fetched": 0, "failed": 0, "skipped": 0})
+            row["total"] += count
+            if not ok:
+                row["failed"] += count
+            elif hit:
+                row["hits"] += count
+            else:
+                row["fetched"] += count
+
+    def skip(self, stage: str, count: int = 1) -> None:
+        with self._lock:
+            row = self.stages.setdefault(stage, {"total": 0, "hits": 0, "fetched": 0, "failed": 0, "skipped": 0})
+            row["skipped"] += count
+
+    def report(self) -> str:
+        width = max([14] + [len(stage) for stage in self.stages])
+        lines = [f"{'stage':<{width}} {'total':>7} {'hits':>7} {'fetched':>8} {'failed':>7} {'resumed':>8} {'hit_rate':>9}"]
+        with self._lock:
+            for stage, r in self.stages.items():
+                rate = r["hits"] / r["total"] if r["total"] else 0.0
+                lines.append(
+                    f"{stage:<{width}} {r['total']:>7} {r['hits']:>7} {r['fetched']:>8} "
+                    f"{r['failed']:>7} {r['skipped']:>8} {rate:>9.1%}"
+                )
+        return "\n".join(lines)
+
+
+class _StateLog:
+    """續跑紀錄：每完成一個 (目標, 階段) 追加一行 JSON。"""
+
+    def __init__(self, path: str, restart: bool):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    if rec.get("ok"):
+                        self.done[(rec.get("input"), rec.get("stage"))] = rec
+
+    def get(self, target: str, stage: str) -> Optional[Dict[str, Any]]:
+        return self.done.get((target, stage))
+
+    def record(self, target: str, stage: str, ok: bool, **extra: Any) -> None:
+        rec = {"input": target, "stage": stage, "ok": ok, "at": _utc_now(), **extra}
+        with self._lock:
+            atomic_io.append_jsonl(self.path, rec)
+            if ok:
+                self.done[(target, stage)] = rec
+
+
+def _state_path(targets_path: str, options: Dict[str, Any]) -> str:
+    digest = hashlib.sha1(json.dumps(options, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+    base = os.path.splitext(os.path.basename(targets_path))[0] or "targets"
+    return os.path.join(WARMUP_DIR, f"{base}.{digest}.jsonl")
+
+
+def _resolve_names(targets: List[Dict[str, str]], state: _StateLog, progress: _Progress, workers: int) -> None:
+    """名稱 → SMILES（寫回 target["smiles"]）；SMILES 目標直接沿用。"""
+    pending = []
+    for t in targets:
+        if t["kind"] == "smiles":
+            t["smiles"] = t["value"]
+            continue
+        rec = state.get(t["input"], "resolve")
+        if rec is not None:
+            t["smiles"] = rec.get("smiles", "")
+            progress.skip("resolve")
+        else:
+            pending.append(t)
+
+    def _one(t: Dict[str, str]) -> Tuple[Dict[str, str], bool, str]:
+        hit = cache.get(smiles_resolver._name_cache_key(t["value"])) is not None
+        text = smiles_resolver.resolve_smiles_from_name(t["value"])
+        m = _RESOLVED_SMILES_RE.search(text or "")
+        return t, hit, (m.group(1).strip() if m else "")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="askllm-warmup-resolve") as pool:
+        for fut in as_completed([pool.submit(_one, t) for t in pending]):
+            t, hit, smiles = fut.result()
+            t["smiles"] = smiles
+            progress.add("resolve", hit=hit, ok=bool(smiles))
+            state.record(t["input"], "resolve", bool(smiles), smiles=smiles)
+            if not smiles:
+                print(f"  [resolve] 無法解析：{t['value']}")
+
+
+def _warm_retro(
+    targets: List[Dict[str, str]],
+    engines: List[str],
+    state: _StateLog,
+    progress: _Progress,
+    workers: int,
+) -> None:
+    by_smiles: Dict[str, List[str]] = {}
+    for t in targets:
+        if t.get("smiles"):
+            by_smiles.setdefault(t["smiles"], []).append(t["input"])
+    for engine_key in engines:
+        stage = f"retro:{engine_key}"
+        pending = []
+        for smi, inputs in by_smiles.items():
+            if all(state.get(i, stage) for i in inputs):
+                progress.skip(stage, len(inputs))
+            else:
+                pending.append(smi)
+        if not pending:
+            continue
+        done = 0
+        for item in retrosynthesis.iter_retrosynthesis_batch(pending, engines=[engine_key], max_workers=workers):
+            done += 1
+            inputs = by_smiles.get(item["smiles"], [])
+            progress.add(stage, hit=item["cached"], ok=item["ok"], count=max(1, len(inputs)))
+            for target_input in inputs:
+                state.record(target_input, stage, item["ok"])
+            if done % 50 == 0 or done == len(pending):
+                print(f"  [{stage}] {done}/{len(pending)}")
+
+
+def _tree_leaves(data: Dict[str, Any]) -> List[str]:
+    result = data.get("result", {}) if isinstance(data, dict) else {}
+    uds = result.get("uds", {}) if isinstance(result, dict) else {}
+    leaves: List[str] = []
+    for route in parse_uds_paths(uds if isinstance(uds, dict) else {}):
+        leaves.extend(x for x in route_summary(route).get("leaf_chemicals") or [] if x and ">>" not in str(x))
+    return list(dict.fromkeys(leaves))
+
+
+def _warm_tree_and_hazards(
+    target: Dict[str, str],
+    args: argparse.Namespace,
+    rules: Dict[str, Any],
+    state: _StateLog,
+    progress: _Progress,
+) -> None:
+    smiles = target.get("smiles")
+    if not smiles:
+        return
+    leaves: Optional[List[str]] = None
+    rec = state.get(target["input"], "tree")
+    if rec is not None:
+        progress.skip("tree")
+        leaves = rec.get("leaves")
+    else:
+        payload = reco._build_payload(
+            target_smiles=smiles,
+            backend=args.backend,
+            max_depth=args.max_depth,
+            max_paths=args.max_paths,
+            expansion_time=args.expansion_time,
+            max_branching=args.max_branching,
+            max_num_templates=args.max_num_templates,
+            threshold=args.threshold,
+            fast_filter_threshold=args.fast_filter_threshold,
+        )
+        hit = isinstance(cache.get(reco._tree_search_key(payload)), dict)
+        try:
+            data = reco._call_tree_search(payload, expansion_time=args.expansion_time)
+        except Exception as e:
+            progress.add("tree", ok=False)
+            state.record(target["input"], "tree", False, error=str(e)[:200])
+            print(f"  [tree] 失敗：{smiles}（{str(e)[:120]}）")
+            return
+        leaves = _tree_leaves(data)
+        progress.add("tree", hit=hit)
+        state.record(target["input"], "tree", True, leaves=leaves)
+
+    if not args.hazards or not leaves:
+        return
+    if state.get(target["input"], "hazards") is not None:
+        progress.skip("hazards", len(leaves))
+        return
+    keys = {smi: reco._hazard_assess_key(smi, rules) for smi in leaves}
+    cached = cache.get_many(list(keys.values()))
+    assessed = reco._pubchem_hazard_assess_many(leaves, rules, deadline_sec=args.hazard_deadline)
+    # pubchem_error（限流 / ServerBusy）不算完成：續跑時要重查，而不是沿用錯誤結果
+    checked = {
+        smi for smi, out in assessed.items() if not str(out.get("reason", "")).startswith("pubchem_error")
+    }
+    for smi in leaves:
+        progress.add("hazards", hit=keys[smi] in cached, ok=smi in checked)
+    state.record(target["input"], "hazards", len(checked) == len(leaves), checked=len(checked), leaves=len(leaves))
+
+
+def warmup(args: argparse.Namespace) -> _Progress:
+    targets = read_targets(args.targets)
+    engines = [] if args.engines.strip().lower() == "none" else retrosynthesis._resolve_batch_engines(args.engines)
+    options = {
+        "engines": engines,
+        "tree": args.tree,
+        "hazards": args.hazards,
+        "backend": args.backend,
+        "max_depth": args.max_depth,
+        "max_paths": args.max_paths,
+        "expansion_time": args.expansion_time,
+        "max_branching": args.max_branching,
+        "max_num_templates": args.max_num_templates,
+        "threshold": args.threshold,
+        "fast_filter_threshold": args.fast_filter_threshold,
+    }
+    state = _StateLog(_state_path(args.targets, options), restart=args.restart)
+    progress = _Progress()
+    print(f"目標 {len(targets)} 個；引擎 {engines or '無'}；tree search {'開' if args.tree else '關'}；紀錄 {state.path}")
+
+    _resolve_names(targets, state, progress, args.workers)
+    if engines:
+        _warm_retro(targets, engines, state, progress, args.workers)
+    if args.tree:
+        rules = reco._load_risk_rules()
+        resolved = [t for t in targets if t.get("smiles")]
+        with ThreadPoolExecutor(max_workers=max(1, args.tree_workers), thread_name_prefix="askllm-warmup-tree") as pool:
+            futures = [pool.submit(_warm_tree_and_hazards, t, args, rules, state, progress) for t in resolved]
+            for idx, fut in enumerate(as_completed(futures), start=1):
+                fut.result()
+                print(f"  [tree] {idx}/{len(resolved)}")
+    return progress
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="askllm 快取預熱（目標清單 → AskCOS / PubChem）")
+    parser.add_argument("targets", help="目標清單檔（每行一個 SMILES 或名稱）")
+    parser.add_argument("--engines", default="reaxys", help="單步逆合成引擎，逗號分隔；all 為全部，none 為略過")
+    parser.add_argument("--workers", type=int, default=4, help="名稱解析 / 單步逆合成並行數")
+    parser.add_argument("--tree", action="store_true", help="同時跑 tree search（路線推薦用）")
+    parser.add_argument("--tree-workers", type=int, default=2, help="同時進行的 tree search 數")
+    parser.add_argument("--no-hazards", dest="hazards", action="store_false", help="不預抓路線末端前驅物的危害資料")
+    parser.add_argument("--hazard-deadline", type=float, default=600.0, help="每個目標危害預抓的時間上限（秒）")
+    parser.add_argument("--backend", default="mcts")
+    parser.add_argument("--max-depth", type=int, default=5)
+    parser.add_argument("--max-paths", type=int, default=120)
+    parser.add_argument("--expansion-time", type=int, default=180)
+    parser.add_argument("--max-branching", type=int, default=25)
+    parser.add_argument("--max-num-templates", type=int, default=1000)
+    parser.add_argument("--threshold", type=float, default=0.3)
+    parser.add_argument("--fast-filter-threshold", type=float, default=0.001)
+    parser.add_argument("--restart", action="store_true", help="忽略續跑紀錄，從頭開始")
+    args = parser.parse_args()
+    if args.engines.strip().lower() == "all":
+        args.engines = ",".join(retrosynthesis.RETRO_ENGINES)
+    elif args.engines.strip().lower() != "none":
+        try:
+            retrosynthesis._resolve_batch_engines(args.engines)
+        except ValueError as e:
+            parser.error(str(e))
+
+    started = time.time()
+    progress = warmup(args)
+    print(f"\n預熱完成（{time.time() - started:.1f} 秒）")
+    print(progress.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+分子 / 反應 SMILES 正規化，只用於組 cache key：等價輸入（OCC 與 C(O)C、反應物順序不同、
+多餘空白）共用同一筆快取；送給 AskCOS / PubChem 的仍是使用者原始輸入。
+
+- 有 RDKit：MolFromSmiles → MolToSmiles（canonical、保留立體），再把 "." 片段排序。
+- 無 RDKit 或解析失敗：內建正規化，只做不會改變分子身分的處理——去除空白、片段排序。
+  這種情況下 OCC 與 C(O)C 仍是不同 key（寧可少命中，也不把不同分子併在一起）。
+
+結果以 lru_cache 記憶，同一 SMILES 在行程內只算一次。
+
+環境變數：
+  ASKLLM_CANON_RDKIT=0        不使用 RDKit（一律內建正規化）
+  ASKLLM_CANON_CACHE_SIZE     記憶筆數上限（預設 65536）
+"""
+
+import os
+import re
+from functools import lru_cache
+from typing import Any, Iterable, List
+
+USE_RDKIT = os.environ.get("ASKLLM_CANON_RDKIT", "1") != "0"
+CACHE_SIZE = int(os.environ.get("ASKLLM_CANON_CACHE_SIZE", "65536"))
+
+Chem = None
+if USE_RDKIT:
+    try:
+        from rdkit import Chem, RDLogger
+
+        RDLogger.DisableLog("rdApp.*")  # 無效 SMILES 會退回內建正規化，不必刷 stderr
+    except ImportError:
+        Chem = None
+
+_WS_RE = re.compile(r"\s+")
+
+
+def backend_name() -> str:
+    return "rdkit" if Chem is not None else "builtin"
+
+
+def _builtin(smiles: str) -> str:
+    fragments = [f for f in _WS_RE.sub("", smiles).split(".") if f]
+    return ".".join(sorted(fragments))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _canonical(smiles: str) -> str:
+    if Chem is not None:
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is not None:
+            return ".".join(sorted(Chem.MolToSmiles(mol).split(".")))
+    return _builtin(smiles)
+
+
+def canonical_smiles(smiles: Any) -> str:
+    """分子 SMILES（可含 "." 多片段，片段順序不影響結果）；空值回傳空字串。"""
+    text = _WS_RE.sub("", str(smiles or ""))
+    if not text:
+        return ""
+    return _canonical(text)
+
+
+def canonical_set(items: Any) -> List[str]:
+    """SMILES 集合（試劑、溶劑清單等）：逐一正規化、去空值後排序。"""
+    if isinstance(items, str):
+        items = [items]
+    return sorted(c for c in (canonical_smiles(x) for x in (items or [])) if c)
+
+
+def canonical_list(items: Iterable[Any]) -> List[str]:
+    """保留順序的逐一正規化（例如多目標請求，結果依輸入順序對應）。"""
+    return [canonical_smiles(x) for x in items]
+
+
+def canonical_reaction(reaction_smiles: Any) -> str:
+    """反應 SMILES（R>>P 或 R>A>P）：每一段各自正規化、片段排序。"""
+    text = _WS_RE.sub("", str(reaction_smiles or ""))
+    parts = text.split(">")
+    if len(parts) != 3:
+        return canonical_smiles(text)
+    return ">".join(canonical_smiles(p) for p in parts)
+
+
+def cache_info() -> Any:
+    return _canonical.cache_info()
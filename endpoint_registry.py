@@ -0,0 +1,232 @@
+"""
+AskCOS 端點健康登錄表：背景探測 + per-endpoint circuit breaker + 已知離線時 fast-fail。
+
+端點以 host:port 為單位（一個容器一個 breaker）。各工具模組在 import 時以
+register(url, tools=[...]) 登錄自己的 URL 與對應工具；http_transport 每次請求前
+呼叫 allow()，請求結束後回報 record_success()/record_failure()。
+一個工具的所有端點都離線時，unavailable_tools() 會列出它，供 planner 略過。
+
+Breaker 狀態：
+  closed     正常放行
+  open       連續失敗達門檻，cooldown 期間直接拒絕
+  half_open  cooldown 結束，只放行一個試探請求；成功即 closed，失敗回到 open
+
+環境變數：
+  ASKLLM_HEALTH_PROBE=0                 關閉背景 TCP 探測（預設開啟）
+  ASKLLM_HEALTH_PROBE_INTERVAL_SEC      探測間隔（預設 30）
+  ASKLLM_BREAKER_FAILURE_THRESHOLD      連續失敗幾次跳開（預設 3）
+  ASKLLM_BREAKER_COOLDOWN_SEC           跳開後多久允許半開試探（預設 60）
+  ASKLLM_HTTP_RETRIES                   連線失敗時的重試次數（預設 2）
+  ASKLLM_HTTP_RETRY_BASE_SEC            重試退避基準秒數（預設 0.5，full jitter）
+"""
+
+import os
+import random
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+
+PROBE_ENABLED = os.environ.get("ASKLLM_HEALTH_PROBE", "1") == "1"
+PROBE_INTERVAL_SEC = float(os.environ.get("ASKLLM_HEALTH_PROBE_INTERVAL_SEC", "30"))
+PROBE_TIMEOUT_SEC = 2.0
+FAILURE_THRESHOLD = int(os.environ.get("ASKLLM_BREAKER_FAILURE_THRESHOLD", "3"))
+COOLDOWN_SEC = float(os.environ.get("ASKLLM_BREAKER_COOLDOWN_SEC", "60"))
+RETRIES = int(os.environ.get("ASKLLM_HTTP_RETRIES", "2"))
+RETRY_BASE_SEC = float(os.environ.get("ASKLLM_HTTP_RETRY_BASE_SEC", "0.5"))
+RETRY_MAX_SEC = 8.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class _Endpoint:
+    def __init__(self, key: str, host: str, port: int):
+        self.key = key
+        self.host = host
+        self.port = port
+        self.urls: Set[str] = set()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.last_error = ""
+        self.last_probe_at = 0.0
+        self.last_probe_ok: Optional[bool] = None
+
+
+_lock = threading.Lock()
+_endpoints: Dict[str, _Endpoint] = {}
+_tool_endpoints: Dict[str, Set[str]] = {}
+_probe_thread: Optional[threading.Thread] = None
+
+
+def endpoint_key(url: str) -> str:
+    parts = urlsplit(url)
+    scheme = (parts.scheme or "http").lower()
+    host = parts.hostname or "127.0.0.1"
+    port = parts.port or (443 if scheme == "https" else 80)
+    return f"{host}:{port}"
+
+
+def register(url: str, tools: Optional[List[str]] = None) -> str:
+    """登錄端點並綁定工具名稱；同一 host:port 可被多個 URL / 工具共用。"""
+    parts = urlsplit(url)
+    key = endpoint_key(url)
+    with _lock:
+        ep = _endpoints.get(key)
+        if ep is None:
+            ep = _Endpoint(key, parts.hostname or "127.0.0.1", int(key.rsplit(":", 1)[1]))
+            _endpoints[key] = ep
+        ep.urls.add(url)
+        for tool in tools or []:
+            _tool_endpoints.setdefault(tool, set()).add(key)
+    if PROBE_ENABLED:
+        _ensure_probe_thread()
+    return key
+
+
+def _transition_locked(ep: _Endpoint, now: float) -> None:
+    if ep.state == OPEN and now - ep.opened_at >= COOLDOWN_SEC:
+        ep.state = HALF_OPEN
+        ep.trial_in_flight = False
+
+
+def allow(url: str) -> Optional[str]:
+    """請求前檢查；放行回傳 None，已知離線則回傳原因字串（未登錄的 URL 一律放行）。"""
+    key = endpoint_key(url)
+    now = time.monotonic()
+    with _lock:
+        ep = _endpoints.get(key)
+        if ep is None:
+            return None
+        _transition_locked(ep, now)
+        if ep.state == CLOSED:
+            return None
+        if ep.state == HALF_OPEN and not ep.trial_in_flight:
+            ep.trial_in_flight = True
+            return None
+        wait = max(0.0, COOLDOWN_SEC - (now - ep.opened_at))
+        return (
+            f"端點 {key} 已知離線（circuit {ep.state}，約 {wait:.0f} 秒後再試）；"
+            f"最近錯誤：{ep.last_error or 'unknown'}"
+        )
+
+
+def record_success(url: str) -> None:
+    with _lock:
+        ep = _endpoints.get(endpoint_key(url))
+        if ep is None:
+            return
+        ep.state = CLOSED
+        ep.failures = 0
+        ep.trial_in_flight = False
+        ep.last_error = ""
+
+
+def record_failure(url: str, error: str = "") -> None:
+    now = time.monotonic()
+    with _lock:
+        ep = _endpoints.get(endpoint_key(url))
+        if ep is None:
+            return
+        ep.failures += 1
+        ep.last_error = (error or "")[:200]
+        ep.trial_in_flight = False
+        if ep.state == HALF_OPEN or ep.failures >= FAILURE_THRESHOLD:
+            ep.state = OPEN
+            ep.opened_at = now
+
+
+def backoff_delay(attempt: int) -> float:
+    """第 attempt 次重試前的等待秒數（exponential backoff + full jitter）。"""
+    return random.uniform(0.0, min(RETRY_MAX_SEC, RETRY_BASE_SEC * (2 ** max(0, attempt))))
+
+
+def is_available(key: str) -> bool:
+    now = time.monotonic()
+    with _lock:
+        ep = _endpoints.get(key)
+        if ep is None:
+            return True
+        _transition_locked(ep, now)
+        return ep.state != OPEN
+
+
+def unavailable_tools() -> List[str]:
+    """所有端點都處於 open 狀態的工具名稱。"""
+    with _lock:
+        tool_map = {tool: set(keys) for tool, keys in _tool_endpoints.items()}
+    return sorted(tool for tool, keys in tool_map.items() if keys and not any(is_available(k) for k in keys))
+
+
+def snapshot() -> List[Dict[str, Any]]:
+    now = time.monotonic()
+    out = []
+    with _lock:
+        for ep in _endpoints.values():
+            _transition_locked(ep, now)
+            out.append(
+                {
+                    "endpoint": ep.key,
+                    "state": ep.state,
+                    "failures": ep.failures,
+                    "last_error": ep.last_error,
+                    "last_probe_ok": ep.last_probe_ok,
+                    "tools": sorted(t for t, keys in _tool_endpoints.items() if ep.key in keys),
+                }
+            )
+    out.sort(key=lambda x: x["endpoint"])
+    return out
+
+
+def probe_once() -> None:
+    """對所有已登錄端點做一次 TCP 探測；連不上直接跳開，連得上則關閉 breaker。"""
+    with _lock:
+        targets = [(ep.key, ep.host, ep.port) for ep in _endpoints.values()]
+    for key, host, port in targets:
+        ok = True
+        err = ""
+        try:
+            with socket.create_connection((host, port), timeout=PROBE_TIMEOUT_SEC):
+                pass
+        except OSError as e:
+            ok = False
+            err = f"health probe: {e}"
+        now = time.monotonic()
+        with _lock:
+            ep = _endpoints.get(key)
+            if ep is None:
+                continue
+            ep.last_probe_at = now
+            ep.last_probe_ok = ok
+            if ok:
+                if ep.state != CLOSED:
+                    ep.state = CLOSED
+                    ep.failures = 0
+                    ep.trial_in_flight = False
+            elif ep.state != OPEN:
+                ep.state = OPEN
+                ep.opened_at = now
+                ep.last_error = err[:200]
+
+
+def _probe_loop() -> None:
+    while True:
+        try:
+            probe_once()
+        except Exception:
+            pass
+        time.sleep(PROBE_INTERVAL_SEC)
+
+
+def _ensure_probe_thread() -> None:
+    global _probe_thread
+    with _lock:
+        if _probe_thread is not None:
+            return
+        _probe_thread = threading.Thread(target=_probe_loop, name="askllm-health-probe", daemon=True)
+        _probe_thread.start()
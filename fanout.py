@@ -0,0 +1,93 @@
+"""
+多引擎 compare 的並行 fan-out：有界 thread pool，每個引擎各自 deadline，
+逾時的引擎在報告中標記，不阻塞其他引擎的結果。
+
+gather() 是同一機制的通用版本（回合前的 skill 路由 / planner / 名稱解析也用它）：
+每個工作各自 deadline，逾時或例外時改用該工作的 fallback() 結果。
+
+逾時的引擎不會被強制中斷（HTTP 請求仍在背景跑完），完成後照常寫入快取，
+下一次 compare 即可直接命中。
+
+環境變數：
+  ASKLLM_COMPARE_MAX_WORKERS   單次 compare 同時執行的引擎數上限（預設 4）
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+MAX_WORKERS = int(os.environ.get("ASKLLM_COMPARE_MAX_WORKERS", "4"))
+
+EngineTask = Tuple[str, Callable[[], str], float]
+# (name, fn, deadline_sec, fallback)
+GatherTask = Tuple[str, Callable[[], Any], float, Callable[[], Any]]
+
+
+def timeout_notice(name: str, deadline_sec: float) -> str:
+    return (
+        f"{name} 逾時：超過 {deadline_sec:.0f} 秒未回應，本次比較先略過此引擎；"
+        "背景請求完成後結果仍會寫入快取。"
+    )
+
+
+def run_engines(tasks: List[EngineTask], max_workers: Optional[int] = None) -> List[Tuple[str, str]]:
+    """
+    並行執行 (name, fn, deadline_sec) 清單，依輸入順序回傳 (name, text)。
+    deadline 以整批開始時間起算；逾時或例外都轉成文字標記。
+    """
+    if not tasks:
+        return []
+    workers = max(1, min(len(tasks), int(max_workers or MAX_WORKERS)))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="askllm-compare")
+    started = time.monotonic()
+    try:
+        futures = [(name, pool.submit(fn), float(deadline)) for name, fn, deadline in tasks]
+        results: List[Tuple[str, str]] = []
+        for name, fut, deadline in futures:
+            remaining = max(0.0, started + deadline - time.monotonic())
+            try:
+                results.append((name, str(fut.result(timeout=remaining))))
+            except FutureTimeoutError:
+                fut.cancel()
+                results.append((name, timeout_notice(name, deadline)))
+            except Exception as e:
+                results.append((name, f"{name} 執行失敗：{e}"))
+        return results
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def gather(tasks: List[GatherTask], thread_name_prefix: str = "askllm-gather") -> Dict[str, Dict[str, Any]]:
+    """
+    並行執行 (name, fn, deadline_sec, fallback)，全部完成或各自逾時後回傳
+    {name: {"value", "status", "elapsed_sec"}}；status 為 ok / timeout / error，後兩者的 value 取 fallback()。
+    deadline 以整批開始時間起算；每個工作一條 thread，總耗時約為最慢者而非總和。
+    """
+    if not tasks:
+        return {}
+    pool = ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix=thread_name_prefix)
+    started = time.monotonic()
+    try:
+
+        def _timed(fn: Callable[[], Any]) -> Tuple[Any, float]:
+            return fn(), time.monotonic() - started
+
+        futures = [(name, pool.submit(_timed, fn), float(deadline), fallback) for name, fn, deadline, fallback in tasks]
+        results: Dict[str, Dict[str, Any]] = {}
+        for name, fut, deadline, fallback in futures:
+            remaining = max(0.0, started + deadline - time.monotonic())
+            try:
+                value, elapsed = fut.result(timeout=remaining)
+                status = "ok"
+            except FutureTimeoutError:
+                fut.cancel()
+                value, elapsed, status = fallback(), deadline, "timeout"
+            except Exception:
+                value, elapsed, status = fallback(), time.monotonic() - started, "error"
+            results[name] = {"value": value, "status": status, "elapsed_sec": round(elapsed, 3)}
+        return results
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
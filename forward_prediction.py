@@ -1,9 +1,12 @@
-import json
 import os
-import subprocess
 from typing import Any, Dict, List
 
 import cache_utils as cache
+import chem_canon
+import endpoint_registry
+import fanout
+import http_transport
+import singleflight
 
 
 ASKCOS_FORWARD_WLDN5_URL = os.environ.get(
@@ -19,6 +22,24 @@ ASKCOS_FORWARD_GRAPH2SMILES_URL = os.environ.get(
     "http://127.0.0.1:9510/predictions/graph2smiles_pistachio",
 )
 ASKCOS_FORWARD_DEFAULT_MODEL = os.environ.get("ASKLLM_FORWARD_DEFAULT_MODEL", "pistachio")
+COMPARE_ENGINE_DEADLINE_SEC = int(os.environ.get("ASKLLM_FORWARD_COMPARE_DEADLINE_SEC", "50"))
+
+endpoint_registry.register(
+    ASKCOS_FORWARD_WLDN5_URL,
+    tools=[
+        "run_askcos_forward_prediction",
+        "run_askcos_forward_prediction_wldn5",
+        "run_askcos_forward_prediction_compare",
+    ],
+)
+endpoint_registry.register(
+    ASKCOS_FORWARD_USPTO_STEREO_URL,
+    tools=["run_askcos_forward_prediction_uspto_stereo", "run_askcos_forward_prediction_compare"],
+)
+endpoint_registry.register(
+    ASKCOS_FORWARD_GRAPH2SMILES_URL,
+    tools=["run_askcos_forward_prediction_graph2smiles", "run_askcos_forward_prediction_compare"],
+)
 
 
 def _normalize_reactants(reactants_smiles_list: Any) -> List[str]:
@@ -30,26 +51,21 @@ def _normalize_reactants(reactants_smiles_list: Any) -> List[str]:
 
 
 def _post_json(url: str, payload: Dict[str, Any], timeout_sec: int = 60) -> Any:
-    result = subprocess.run(
-        [
-            "curl",
-            url,
-            "--header",
-            "Content-Type: application/json",
-            "--request",
-            "POST",
-            "--data",
-            json.dumps(payload, ensure_ascii=False),
-        ],
-        capture_output=True,
-        text=True,
-        check=True,
-        timeout=timeout_sec,
-    )
-    return json.loads(result.stdout)
+    return http_transport.post_json(url, payload, timeout_sec=timeout_sec)
 
 
-def _summarize_forward_results(engine_name: str, full_reactants_smiles: str, data: Any, top_k: int) -> str:
+def _key_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """cache key 用的 payload：反應物 SMILES 正規化（片段排序），其餘欄位不變。"""
+    out = dict(payload)
+    if isinstance(out.get("reactants"), str):
+        out["reactants"] = chem_canon.canonical_smiles(out["reactants"])
+    if isinstance(out.get("smiles"), list):
+        out["smiles"] = chem_canon.canonical_list(out["smiles"])
+    return out
+
+
+def _parse_forward_response(data: Any) -> Dict[str, Any]:
+    """引擎回應 -> 可快取的精簡紀錄 {"products", "scores"}（保留全部候選，top_k 在讀出時才套用）。"""
     results_obj = None
     if isinstance(data, list) and data and isinstance(data[0], dict):
         results_obj = data[0]
@@ -67,6 +83,13 @@ def _summarize_forward_results(engine_name: str, full_reactants_smiles: str, dat
         products = [item.get("product", item.get("smiles", "N/A")) for item in result_list]
         scores = [float(item.get("score", 0.0) or 0.0) for item in result_list]
 
+    return {"products": list(products or []), "scores": list(scores or [])}
+
+
+def _summarize_forward_results(engine_name: str, full_reactants_smiles: str, parsed: Dict[str, Any], top_k: int) -> str:
+    products = parsed.get("products") or []
+    scores = parsed.get("scores") or []
+
     if not products:
         return f"AskCOS 正向預測 ({engine_name}) 調用成功，但未找到產物候選。"
 
@@ -96,31 +119,44 @@ def _run_forward_engine(
     full_reactants_smiles: str,
     top_k: int,
 ) -> str:
+    # 只以模型輸入為 key；top_k 在讀出時才套用，換顯示筆數不必重打引擎
     cache_key = cache.build_key(
-        "askcos:forward:v2",
+        "askcos:forward:raw:v2",
         engine=engine_name,
         url=url,
-        payload=payload,
-        top_k=top_k,
+        payload=_key_payload(payload),
     )
-    cached = cache.get(cache_key)
-    if isinstance(cached, str) and cached.strip():
+
+    def _fetch() -> Any:
+        """成功回傳解析後紀錄（dict），失敗回傳錯誤訊息字串；兩者都依 outcome 寫入快取。"""
+        try:
+            parsed = _parse_forward_response(_post_json(url, payload))
+            outcome = cache.OUTCOME_SUCCESS if parsed["products"] else cache.OUTCOME_EMPTY
+            cache.set(cache_key, parsed, outcome=outcome)
+            return parsed
+        except http_transport.TransportTimeout:
+            text = f"調用 AskCOS {engine_name} API 失敗，Curl 命令執行超時。"
+            cache.set(cache_key, text, outcome=cache.OUTCOME_TRANSIENT_ERROR)
+            return text
+        except http_transport.TransportError as e:
+            text = f"調用 AskCOS {engine_name} API 失敗，Curl 退出代碼: {e.returncode}。錯誤詳情:\n{e.stderr}"
+            cache.set(cache_key, text, outcome=cache.OUTCOME_TRANSIENT_ERROR)
+            return text
+        except Exception as e:
+            return f"AskCOS {engine_name} 發生未知錯誤: {e}"
+
+    cached = cache.get_or_revalidate(cache_key, lambda: singleflight.run(cache_key, _fetch))
+    if isinstance(cached, dict):
         print(f"  -> 命中快取：AskCOS 正向預測 {engine_name}")
+        return _summarize_forward_results(engine_name, full_reactants_smiles, cached, top_k)
+    if isinstance(cached, str) and cached.strip():
+        # 短期負向快取：剛失敗過的請求不重打引擎
         return cached
 
-    try:
-        data = _post_json(url, payload)
-        final_summary = _summarize_forward_results(engine_name, full_reactants_smiles, data, top_k)
-        cache.set(cache_key, final_summary)
-        return final_summary
-    except subprocess.CalledProcessError as e:
-        return f"調用 AskCOS {engine_name} API 失敗，Curl 退出代碼: {e.returncode}。錯誤詳情:\n{e.stderr}"
-    except subprocess.TimeoutExpired:
-        return f"調用 AskCOS {engine_name} API 失敗，Curl 命令執行超時。"
-    except FileNotFoundError:
-        return "錯誤: 找不到 'curl' 命令。請確保它已安裝在系統 PATH 中。"
-    except Exception as e:
-        return f"AskCOS {engine_name} 發生未知錯誤: {e}"
+    result = singleflight.run(cache_key, _fetch, lookup=singleflight.record_lookup(cache_key))
+    if isinstance(result, dict):
+        return _summarize_forward_results(engine_name, full_reactants_smiles, result, top_k)
+    return result
 
 
 def run_askcos_forward_prediction(reactants_smiles_list: Any, top_k: int = 3) -> str:
@@ -180,11 +216,15 @@ def run_askcos_forward_prediction_wldn5(reactants_smiles_list: Any, top_k: int =
 
 
 def run_askcos_forward_prediction_compare(reactants_smiles_list: Any, top_k: int = 3) -> str:
-    sections = [
-        ("WLDN5_PISTACHIO", run_askcos_forward_prediction(reactants_smiles_list=reactants_smiles_list, top_k=top_k)),
-        ("USPTO_STEREO", run_askcos_forward_prediction_uspto_stereo(reactants_smiles_list=reactants_smiles_list, top_k=top_k)),
-        ("GRAPH2SMILES_PISTACHIO", run_askcos_forward_prediction_graph2smiles(reactants_smiles_list=reactants_smiles_list, top_k=top_k)),
+    kwargs = {"reactants_smiles_list": reactants_smiles_list, "top_k": top_k}
+    engines = [
+        ("WLDN5_PISTACHIO", run_askcos_forward_prediction),
+        ("USPTO_STEREO", run_askcos_forward_prediction_uspto_stereo),
+        ("GRAPH2SMILES_PISTACHIO", run_askcos_forward_prediction_graph2smiles),
     ]
+    sections = fanout.run_engines(
+        [(name, lambda fn=fn: fn(**kwargs), COMPARE_ENGINE_DEADLINE_SEC) for name, fn in engines]
+    )
     return "以下是多引擎正向預測比較結果，請比較產物候選、分數與差異：\n\n" + "\n\n".join(
         [f"=== {name} ===\n{text}" for name, text in sections]
     )
\ No newline at end of file
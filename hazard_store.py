@@ -0,0 +1,420 @@
+"""
+本地 GHS 危害資料庫（SQLite）：路線推薦的危害檢查先查這裡，查不到才打 PubChem，
+查到的結果再寫回，之後同一分子完全離線。
+
+資料表：
+  hazards(cid PK, inchikey, hcodes, keywords, source, fetched_at, statements, keywords_hash)
+      hcodes   JSON list，例如 ["H225", "H319"]（保存全部 H-code，不限 risk_rules.json 已列者，
+               規則調整時不必重建資料庫）
+      keywords JSON list，寫入當下命中的 risk_rules.json 關鍵字（小寫）
+      statements     危害敘述文字（小寫、去重；空字串 = PubChem 確認無危害章節，NULL = 未保存）；
+                     關鍵字規則變動時據此離線重新比對
+      keywords_hash  寫入時 rule_keywords() 的 hash。lookup(keywords=...) 與目前規則不符時，
+                     有 statements 就重新比對並寫回，沒有（舊版資料列）則視為查無、改打 PubChem
+  aliases(smiles PK, cid)
+      SMILES → CID 對照；只存 cid > 0。查無 CID 由快取的 not_found TTL 記住，不永久存放
+      （舊版寫入的 cid=0 列在查詢時忽略：可能是 PubChem 限流時誤判）
+
+每個 thread 各自一條連線（WAL 模式，多行程讀寫安全），查詢走主鍵/索引，單筆約數十微秒。
+
+CLI：
+  python hazard_store.py import dump.csv [--rules risk_rules.json] [--source ghs_dump]
+  python hazard_store.py lookup <SMILES | InChIKey | CID>
+  python hazard_store.py stats
+
+匯入檔可為 CSV / TSV / JSONL，欄位（大小寫不拘）：
+  cid, inchikey, smiles, hcodes（任意分隔，例如 "H225; H319" 或 "H300+H310"）,
+  statements（選填，危害敘述文字，用於比對 risk_rules.json 的關鍵字）
+
+環境變數：
+  ASKLLM_HAZARD_DB            資料庫路徑（預設 runtime_jobs/hazard_store.sqlite3）
+  ASKLLM_HAZARD_DB_DISABLE=1  關閉本地資料庫（只走 PubChem）
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import chem_canon
+
+
+DB_PATH = os.environ.get(
+    "ASKLLM_HAZARD_DB",
+    os.path.join(os.path.dirname(__file__), "runtime_jobs", "hazard_store.sqlite3"),
+)
+DISABLE = os.environ.get("ASKLLM_HAZARD_DB_DISABLE", "0") == "1"
+RISK_RULES_PATH = os.path.join(os.path.dirname(__file__), "risk_rules.json")
+
+# H360FD、H300+H310 這類寫法也要拆出 H360 / H300 / H310
+HCODE_RE = re.compile(r"\bH\d{3}(?!\d)")
+_INCHIKEY_RE = re.compile(r"^[A-Z]{14}-[A-Z]{10}-[A-Z]$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hazards (
+    cid INTEGER PRIMARY KEY,
+    inchikey TEXT,
+    hcodes TEXT NOT NULL,
+    keywords TEXT NOT NULL,
+    source TEXT,
+    fetched_at INTEGER,
+    statements TEXT,
+    keywords_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_hazards_inchikey ON hazards(inchikey);
+CREATE TABLE IF NOT EXISTS aliases (
+    smiles TEXT PRIMARY KEY,
+    cid INTEGER NOT NULL
+);
+"""
+
+# 舊版資料庫沒有的欄位（_connect 時補上）
+_ADDED_COLUMNS = (("statements", "TEXT"), ("keywords_hash", "TEXT"))
+_SELECT = "SELECT cid, inchikey, hcodes, keywords, source, fetched_at, statements, keywords_hash FROM hazards"
+
+_local = threading.local()
+
+
+def extract_hcodes(text: str) -> List[str]:
+    return sorted(set(HCODE_RE.findall(str(text or "").upper())))
+
+
+def rule_keywords(rules: Dict[str, Any]) -> List[str]:
+    """risk_rules.json 中 high/medium/low 三組關鍵字的聯集（小寫）。"""
+    pubchem_rules = rules.get("pubchem", {}) if isinstance(rules.get("pubchem", {}), dict) else {}
+    out: List[str] = []
+    for level in ("high_keywords", "medium_keywords", "low_keywords"):
+        for kw in pubchem_rules.get(level, []) or []:
+            kw = str(kw).strip().lower()
+            if kw and kw not in out:
+                out.append(kw)
+    return out
+
+
+def keywords_hash(keywords: Iterable[str]) -> str:
+    return hashlib.sha256(json.dumps(sorted(set(keywords)), ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def match_keywords(statements: str, keywords: Iterable[str]) -> List[str]:
+    text = str(statements or "").lower()
+    return [kw for kw in keywords if kw in text]
+
+
+def _connect() -> Optional[sqlite3.Connection]:
+    if DISABLE:
+        return None
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+    try:
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(hazards)")}
+        for column, kind in _ADDED_COLUMNS:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE hazards ADD COLUMN {column} {kind}")
+        conn.commit()
+    except sqlite3.Error:
+        return None
+    _local.conn = conn
+    return conn
+
+
+def _row_to_record(row: Any) -> Dict[str, Any]:
+    cid, inchikey, hcodes, keywords, source, fetched_at, statements, kw_hash = row
+    return {
+        "cid": int(cid),
+        "inchikey": inchikey or "",
+        "hcodes": json.loads(hcodes or "[]"),
+        "keywords": json.loads(keywords or "[]"),
+        "source": source or "",
+        "fetched_at": int(fetched_at or 0),
+        "statements": statements,
+        "keywords_hash": kw_hash or "",
+    }
+
+
+def _by_cid(conn: sqlite3.Connection, cid: int) -> Optional[Dict[str, Any]]:
+    row = conn.execute(f"{_SELECT} WHERE cid = ?", (int(cid),)).fetchone()
+    return _row_to_record(row) if row else None
+
+
+def _current(conn: sqlite3.Connection, record: Dict[str, Any], keywords: List[str]) -> Optional[Dict[str, Any]]:
+    """依目前規則關鍵字校正紀錄：hash 相符原樣回傳；不符時以 statements 重新比對並寫回，未保存 statements 回傳 None。"""
+    current_hash = keywords_hash(keywords)
+    if record["keywords_hash"] == current_hash:
+        return record
+    if record["statements"] is None:
+        return None
+    record["keywords"] = match_keywords(record["statements"], keywords)
+    record["keywords_hash"] = current_hash
+    try:
+        with conn:
+            conn.execute(
+                "UPDATE hazards SET keywords = ?, keywords_hash = ? WHERE cid = ?",
+                (json.dumps(sorted(set(record["keywords"])), ensure_ascii=False), current_hash, record["cid"]),
+            )
+    except sqlite3.Error:
+        pass
+    return record
+
+
+def lookup_cid(smiles: str) -> Optional[int]:
+    """SMILES → CID；沒有對照時回傳 None。"""
+    conn = _connect()
+    if conn is None or not smiles:
+        return None
+    try:
+        row = conn.execute("SELECT cid FROM aliases WHERE smiles = ?", (chem_canon.canonical_smiles(smiles),)).fetchone()
+    except sqlite3.Error:
+        return None
+    return int(row[0]) if row and int(row[0]) > 0 else None
+
+
+def lookup(
+    smiles: Optional[str] = None,
+    inchikey: Optional[str] = None,
+    cid: Optional[int] = None,
+    keywords: Optional[List[str]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    依 CID → InChIKey → SMILES 的順序查詢危害紀錄；查無回傳 None。
+    給 keywords（目前的 rule_keywords）時，紀錄的關鍵字命中會對齊目前規則（見 _current）。
+    """
+    conn = _connect()
+    if conn is None:
+        return None
+    hit = None
+    try:
+        if cid:
+            hit = _by_cid(conn, cid)
+        if hit is None and inchikey:
+            row = conn.execute(f"{_SELECT} WHERE inchikey = ? LIMIT 1", (inchikey.strip().upper(),)).fetchone()
+            hit = _row_to_record(row) if row else None
+        if hit is None and smiles:
+            row = conn.execute("SELECT cid FROM aliases WHERE smiles = ?", (chem_canon.canonical_smiles(smiles),)).fetchone()
+            if row and int(row[0]) > 0:
+                hit = _by_cid(conn, int(row[0]))
+    except sqlite3.Error:
+        return None
+    if hit is None or keywords is None:
+        return hit
+    return _current(conn, hit, keywords)
+
+
+def _upsert(
+    conn: sqlite3.Connection,
+    cid: int,
+    hcodes: Iterable[str],
+    keywords: Iterable[str],
+    smiles: Optional[str],
+    inchikey: Optional[str],
+    source: str,
+    fetched_at: Optional[int],
+    statements: Optional[str],
+    kw_hash: Optional[str],
+) -> None:
+    conn.execute(
+        "INSERT INTO hazards (cid, inchikey, hcodes, keywords, source, fetched_at, statements, keywords_hash) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(cid) DO UPDATE SET inchikey = COALESCE(excluded.inchikey, hazards.inchikey), "
+        "hcodes = excluded.hcodes, keywords = excluded.keywords, source = excluded.source, "
+        "fetched_at = excluded.fetched_at, statements = excluded.statements, "
+        "keywords_hash = excluded.keywords_hash",
+        (
+            int(cid),
+            inchikey.strip().upper() if inchikey else None,
+            json.dumps(sorted(set(hcodes))),
+            json.dumps(sorted(set(keywords)), ensure_ascii=False),
+            source,
+            int(fetched_at or time.time()),
+            str(statements).lower() if statements is not None else None,
+            kw_hash or None,
+        ),
+    )
+    if smiles:
+        conn.execute("INSERT OR REPLACE INTO aliases (smiles, cid) VALUES (?, ?)", (chem_canon.canonical_smiles(smiles), int(cid)))
+
+
+def put(
+    cid: int,
+    hcodes: Iterable[str],
+    keywords: Iterable[str] = (),
+    smiles: Optional[str] = None,
+    inchikey: Optional[str] = None,
+    source: str = "pubchem",
+    fetched_at: Optional[int] = None,
+    statements: Optional[str] = None,
+    kw_hash: Optional[str] = None,
+) -> bool:
+    """kw_hash 為比對 keywords 時所用 rule_keywords() 的 keywords_hash；不給則下次帶 keywords 查詢時視為過期。"""
+    conn = _connect()
+    if conn is None or int(cid) <= 0:
+        return False
+    try:
+        with conn:
+            _upsert(conn, cid, hcodes, keywords, smiles, inchikey, source, fetched_at, statements, kw_hash)
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def put_alias(smiles: str, cid: int) -> bool:
+    conn = _connect()
+    if conn is None or not smiles or int(cid) <= 0:
+        return False
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO aliases (smiles, cid) VALUES (?, ?)", (chem_canon.canonical_smiles(smiles), int(cid)))
+        return True
+    except sqlite3.Error:
+        return False
+
+
+def put_many(records: Iterable[Dict[str, Any]], source: str = "import", batch_size: int = 5000) -> int:
+    """批次寫入（每 batch_size 筆一個 transaction）；record 欄位同 put()（kw_hash 對應 "keywords_hash"）。回傳寫入筆數。"""
+    conn = _connect()
+    if conn is None:
+        return 0
+    count = 0
+    pending = 0
+    try:
+        conn.execute("BEGIN")
+        for rec in records:
+            cid = int(rec.get("cid") or 0)
+            if cid <= 0:
+                continue
+            _upsert(
+                conn,
+                cid,
+                rec.get("hcodes") or [],
+                rec.get("keywords") or [],
+                rec.get("smiles"),
+                rec.get("inchikey"),
+                str(rec.get("source") or source),
+                rec.get("fetched_at"),
+                rec.get("statements"),
+                rec.get("keywords_hash"),
+            )
+            count += 1
+            pending += 1
+            if pending >= batch_size:
+                conn.execute("COMMIT")
+                conn.execute("BEGIN")
+                pending = 0
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return count
+
+
+def stats() -> Dict[str, Any]:
+    conn = _connect()
+    if conn is None:
+        return {"enabled": False, "path": DB_PATH}
+    hazards = conn.execute("SELECT COUNT(*) FROM hazards").fetchone()[0]
+    with_hcodes = conn.execute("SELECT COUNT(*) FROM hazards WHERE hcodes != '[]'").fetchone()[0]
+    aliases = conn.execute("SELECT COUNT(*) FROM aliases").fetchone()[0]
+    no_cid = conn.execute("SELECT COUNT(*) FROM aliases WHERE cid = 0").fetchone()[0]
+    return {
+        "enabled": True,
+        "path": DB_PATH,
+        "compounds": hazards,
+        "compounds_with_hcodes": with_hcodes,
+        "smiles_aliases": aliases,
+        "smiles_without_cid": no_cid,
+    }
+
+
+def _iter_dump_rows(path: str) -> Iterator[Dict[str, Any]]:
+    lower = path.lower()
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if lower.endswith(".jsonl") or lower.endswith(".ndjson"):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(row, dict):
+                    yield {str(k).strip().lower(): v for k, v in row.items()}
+            return
+        delimiter = "\t" if lower.endswith(".tsv") else ","
+        for row in csv.DictReader(f, delimiter=delimiter):
+            yield {str(k).strip().lower(): v for k, v in row.items() if k}
+
+
+def _dump_records(path: str, keywords: List[str]) -> Iterator[Dict[str, Any]]:
+    kw_hash = keywords_hash(keywords)
+    for row in _iter_dump_rows(path):
+        raw_hcodes = row.get("hcodes") or row.get("h_codes") or ""
+        if isinstance(raw_hcodes, list):
+            raw_hcodes = " ".join(str(x) for x in raw_hcodes)
+        statements = row.get("statements") or ""
+        if isinstance(statements, list):
+            statements = " ".join(str(x) for x in statements)
+        text = f"{raw_hcodes} {statements}".lower()
+        yield {
+            "cid": row.get("cid"),
+            "inchikey": row.get("inchikey") or None,
+            "smiles": row.get("smiles") or None,
+            "hcodes": extract_hcodes(f"{raw_hcodes} {statements}"),
+            "keywords": match_keywords(text, keywords),
+            "statements": text.strip(),
+            "keywords_hash": kw_hash,
+        }
+
+
+def _load_rules(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地 GHS 危害資料庫")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="從 PubChem/GHS dump（CSV/TSV/JSONL）批次匯入")
+    p_import.add_argument("path")
+    p_import.add_argument("--rules", default=RISK_RULES_PATH)
+    p_import.add_argument("--source", default="ghs_dump")
+    p_lookup = sub.add_parser("lookup", help="以 SMILES / InChIKey / CID 查詢")
+    p_lookup.add_argument("key")
+    sub.add_parser("stats", help="顯示資料庫統計")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        started = time.time()
+        keywords = rule_keywords(_load_rules(args.rules))
+        count = put_many(_dump_records(args.path, keywords), source=args.source)
+        print(f"匯入完成：{count} 筆（{time.time() - started:.1f} 秒）→ {DB_PATH}")
+    elif args.command == "lookup":
+        key = args.key.strip()
+        if key.isdigit():
+            hit = lookup(cid=int(key))
+        elif _INCHIKEY_RE.match(key.upper()):
+            hit = lookup(inchikey=key)
+        else:
+            hit = lookup(smiles=key)
+        print(json.dumps(hit, ensure_ascii=False, indent=2) if hit else "查無資料")
+    else:
+        print(json.dumps(stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
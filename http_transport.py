@@ -0,0 +1,284 @@
+"""
+共用 HTTP 傳輸層：以 per-host 連線池 + keep-alive 取代每次呼叫 fork 一個 curl。
+
+請求本文直接寫入 socket（不再經 argv），避免大 payload 撞到參數長度上限。
+HTTP 錯誤狀態碼不視為例外：與原本 curl（未加 -f）一致，回傳本文交由呼叫端判讀。
+
+每次請求都會經過 endpoint_registry：已知離線的端點直接 fast-fail（EndpointUnavailable），
+失敗以 jittered backoff 重試，一次呼叫（含重試）只回報一次結果給 circuit breaker。
+重試範圍：
+  - 連線失敗（請求尚未送出）與 502/503：任何 method
+  - 連線中途中斷與 504：只限冪等 method（GET 等）；POST 可能已在伺服器端執行（tree search、
+    multistep job），重送會讓同一工作跑好幾次
+逾時不重試（tree search 一次就可能數百秒）。
+
+環境變數：
+  ASKLLM_HTTP_POOL_SIZE     每個 host 最多保留幾條閒置連線（預設 8）
+  ASKLLM_HTTP_USER_AGENT    User-Agent（預設 askllm-http/1.0）
+"""
+
+import http.client
+import json
+import os
+import socket
+import ssl
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode, urlsplit
+
+import endpoint_registry
+
+
+POOL_SIZE = int(os.environ.get("ASKLLM_HTTP_POOL_SIZE", "8"))
+USER_AGENT = os.environ.get("ASKLLM_HTTP_USER_AGENT", "askllm-http/1.0")
+
+# 與 curl 退出代碼對齊，讓既有錯誤訊息（「Curl 退出代碼: N」）維持不變。
+EXIT_CONNECT_FAILED = 7
+EXIT_TIMEOUT = 28
+EXIT_EMPTY_REPLY = 52
+EXIT_RECV_ERROR = 56
+
+
+class TransportError(RuntimeError):
+    """傳輸層錯誤；returncode/stderr 沿用 curl 語意，方便既有 except 分支直接換型別。"""
+
+    def __init__(self, message: str, returncode: int = EXIT_RECV_ERROR):
+        super().__init__(message)
+        self.returncode = returncode
+        self.stderr = message
+
+
+class TransportTimeout(TransportError):
+    def __init__(self, message: str):
+        super().__init__(message, returncode=EXIT_TIMEOUT)
+
+
+class EndpointUnavailable(TransportError):
+    """circuit breaker 判定端點離線，未實際送出請求。"""
+
+    def __init__(self, message: str):
+        super().__init__(message, returncode=EXIT_CONNECT_FAILED)
+
+
+# 這些狀態碼通常代表容器/閘道暫時不可用，值得退避後重試
+_RETRYABLE_STATUS = {502, 503, 504}
+# 504 代表上游可能已收到請求，只對冪等 method 重試
+_IDEMPOTENT_ONLY_STATUS = {504}
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+_PoolKey = Tuple[str, str, int]
+
+_pools: Dict[_PoolKey, List[http.client.HTTPConnection]] = {}
+_pools_lock = threading.Lock()
+_ssl_context: Optional[ssl.SSLContext] = None
+
+# 重用閒置連線時，對方可能早已關閉 keep-alive；這些錯誤值得換新連線重送一次。
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+def _pool_key(url: str) -> Tuple[_PoolKey, str]:
+    parts = urlsplit(url)
+    scheme = (parts.scheme or "http").lower()
+    if scheme not in {"http", "https"}:
+        raise TransportError(f"不支援的 URL scheme: {scheme}", returncode=1)
+    host = parts.hostname or "127.0.0.1"
+    port = parts.port or (443 if scheme == "https" else 80)
+    path = parts.path or "/"
+    if parts.query:
+        path = f"{path}?{parts.query}"
+    return (scheme, host, port), path
+
+
+def _new_connection(key: _PoolKey, timeout_sec: float) -> http.client.HTTPConnection:
+    global _ssl_context
+    scheme, host, port = key
+    if scheme == "https":
+        if _ssl_context is None:
+            _ssl_context = ssl.create_default_context()
+        return http.client.HTTPSConnection(host, port, timeout=timeout_sec, context=_ssl_context)
+    return http.client.HTTPConnection(host, port, timeout=timeout_sec)
+
+
+def _acquire(key: _PoolKey, timeout_sec: float) -> Tuple[http.client.HTTPConnection, bool]:
+    with _pools_lock:
+        idle = _pools.get(key)
+        if idle:
+            conn = idle.pop()
+            conn.timeout = timeout_sec
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout_sec)
+            return conn, True
+    return _new_connection(key, timeout_sec), False
+
+
+def _release(key: _PoolKey, conn: http.client.HTTPConnection) -> None:
+    with _pools_lock:
+        idle = _pools.setdefault(key, [])
+        if len(idle) < POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close()
+
+
+def close_all() -> int:
+    """關閉所有閒置連線（測試或 fork 前使用）。"""
+    with _pools_lock:
+        conns = [c for idle in _pools.values() for c in idle]
+        _pools.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+    return len(conns)
+
+
+def _request_once(
+    method: str,
+    url: str,
+    key: _PoolKey,
+    path: str,
+    body: Optional[bytes],
+    headers: Dict[str, str],
+    timeout_sec: float,
+) -> Tuple[int, bytes]:
+    idempotent = method.upper() in _IDEMPOTENT_METHODS
+    for attempt in range(2):
+        conn, reused = _acquire(key, timeout_sec)
+        sent = False
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            sent = True
+            resp = conn.getresponse()
+            data = resp.read()
+        except _STALE_CONNECTION_ERRORS as e:
+            conn.close()
+            # 閒置連線已被對方關閉：送出時就失敗必定未執行；送出後才斷線只有冪等 method 能重送
+            if reused and attempt == 0 and (idempotent or not sent):
+                continue
+            code = EXIT_EMPTY_REPLY if isinstance(e, http.client.RemoteDisconnected) else EXIT_RECV_ERROR
+            raise TransportError(f"{method} {url} 連線中斷：{e}", returncode=code) from e
+        except (socket.timeout, TimeoutError) as e:
+            conn.close()
+            raise TransportTimeout(f"{method} {url} 逾時（{timeout_sec} 秒）") from e
+        except (ConnectionRefusedError, socket.gaierror) as e:
+            conn.close()
+            raise TransportError(f"無法連線到 {url}：{e}", returncode=EXIT_CONNECT_FAILED) from e
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise TransportError(f"{method} {url} 失敗：{e}") from e
+
+        if resp.will_close:
+            conn.close()
+        else:
+            _release(key, conn)
+        return resp.status, data
+
+    raise TransportError(f"{method} {url} 失敗：連線重試後仍中斷", returncode=EXIT_RECV_ERROR)
+
+
+def request(
+    method: str,
+    url: str,
+    *,
+    body: Optional[bytes] = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout_sec: float = 60,
+    retries: Optional[int] = None,
+) -> Tuple[int, bytes]:
+    """
+    送出一次 HTTP 請求並回傳 (status, body)。連線錯誤/逾時轉成 TransportError。
+    retries=None 時使用 endpoint_registry.RETRIES；探測類請求可傳 0。
+    """
+    max_retries = endpoint_registry.RETRIES if retries is None else max(0, int(retries))
+    idempotent = method.upper() in _IDEMPOTENT_METHODS
+    key, path = _pool_key(url)
+    send_headers = {"User-Agent": USER_AGENT, "Accept": "application/json"}
+    send_headers.update(headers or {})
+    if body is not None:
+        send_headers["Content-Length"] = str(len(body))
+
+    # breaker 只在呼叫開始時檢查、結束時記一次：重試屬於同一次呼叫（half-open 的試探也包含其重試）
+    reason = endpoint_registry.allow(url)
+    if reason:
+        raise EndpointUnavailable(reason)
+    attempt = 0
+    while True:
+        try:
+            status, data = _request_once(method, url, key, path, body, send_headers, timeout_sec)
+        except TransportTimeout as e:
+            endpoint_registry.record_failure(url, str(e))
+            raise
+        except TransportError as e:
+            retryable = idempotent or e.returncode == EXIT_CONNECT_FAILED
+            if attempt >= max_retries or not retryable:
+                endpoint_registry.record_failure(url, str(e))
+                raise
+        else:
+            if status not in _RETRYABLE_STATUS:
+                endpoint_registry.record_success(url)
+                return status, data
+            retryable = idempotent or status not in _IDEMPOTENT_ONLY_STATUS
+            if attempt >= max_retries or not retryable:
+                endpoint_registry.record_failure(url, f"HTTP {status}")
+                return status, data
+        time.sleep(endpoint_registry.backoff_delay(attempt))
+        attempt += 1
+
+
+def _decode_json(data: bytes) -> Any:
+    return json.loads(data.decode("utf-8"))
+
+
+def post_json(url: str, payload: Any, timeout_sec: float = 60, retries: Optional[int] = None) -> Any:
+    """POST JSON 並解析回應 JSON（回應非 JSON 時拋出 ValueError，與原 json.loads 行為一致）。"""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    _, data = request(
+        "POST",
+        url,
+        body=body,
+        headers={"Content-Type": "application/json"},
+        timeout_sec=timeout_sec,
+        retries=retries,
+    )
+    return _decode_json(data)
+
+
+def _with_params(url: str, params: Optional[Dict[str, Any]]) -> str:
+    if not params:
+        return url
+    sep = "&" if "?" in url else "?"
+    return f"{url}{sep}{urlencode(params, quote_via=quote)}"
+
+
+def get_json(
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    timeout_sec: float = 30,
+    retries: Optional[int] = None,
+) -> Any:
+    _, data = request("GET", _with_params(url, params), timeout_sec=timeout_sec, retries=retries)
+    return _decode_json(data)
+
+
+def get_json_response(
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    timeout_sec: float = 30,
+    retries: Optional[int] = None,
+) -> Tuple[int, Any]:
+    """同 get_json，但一併回傳 HTTP 狀態碼；本文不是 JSON（例如閘道的 HTML 錯誤頁）時為 (status, None)。"""
+    status, data = request("GET", _with_params(url, params), timeout_sec=timeout_sec, retries=retries)
+    try:
+        return status, _decode_json(data)
+    except ValueError:
+        return status, None
+
@@ -3,6 +3,7 @@ import json
 import os
 from datetime import datetime, timezone
 
+import atomic_io
 from multistep_retrosynthesis import (
     run_askcos_multistep_retrosynthesis,
     run_askcos_multistep_retrosynthesis_compare,
@@ -35,9 +36,15 @@ def _read_job(job_id: str) -> dict:
 
 
 def _write_job(job_id: str, payload: dict) -> None:
+    """把 payload 的欄位併入 job 檔（持鎖 read-modify-write），保留提交端事後寫入的 pid 等欄位。"""
     os.makedirs(ASYNC_JOBS_DIR, exist_ok=True)
-    with open(_job_file_path(job_id), "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+
+    def _merge(job: dict) -> dict:
+        merged = job if isinstance(job, dict) else {}
+        merged.update(payload)
+        return merged
+
+    atomic_io.update_json(_job_file_path(job_id), _merge, default={})
 
 
 def main() -> None:
@@ -89,9 +96,7 @@ def main() -> None:
 
         result_file = str(job.get("result_file", ""))
         if result_file:
-            os.makedirs(os.path.dirname(result_file), exist_ok=True)
-            with open(result_file, "w", encoding="utf-8") as f:
-                f.write(str(text))
+            atomic_io.write_text(result_file, str(text))
 
         auto_analyze = bool(params.get("auto_analyze", True))
         if auto_analyze:
@@ -111,9 +116,7 @@ def main() -> None:
                 )
                 analysis_file = str(job.get("analysis_file", ""))
                 if analysis_file:
-                    os.makedirs(os.path.dirname(analysis_file), exist_ok=True)
-                    with open(analysis_file, "w", encoding="utf-8") as af:
-                        af.write(str(analyze_text))
+                    atomic_io.write_text(analysis_file, str(analyze_text))
                 job["analysis_status"] = "done"
                 job["analysis_error"] = ""
             except Exception as ae:
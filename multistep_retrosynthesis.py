@@ -1,19 +1,56 @@
 import json
 import os
+import random
 import subprocess
 import sys
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台：退回單一行程內計數
+    fcntl = None
 
 from askcos_tree_utils import parse_uds_paths, route_summary
+import atomic_io
 import cache_utils as cache
+import chem_canon
+import endpoint_registry
+import fanout
+import http_transport
+import singleflight
 
 
 ASKCOS_MULTISTEP_URL = "http://127.0.0.1:7000/get_buyable_paths"
 # 與本機 docker host 網路中的 retro_star_* 容器埠一致（依實際部署調整）
 ASKCOS_RETROSTAR_PORTS = [9322, 9323, 9324, 9325, 9326, 9327, 9328, 9329, 9330, 9331]
 ASYNC_JOBS_DIR = os.path.join(os.path.dirname(__file__), "runtime_jobs", "multistep")
+# Retro* replica 探測結果快取多久（秒）；過期時先回舊結果、背景重新探測
+RETROSTAR_DISCOVERY_TTL_SEC = int(os.environ.get("ASKLLM_RETROSTAR_DISCOVERY_TTL_SEC", "300"))
+# 每個 replica 同時最多幾個 Retro* 請求（跨行程，以 slot lock 檔計）
+RETROSTAR_MAX_INFLIGHT = int(os.environ.get("ASKLLM_RETROSTAR_MAX_INFLIGHT", "2"))
+# 所有 replica 都滿載時最多排隊多久，超過就送到最不忙的 replica
+RETROSTAR_SLOT_WAIT_SEC = int(os.environ.get("ASKLLM_RETROSTAR_SLOT_WAIT_SEC", "600"))
+RETROSTAR_SLOTS_DIR = os.path.join(os.path.dirname(__file__), "runtime_jobs", "retrostar_slots")
+
+_MULTISTEP_GROUP_TOOLS = [
+    "run_askcos_multistep_retrosynthesis_compare",
+    "run_askcos_multistep_retrosynthesis_async_submit",
+]
+endpoint_registry.register(
+    ASKCOS_MULTISTEP_URL,
+    tools=["run_askcos_multistep_retrosynthesis"] + _MULTISTEP_GROUP_TOOLS,
+)
+for _port in ASKCOS_RETROSTAR_PORTS:
+    endpoint_registry.register(
+        f"http://127.0.0.1:{_port}/get_buyable_paths",
+        tools=["run_askcos_multistep_retrosynthesis_retro_star"] + _MULTISTEP_GROUP_TOOLS,
+    )
 
 
 def _safe_float(v: Any, default: float = 0.0) -> float:
@@ -53,8 +90,19 @@ def _read_job(job_id: str) -> dict:
 
 def _write_job(job_id: str, payload: dict) -> None:
     _ensure_async_jobs_dir()
-    with open(_job_file_path(job_id), "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    atomic_io.write_json(_job_file_path(job_id), payload)
+
+
+def _update_job(job_id: str, mutate: Callable[[dict], None]) -> dict:
+    """鎖住 job 檔做 read-modify-write；背景 runner 同時更新狀態時不會互相蓋掉欄位。"""
+    _ensure_async_jobs_dir()
+
+    def _apply(job: Any) -> dict:
+        job = job if isinstance(job, dict) else {}
+        mutate(job)
+        return job
+
+    return atomic_io.update_json(_job_file_path(job_id), _apply, default={})
 
 
 def _list_jobs() -> list:
@@ -108,22 +156,156 @@ def _format_route_summary(item: dict) -> str:
     return "\n".join(lines)
 
 
-def _detect_retro_star_url() -> str:
-    for port in ASKCOS_RETROSTAR_PORTS:
+def _retro_star_url(port: int) -> str:
+    return f"http://127.0.0.1:{port}/get_buyable_paths"
+
+
+_retro_star_lock = threading.Lock()
+_retro_star_ports: List[int] = []
+_retro_star_discovered_at = 0.0
+_retro_star_refreshing = False
+_retro_star_local_inflight: Dict[int, int] = {}
+
+
+def _probe_retro_star_port(port: int) -> bool:
+    try:
+        api = http_transport.get_json(f"http://127.0.0.1:{port}/openapi.json", timeout_sec=5, retries=0)
+        return "/get_buyable_paths" in (api.get("paths") or {})
+    except Exception:
+        return False
+
+
+def _discover_retro_star_ports() -> List[int]:
+    """並行探測所有 Retro* 埠（最多約 5 秒），結果寫入共用快取讓其他行程沿用。"""
+    with ThreadPoolExecutor(max_workers=len(ASKCOS_RETROSTAR_PORTS)) as pool:
+        flags = list(pool.map(_probe_retro_star_port, ASKCOS_RETROSTAR_PORTS))
+    ports = [p for p, ok in zip(ASKCOS_RETROSTAR_PORTS, flags) if ok]
+    cache.set(cache.build_key("askcos:retrostar:ports:v1", ports=ASKCOS_RETROSTAR_PORTS), ports)
+    return ports
+
+
+def _refresh_retro_star_ports() -> None:
+    global _retro_star_ports, _retro_star_discovered_at, _retro_star_refreshing
+    try:
+        ports = _discover_retro_star_ports()
+        with _retro_star_lock:
+            _retro_star_ports = ports
+            _retro_star_discovered_at = time.monotonic()
+    finally:
+        with _retro_star_lock:
+            _retro_star_refreshing = False
+
+
+def _retro_star_healthy_ports() -> List[int]:
+    """
+    回傳目前可用的 Retro* 埠。第一次呼叫時先看共用快取，沒有才同步探測；
+    之後過期只在背景重新探測，呼叫端永遠不需要等探測。
+    """
+    global _retro_star_ports, _retro_star_discovered_at, _retro_star_refreshing
+    with _retro_star_lock:
+        known = _retro_star_discovered_at > 0
+        stale = known and time.monotonic() - _retro_star_discovered_at > RETROSTAR_DISCOVERY_TTL_SEC
+        start_refresh = stale and not _retro_star_refreshing
+        if start_refresh:
+            _retro_star_refreshing = True
+        ports = list(_retro_star_ports)
+
+    if not known:
+        shared = cache.get(
+            cache.build_key("askcos:retrostar:ports:v1", ports=ASKCOS_RETROSTAR_PORTS),
+            ttl_sec=RETROSTAR_DISCOVERY_TTL_SEC,
+        )
+        ports = [int(p) for p in shared] if isinstance(shared, list) else _discover_retro_star_ports()
+        with _retro_star_lock:
+            _retro_star_ports = ports
+            _retro_star_discovered_at = time.monotonic()
+    elif start_refresh:
+        threading.Thread(target=_refresh_retro_star_ports, name="askllm-retrostar-discovery", daemon=True).start()
+
+    alive = [p for p in ports if endpoint_registry.is_available(endpoint_registry.endpoint_key(_retro_star_url(p)))]
+    return alive or ports or [ASKCOS_RETROSTAR_PORTS[0]]
+
+
+def _slot_path(port: int, idx: int) -> str:
+    return os.path.join(RETROSTAR_SLOTS_DIR, f"{port}.{idx}.lock")
+
+
+def _retro_star_busy(port: int) -> int:
+    if fcntl is None:
+        with _retro_star_lock:
+            return _retro_star_local_inflight.get(port, 0)
+    busy = 0
+    for idx in range(RETROSTAR_MAX_INFLIGHT):
         try:
-            probe = subprocess.run(
-                ["curl", "-sS", f"http://127.0.0.1:{port}/openapi.json"],
-                capture_output=True,
-                text=True,
-                check=True,
-                timeout=5,
-            )
-            api = json.loads(probe.stdout)
-            if "/get_buyable_paths" in (api.get("paths") or {}):
-                return f"http://127.0.0.1:{port}/get_buyable_paths"
-        except Exception:
+            with open(_slot_path(port, idx), "a") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                except OSError:
+                    busy += 1
+        except OSError:
             continue
-    return "http://127.0.0.1:9322/get_buyable_paths"
+    return busy
+
+
+def _try_take_slot(port: int) -> Optional[Any]:
+    """拿到 slot 回傳 handle（釋放時交給 _release_slot），滿載回傳 None。"""
+    if fcntl is None:
+        with _retro_star_lock:
+            if _retro_star_local_inflight.get(port, 0) >= RETROSTAR_MAX_INFLIGHT:
+                return None
+            _retro_star_local_inflight[port] = _retro_star_local_inflight.get(port, 0) + 1
+            return port
+    for idx in range(RETROSTAR_MAX_INFLIGHT):
+        f = open(_slot_path(port, idx), "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except OSError:
+            f.close()
+    return None
+
+
+def _release_slot(port: int, handle: Any) -> None:
+    if handle is None:
+        return
+    if fcntl is None:
+        with _retro_star_lock:
+            _retro_star_local_inflight[port] = max(0, _retro_star_local_inflight.get(port, 0) - 1)
+        return
+    try:
+        fcntl.flock(handle, fcntl.LOCK_UN)
+    finally:
+        handle.close()
+
+
+@contextmanager
+def _retro_star_dispatch() -> Iterator[str]:
+    """
+    取得 in-flight 最少、且未達 RETROSTAR_MAX_INFLIGHT 的 Retro* replica URL。
+    slot 以 flock 鎖檔表示，async job 子行程與 compare 執行緒都看得到彼此的負載。
+    """
+    os.makedirs(RETROSTAR_SLOTS_DIR, exist_ok=True)
+    deadline = time.monotonic() + RETROSTAR_SLOT_WAIT_SEC
+    while True:
+        ports = _retro_star_healthy_ports()
+        busy = {p: _retro_star_busy(p) for p in ports}
+        for port in sorted(ports, key=lambda p: busy[p]):
+            if busy[port] >= RETROSTAR_MAX_INFLIGHT:
+                continue
+            handle = _try_take_slot(port)
+            if handle is None:
+                continue
+            try:
+                yield _retro_star_url(port)
+            finally:
+                _release_slot(port, handle)
+            return
+        if time.monotonic() >= deadline:
+            # 排隊太久：不再等 slot，直接送到目前最不忙的 replica
+            yield _retro_star_url(min(ports, key=lambda p: busy[p]))
+            return
+        time.sleep(1.0 + random.random())
 
 
 def _curl_wall_timeout_seconds(expansion_time: int, backend_label: str) -> int:
@@ -137,6 +319,60 @@ def _curl_wall_timeout_seconds(expansion_time: int, backend_label: str) -> int:
     return base
 
 
+def _parse_multistep_response(data: Any) -> Dict[str, Any]:
+    """tree search 回應 -> 可快取的紀錄：統計值 + 每條路徑的 route_summary（無 UDS 時保留原始 pathways）。"""
+    data = data if isinstance(data, dict) else {}
+    results_obj = data.get("results", {})
+    results_obj = results_obj if isinstance(results_obj, dict) else {}
+    stats_obj = results_obj.get("stats", {}) or {}
+    uds_obj = results_obj.get("uds", {})
+    parsed_routes = parse_uds_paths(uds_obj if isinstance(uds_obj, dict) else {})
+
+    pathways = (
+        results_obj.get("paths")
+        or results_obj.get("pathways")
+        or data.get("paths")
+        or data.get("pathways")
+        or []
+    )
+    total_paths = int(
+        stats_obj.get("total_paths", data.get("total_paths", len(pathways) if isinstance(pathways, list) else 0))
+    )
+    return {
+        "total_paths": total_paths,
+        "total_chemicals": int(stats_obj.get("total_chemicals", data.get("total_chemicals", 0))),
+        "total_reactions": int(stats_obj.get("total_reactions", data.get("total_reactions", 0))),
+        "routes": [route_summary(rt) for rt in parsed_routes],
+        "pathways": [] if parsed_routes else list(pathways if isinstance(pathways, list) else []),
+    }
+
+
+def _format_multistep_record(backend_label: str, record: Dict[str, Any], max_paths: int) -> str:
+    total_paths = record.get("total_paths", 0)
+    total_chemicals = record.get("total_chemicals", 0)
+    total_reactions = record.get("total_reactions", 0)
+    routes = record.get("routes") or []
+    pathways = record.get("pathways") or []
+
+    if not routes and not pathways and total_paths <= 0:
+        return (
+            f"AskCOS 多步逆合成（{backend_label}）未找到可回推到可購買起始物的完整路徑。\n"
+            f"搜尋統計：total_paths={total_paths}，total_chemicals={total_chemicals}，total_reactions={total_reactions}"
+        )
+
+    lines = [
+        f"AskCOS 多步逆合成（{backend_label}）完成。共找到 {total_paths} 條路徑。",
+        f"搜尋統計：total_chemicals={total_chemicals}，total_reactions={total_reactions}",
+    ]
+    if routes:
+        for item in routes[:max_paths]:
+            lines.append(_format_route_summary(item))
+    else:
+        for idx, pathway in enumerate(pathways[:max_paths], start=1):
+            lines.append(_format_pathway_item(pathway, idx))
+    return "\n".join(lines)
+
+
 def _run_backend(
     *,
     backend_label: str,
@@ -145,84 +381,86 @@ def _run_backend(
     max_paths: int,
     expansion_time: int,
     use_cache: bool,
+    dispatch: Optional[Callable[[], ContextManager[str]]] = None,
 ) -> str:
-    cache_key = cache.build_key(f"askcos:multistep:{backend_label}:v1", url=endpoint_url, payload=payload)
+    """
+    endpoint_url 同時作為 cache key 的一部分；若給 dispatch，實際請求改送到
+    dispatch() 取得的 replica URL（多 replica 時 cache key 仍保持穩定）。
+
+    快取存的是解析後的搜尋結果（不含 enumerate_paths_options.max_paths），
+    只要先前抓過的路徑數足夠（或引擎本來就只找到這麼多），換 max_paths 直接重用。
+    """
+    key_payload = json.loads(json.dumps(payload))
+    fetched_max_paths = int((key_payload.get("enumerate_paths_options") or {}).pop("max_paths", max_paths) or max_paths)
+    key_payload["smiles"] = chem_canon.canonical_smiles(key_payload.get("smiles"))
+    cache_key = cache.build_key(f"askcos:multistep:{backend_label}:raw:v2", url=endpoint_url, payload=key_payload)
+
+    def _usable(record: Any) -> Optional[Dict[str, Any]]:
+        if not isinstance(record, dict):
+            return None
+        fetched = int(record.get("fetched_max_paths") or 0)
+        available = len(record.get("routes") or []) or len(record.get("pathways") or [])
+        if fetched >= max_paths or available < fetched:
+            return record
+        return None
+
     if use_cache:
-        cached = cache.get(cache_key)
-        if isinstance(cached, str) and cached.strip():
+        hit = cache.get(cache_key)
+        if isinstance(hit, str) and hit.strip():
+            # 短期負向快取：剛逾時 / 失敗的搜尋不立刻重跑
+            return hit
+        cached = _usable(hit)
+        if cached is not None:
             print(f"  -> 命中快取：AskCOS 多步逆合成（{backend_label}）")
-            return cached
-
-    try:
-        result = subprocess.run(
-            [
-                "curl",
-                endpoint_url,
-                "--header",
-                "Content-Type: application/json",
-                "--request",
-                "POST",
-                "--data",
-                json.dumps(payload, ensure_ascii=False),
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=_curl_wall_timeout_seconds(expansion_time, backend_label),
-        )
-        data = json.loads(result.stdout)
-        results_obj = data.get("results", {}) if isinstance(data, dict) else {}
-        stats_obj = results_obj.get("stats", {}) if isinstance(results_obj, dict) else {}
-        uds_obj = results_obj.get("uds", {}) if isinstance(results_obj, dict) else {}
-        parsed_routes = parse_uds_paths(uds_obj if isinstance(uds_obj, dict) else {})
-
-        pathways = (
-            results_obj.get("paths")
-            or results_obj.get("pathways")
-            or data.get("paths")
-            or data.get("pathways")
-            or []
-        )
-        total_paths = int(
-            stats_obj.get("total_paths", data.get("total_paths", len(pathways) if isinstance(pathways, list) else 0))
-        )
-        total_chemicals = int(stats_obj.get("total_chemicals", data.get("total_chemicals", 0)))
-        total_reactions = int(stats_obj.get("total_reactions", data.get("total_reactions", 0)))
+            return _format_multistep_record(backend_label, cached, max_paths)
 
-        if not parsed_routes and not pathways and total_paths <= 0:
+    def _fetch() -> Any:
+        """成功回傳解析後紀錄（dict），失敗回傳錯誤訊息字串（不快取）。"""
+        try:
+            if dispatch is None:
+                data = http_transport.post_json(
+                    endpoint_url,
+                    payload,
+                    timeout_sec=_curl_wall_timeout_seconds(expansion_time, backend_label),
+                )
+            else:
+                with dispatch() as replica_url:
+                    data = http_transport.post_json(
+                        replica_url,
+                        payload,
+                        timeout_sec=_curl_wall_timeout_seconds(expansion_time, backend_label),
+                    )
+            record = _parse_multistep_response(data)
+            record["fetched_max_paths"] = fetched_max_paths
+            if use_cache:
+                found = record["routes"] or record["pathways"] or record["total_paths"] > 0
+                cache.set(cache_key, record, outcome=cache.OUTCOME_SUCCESS if found else cache.OUTCOME_EMPTY)
+            return record
+        except http_transport.TransportTimeout:
             text = (
-                f"AskCOS 多步逆合成（{backend_label}）未找到可回推到可購買起始物的完整路徑。\n"
-                f"搜尋統計：total_paths={total_paths}，total_chemicals={total_chemicals}，total_reactions={total_reactions}"
+                f"多步逆合成逾時（{backend_label}）：expansion_time={expansion_time}，"
+                f"HTTP 等待上限約 {_curl_wall_timeout_seconds(expansion_time, backend_label)} 秒。"
+                f"若為 Retro*，可再提高 expansion_time 或檢查 docker log（單次常需數分鐘）。"
             )
             if use_cache:
-                cache.set(cache_key, text)
+                cache.set(cache_key, text, outcome=cache.OUTCOME_TRANSIENT_ERROR)
+            return text
+        except http_transport.TransportError as e:
+            detail = e.stderr if e.stderr else f"Curl 退出代碼: {e.returncode}"
+            text = f"調用 AskCOS 多步逆合成 API 失敗（{backend_label}）。錯誤詳情:\n{detail}"
+            if use_cache:
+                cache.set(cache_key, text, outcome=cache.OUTCOME_TRANSIENT_ERROR)
             return text
+        except Exception as e:
+            return f"多步逆合成發生未知錯誤（{backend_label}）: {e}"
 
-        lines = [
-            f"AskCOS 多步逆合成（{backend_label}）完成。共找到 {total_paths} 條路徑。",
-            f"搜尋統計：total_chemicals={total_chemicals}，total_reactions={total_reactions}",
-        ]
-        if parsed_routes:
-            for rt in parsed_routes[:max_paths]:
-                lines.append(_format_route_summary(route_summary(rt)))
-        else:
-            for idx, pathway in enumerate(pathways[:max_paths], start=1):
-                lines.append(_format_pathway_item(pathway, idx))
-        text = "\n".join(lines)
-        if use_cache:
-            cache.set(cache_key, text)
-        return text
-    except subprocess.CalledProcessError as e:
-        detail = e.stderr if e.stderr else f"Curl 退出代碼: {e.returncode}"
-        return f"調用 AskCOS 多步逆合成 API 失敗（{backend_label}）。錯誤詳情:\n{detail}"
-    except subprocess.TimeoutExpired:
-        return (
-            f"多步逆合成逾時（{backend_label}）：expansion_time={expansion_time}，"
-            f"HTTP 等待上限約 {_curl_wall_timeout_seconds(expansion_time, backend_label)} 秒。"
-            f"若為 Retro*，可再提高 expansion_time 或檢查 docker log（單次常需數分鐘）。"
-        )
-    except Exception as e:
-        return f"多步逆合成發生未知錯誤（{backend_label}）: {e}"
+    # 合併 key 帶上 max_paths：較大的 max_paths 不會共用到路徑數不足的結果
+    # use_cache=False 仍合併同行程的同時請求，只是不跨行程補查快取
+    lookup = (lambda: _usable(cache.get(cache_key))) if use_cache else None
+    result = singleflight.run(f"{cache_key}|max_paths={max_paths}", _fetch, lookup=lookup)
+    if isinstance(result, dict):
+        return _format_multistep_record(backend_label, result, max_paths)
+    return result
 
 
 def run_askcos_multistep_retrosynthesis(
@@ -318,11 +556,13 @@ def run_askcos_multistep_retrosynthesis_retro_star(
     }
     return _run_backend(
         backend_label="Retro*",
-        endpoint_url=_detect_retro_star_url(),
+        # cache key 固定用第一個埠（與舊版預設一致）；實際送往哪個 replica 由 dispatch 決定
+        endpoint_url=_retro_star_url(ASKCOS_RETROSTAR_PORTS[0]),
         payload=payload,
         max_paths=max_paths,
         expansion_time=expansion_time,
         use_cache=use_cache,
+        dispatch=_retro_star_dispatch,
     )
 
 
@@ -334,21 +574,28 @@ def run_askcos_multistep_retrosynthesis_compare(
     retro_model_name: str = "reaxys",
     use_cache: bool = True,
 ) -> str:
-    mcts_text = run_askcos_multistep_retrosynthesis(
-        target_smiles=target_smiles,
-        max_depth=max_depth,
-        max_paths=max_paths,
-        expansion_time=expansion_time,
-        retro_model_name=retro_model_name,
-        use_cache=use_cache,
-    )
-    retro_text = run_askcos_multistep_retrosynthesis_retro_star(
-        target_smiles=target_smiles,
-        max_depth=max_depth,
-        max_paths=max_paths,
-        expansion_time=expansion_time,
-        retro_model_name=retro_model_name,
-        use_cache=use_cache,
+    kwargs = {
+        "target_smiles": target_smiles,
+        "max_depth": max_depth,
+        "max_paths": max_paths,
+        "expansion_time": expansion_time,
+        "retro_model_name": retro_model_name,
+        "use_cache": use_cache,
+    }
+    # 兩種搜尋各自以自己的 HTTP 等待上限為 deadline，一邊逾時不影響另一邊的結果
+    (_, mcts_text), (_, retro_text) = fanout.run_engines(
+        [
+            (
+                "MCTS",
+                lambda: run_askcos_multistep_retrosynthesis(**kwargs),
+                _curl_wall_timeout_seconds(expansion_time, "MCTS"),
+            ),
+            (
+                "Retro*",
+                lambda: run_askcos_multistep_retrosynthesis_retro_star(**kwargs),
+                _curl_wall_timeout_seconds(expansion_time, "Retro*") + 60,
+            ),
+        ]
     )
     return "AskCOS 多步逆合成比較（MCTS vs Retro*）\n\n=== MCTS ===\n" + mcts_text + "\n\n=== Retro* ===\n" + retro_text
 
@@ -417,10 +664,15 @@ def run_askcos_multistep_retrosynthesis_async_submit(
         stderr=subprocess.DEVNULL,
         start_new_session=True,
     )
-    payload["pid"] = int(proc.pid)
-    payload["status"] = "running"
-    payload["started_at"] = _utc_now()
-    _write_job(job_id, payload)
+
+    def _mark_started(job: dict) -> None:
+        job["pid"] = int(proc.pid)
+        # runner 可能已先寫入 running / done，只在仍為 queued 時補上狀態
+        if job.get("status", "queued") == "queued":
+            job["status"] = "running"
+            job["started_at"] = _utc_now()
+
+    _update_job(job_id, _mark_started)
     return (
         "已提交多步逆合成背景任務。\n"
         f"- job_id: {job_id}\n"
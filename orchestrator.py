@@ -1,6 +1,6 @@
 import json
 import re
-from typing import Any, Callable, Dict, List
+from typing import Any, Callable, Dict, List, Optional
 
 
 SWITCH_REASON_ENUM = {
@@ -118,6 +118,7 @@ def run_groq_turn(
     groq_aux_model: str,
     primary_model: str,
     planner_timeout_sec: int,
+    prefetched_name_resolution: Optional[Dict[str, Any]] = None,
 ) -> str:
     tool_names = [getattr(t, "__name__", str(t)) for t in tools_for_turn]
     route_candidates = build_route_candidates(user_prompt, compare_allowed)
@@ -141,8 +142,16 @@ def run_groq_turn(
 
     if not resolved_smiles and not looks_like_smiles_fn(user_prompt):
         name_candidate = extract_name_candidate_fn(user_prompt)
-        if name_candidate:
-            resolved_text = str(resolve_smiles_from_name_fn(compound_name=name_candidate))
+        # 回合前階段已並行解析過同一名稱就直接沿用；text 為 None 表示解析逾時，
+        # 不再同步等待，交給 planner 決定是否呼叫 resolve 工具
+        prefetched = prefetched_name_resolution or {}
+        if prefetched.get("compound_name") != name_candidate:
+            prefetched = {}
+        if name_candidate and (not prefetched or prefetched.get("text") is not None):
+            if prefetched:
+                resolved_text = str(prefetched["text"])
+            else:
+                resolved_text = str(resolve_smiles_from_name_fn(compound_name=name_candidate))
             maybe_smiles = extract_smiles_candidate_fn(resolved_text)
             if maybe_smiles:
                 resolved_smiles = maybe_smiles
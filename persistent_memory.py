@@ -15,6 +15,8 @@ import os
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
 
+import atomic_io
+
 
 MEMORY_DIR = os.environ.get(
     "ASKLLM_MEMORY_DIR",
@@ -98,9 +100,7 @@ def save_state(state: Dict[str, Any]) -> None:
     if DISABLE:
         return
 
-    normalized = _coerce_state(state)
-    with open(_state_path(), "w", encoding="utf-8") as f:
-        json.dump(normalized, f, ensure_ascii=False, indent=2)
+    atomic_io.write_json(_state_path(), _coerce_state(state))
 
 
 def append_turn(state: Dict[str, Any], role: str, text: str) -> Dict[str, Any]:
@@ -4,6 +4,20 @@ from typing import List
 
 _SMILES_CHARSET = set("BCNOFPSIKHbrclonpsif@+-=#()[]\\/1234567890.%:,")
 
+CONDITIONAL_SKILL_RULES = [
+    ("02-ambiguity.md", ["co", "no", " p ", "smiles", "分子式", "結構式", "歧義", "縮寫"]),
+    ("03-name-resolution.md", ["名稱", "name", "翻譯", "smiles", "化合物", "compound", "分子"]),
+    ("04-condition-priority.md", ["條件", "condition", "yield", "產率", "buchwald", "grignard", "chan-lam"]),
+    ("05-task-routing.md", ["逆合成", "retrosynthesis", "forward", "正向", "雜質", "impurity", "路徑", "mcts"]),
+    ("06-formatting.md", ["輸出", "格式", "temperature", "probability", "score", "top 5", "攝氏", "表格"]),
+]
+
+
+def keyword_skill_files(user_prompt: str) -> List[str]:
+    """依 CONDITIONAL_SKILL_RULES 關鍵字命中的 skill 檔（依規則順序）。"""
+    normalized = f" {str(user_prompt).lower()} "
+    return [filename for filename, keywords in CONDITIONAL_SKILL_RULES if any(k in normalized for k in keywords)]
+
 
 def is_tool_error(text: str) -> bool:
     value = (text or "").lower()
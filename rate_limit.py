@@ -0,0 +1,53 @@
+"""
+Token bucket 限流（thread-safe），目前用於 PubChem PUG-REST / PUG-View。
+
+PubChem 公開限制：每秒不超過 5 個請求、每分鐘不超過 400 個請求；
+以 5 req/s、burst 5 的 bucket 即可同時滿足兩者（持續上限 300 req/min）。
+限流以行程為單位；多個 worker 行程同時大量查詢時需自行調低速率。
+
+環境變數：
+  ASKLLM_PUBCHEM_RATE_PER_SEC   PubChem 每秒請求上限（預設 5）
+  ASKLLM_PUBCHEM_BURST          PubChem 瞬間突發上限（預設 5）
+"""
+
+import os
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = max(0.001, float(rate_per_sec))
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """取得一個 token；timeout 內拿不到回傳 False（timeout=None 表示一直等）。"""
+        deadline = None if timeout is None else time.monotonic() + max(0.0, timeout)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill_locked(now)
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return True
+                wait = (1.0 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+PUBCHEM = TokenBucket(
+    float(os.environ.get("ASKLLM_PUBCHEM_RATE_PER_SEC", "5")),
+    float(os.environ.get("ASKLLM_PUBCHEM_BURST", "5")),
+)
@@ -0,0 +1,180 @@
+"""
+最小的 Redis 協定（RESP2）用戶端：只涵蓋共用快取後端用到的指令，不需安裝 redis 套件；
+Redis / Valkey / KeyDB 或測試用的本機替身伺服器，只要講 RESP 都可以用。
+
+- 連線池：每條 socket 同時只給一個 thread，用完放回；上限 POOL_SIZE，等不到連線拋 RespPoolExhausted。
+- pipeline(commands)：多個指令一次送出、一次讀回（批次 GET / SET 只付一次來回）。
+- 從池中取出的閒置連線若已被伺服器關閉，自動換新連線重送一次（快取指令皆為冪等）。
+
+錯誤：連線 / 逾時 / 協定錯誤拋 RespConnectionError；伺服器回覆的錯誤拋 RespError；
+本行程同時請求過多、連線池沒有空位拋 RespPoolExhausted（伺服器本身正常）。
+
+環境變數：
+  ASKLLM_REDIS_POOL_SIZE     每個 Client 的連線上限（預設 8）
+  ASKLLM_REDIS_TIMEOUT_SEC   連線 / 讀寫逾時（預設 1.0）
+"""
+
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Sequence
+from urllib.parse import unquote, urlsplit
+
+
+POOL_SIZE = int(os.environ.get("ASKLLM_REDIS_POOL_SIZE", "8"))
+TIMEOUT_SEC = float(os.environ.get("ASKLLM_REDIS_TIMEOUT_SEC", "1.0"))
+
+
+class RespError(Exception):
+    """伺服器回覆的錯誤（-ERR ...）。"""
+
+
+class RespConnectionError(ConnectionError):
+    """無法連線、逾時或回應格式錯誤；呼叫端可據此改用備援。"""
+
+
+class RespPoolExhausted(Exception):
+    """timeout_sec 內等不到空閒連線；只是本行程負載尖峰，不代表伺服器斷線。"""
+
+
+def _arg(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    return str(value).encode("utf-8")
+
+
+def encode_command(args: Sequence[Any]) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = _arg(arg)
+        parts.append(b"$%d\r\n" % len(data))
+        parts.append(data)
+        parts.append(b"\r\n")
+    return b"".join(parts)
+
+
+def _read_reply(reader: Any) -> Any:
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise RespConnectionError("連線中斷")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode("utf-8", errors="replace")
+    if kind == b"-":
+        # 先回傳不拋出：pipeline 要讀完所有回覆，連線才能放回池中
+        return RespError(body.decode("utf-8", errors="replace"))
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        size = int(body)
+        if size < 0:
+            return None
+        data = reader.read(size + 2)
+        if len(data) != size + 2:
+            raise RespConnectionError("連線中斷")
+        return data[:-2]
+    if kind == b"*":
+        count = int(body)
+        if count < 0:
+            return None
+        return [_read_reply(reader) for _ in range(count)]
+    raise RespConnectionError(f"無法解析的回應: {line[:32]!r}")
+
+
+class _Connection:
+    def __init__(self, host: str, port: int, timeout_sec: float, password: Optional[str], db: int):
+        self.sock = socket.create_connection((host, port), timeout=timeout_sec)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        if password:
+            self.call([("AUTH", password)])
+        if db:
+            self.call([("SELECT", db)])
+
+    def call(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        self.sock.sendall(b"".join(encode_command(c) for c in commands))
+        replies = [_read_reply(self.reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError) and reply.args[0].startswith(("NOAUTH", "WRONGPASS")):
+                raise reply
+        return replies
+
+    def close(self) -> None:
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class Client:
+    """redis://[:password@]host[:port][/db] 的連線池用戶端；可多 thread 共用。"""
+
+    def __init__(self, url: str, pool_size: int = POOL_SIZE, timeout_sec: float = TIMEOUT_SEC):
+        parts = urlsplit(url if "://" in url else f"redis://{url}")
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 6379
+        self.password = unquote(parts.password) if parts.password else None
+        path = (parts.path or "").strip("/")
+        self.db = int(path) if path.isdigit() else 0
+        self.timeout_sec = timeout_sec
+        self._idle: List[_Connection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, pool_size))
+
+    def _connect(self) -> _Connection:
+        try:
+            return _Connection(self.host, self.port, self.timeout_sec, self.password, self.db)
+        except OSError as e:
+            raise RespConnectionError(f"無法連線 {self.host}:{self.port}: {e}") from e
+
+    @contextmanager
+    def _slot(self) -> Iterator[None]:
+        if not self._slots.acquire(timeout=self.timeout_sec):
+            raise RespPoolExhausted(f"連線池已滿（{self.host}:{self.port}）")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """依序執行多個指令並回傳各自的回覆；任一回覆為錯誤時拋出第一個 RespError。"""
+        if not commands:
+            return []
+        with self._slot():
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            reused = conn is not None
+            while True:
+                if conn is None:
+                    conn = self._connect()
+                try:
+                    replies = conn.call(commands)
+                    break
+                except (OSError, ValueError, RespConnectionError) as e:
+                    conn.close()
+                    conn = None
+                    if not reused:
+                        raise e if isinstance(e, RespConnectionError) else RespConnectionError(str(e)) from e
+                    reused = False  # 閒置連線可能已被伺服器關閉，換新連線重送一次
+                except RespError:
+                    conn.close()
+                    raise
+            with self._lock:
+                self._idle.append(conn)
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def execute(self, *args: Any) -> Any:
+        return self.pipeline([args])[0]
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
@@ -1,9 +1,13 @@
-import json
 import os
-import subprocess
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional
 
 import cache_utils as cache
+import chem_canon
+import endpoint_registry
+import fanout
+import http_transport
+import singleflight
 
 
 ASKCOS_RETRO_REAXYS_URL = os.environ.get(
@@ -22,6 +26,28 @@ ASKCOS_RETRO_TEMPLATE_ENUM_URL = os.environ.get(
     "ASKLLM_RETRO_TEMPLATE_ENUM_URL",
     "http://127.0.0.1:9461/predictions/template_enumeration",
 )
+_RETRO_GROUP_TOOLS = ["run_askcos_retrosynthesis_compare", "run_askcos_retrosynthesis_batch"]
+endpoint_registry.register(ASKCOS_RETRO_REAXYS_URL, tools=["run_askcos_retrosynthesis"] + _RETRO_GROUP_TOOLS)
+endpoint_registry.register(ASKCOS_RETRO_USPTO_FULL_URL, tools=["run_askcos_retrosynthesis_uspto_full"] + _RETRO_GROUP_TOOLS)
+endpoint_registry.register(ASKCOS_RETRO_PISTACHIO_URL, tools=["run_askcos_retrosynthesis_pistachio"] + _RETRO_GROUP_TOOLS)
+endpoint_registry.register(
+    ASKCOS_RETRO_TEMPLATE_ENUM_URL,
+    tools=["run_askcos_retrosynthesis_template_enum"] + _RETRO_GROUP_TOOLS,
+)
+
+# compare 時每個引擎最多等多久（略短於單次 HTTP timeout，讓慢引擎不拖住整份報告）
+COMPARE_ENGINE_DEADLINE_SEC = int(os.environ.get("ASKLLM_RETRO_COMPARE_DEADLINE_SEC", "50"))
+# 批次逆合成：每個請求塞幾個目標、同時送出幾個 chunk
+BATCH_CHUNK_SIZE = int(os.environ.get("ASKLLM_RETRO_BATCH_CHUNK_SIZE", "32"))
+BATCH_MAX_WORKERS = int(os.environ.get("ASKLLM_RETRO_BATCH_MAX_WORKERS", "4"))
+
+# engine key -> (顯示名稱 / cache 用 engine_name, URL)
+RETRO_ENGINES = {
+    "reaxys": ("Reaxys", ASKCOS_RETRO_REAXYS_URL),
+    "uspto_full": ("USPTO_FULL", ASKCOS_RETRO_USPTO_FULL_URL),
+    "pistachio": ("PISTACHIO_23Q3", ASKCOS_RETRO_PISTACHIO_URL),
+    "template_enum": ("TEMPLATE_ENUMERATION", ASKCOS_RETRO_TEMPLATE_ENUM_URL),
+}
 
 
 def _normalize_smiles_input(smiles_list: Any = None, target_smiles: str = "") -> List[str]:
@@ -35,23 +61,7 @@ def _normalize_smiles_input(smiles_list: Any = None, target_smiles: str = "") ->
 
 
 def _post_json(url: str, payload: Dict[str, Any], timeout_sec: int = 45) -> Dict[str, Any]:
-    result = subprocess.run(
-        [
-            "curl",
-            url,
-            "--header",
-            "Content-Type: application/json",
-            "--request",
-            "POST",
-            "--data",
-            json.dumps(payload, ensure_ascii=False),
-        ],
-        capture_output=True,
-        text=True,
-        check=True,
-        timeout=timeout_sec,
-    )
-    data = json.loads(result.stdout)
+    data = http_transport.post_json(url, payload, timeout_sec=timeout_sec)
     if isinstance(data, dict):
         return data
     if isinstance(data, list):
@@ -61,17 +71,49 @@ def _post_json(url: str, payload: Dict[str, Any], timeout_sec: int = 45) -> Dict
     return {}
 
 
-def _summarize_retro_results(engine_name: str, data: Dict[str, Any], max_routes: int) -> str:
-    reactants = data.get("reactants") or data.get("precursors") or []
-    scores = data.get("scores") or []
+def _post_json_list(url: str, payload: Dict[str, Any], timeout_sec: int = 60) -> List[Any]:
+    """批次請求用：保留每個目標各自的結果物件（_post_json 只取第一個）。"""
+    data = http_transport.post_json(url, payload, timeout_sec=timeout_sec)
+    if isinstance(data, list):
+        return data
+    return [data]
+
+
+def _retro_cache_key(engine_name: str, url: str, smiles_list: List[str]) -> str:
+    # 只以模型輸入為 key（SMILES 正規化）；max_routes 等顯示參數在讀出時才套用，換 top-N 不必重打引擎
+    return cache.build_key(
+        "askcos:retro:raw:v2",
+        engine=engine_name,
+        url=url,
+        payload={"smiles": chem_canon.canonical_list(smiles_list)},
+    )
+
+
+def _parse_retro_response(data: Dict[str, Any]) -> Dict[str, Any]:
+    """引擎回應 -> 可快取的精簡紀錄（保留全部前體與分數，只留最高分模板的 SMARTS）。"""
     templates = data.get("templates") or []
+    top = templates[0] if templates and isinstance(templates[0], dict) else {}
+    return {
+        "reactants": list(data.get("reactants") or data.get("precursors") or []),
+        "scores": list(data.get("scores") or []),
+        "top_template_smarts": top.get("reaction_smarts", "N/A"),
+    }
+
+
+def _retro_outcome(parsed: Dict[str, Any]) -> str:
+    return cache.OUTCOME_SUCCESS if parsed.get("reactants") else cache.OUTCOME_EMPTY
+
+
+def _summarize_retro_results(engine_name: str, parsed: Dict[str, Any], max_routes: int) -> str:
+    reactants = parsed.get("reactants") or []
+    scores = parsed.get("scores") or []
 
     if not reactants:
         return f"{engine_name} 逆合成調用成功，但未找到前體推薦。"
 
     limit = min(max_routes, len(reactants))
     summary_parts = []
-    top_template_smarts = templates[0].get("reaction_smarts", "N/A") if templates else "N/A"
+    top_template_smarts = parsed.get("top_template_smarts") or "N/A"
 
     for i in range(limit):
         precursor_smiles = reactants[i]
@@ -105,30 +147,196 @@ def _run_retro_engine(
         return "錯誤：未提供目標分子的 SMILES。"
 
     payload_data = {"smiles": normalized}
-    cache_key = cache.build_key(
-        "askcos:retro:v2",
-        engine=engine_name,
-        url=url,
-        payload=payload_data,
-        max_routes=max_routes,
-    )
-    cached = cache.get(cache_key)
-    if isinstance(cached, str) and cached.strip():
+    cache_key = _retro_cache_key(engine_name, url, normalized)
+
+    def _fetch() -> Any:
+        """成功回傳解析後紀錄（dict），失敗回傳錯誤訊息字串；兩者都依 outcome 寫入快取。"""
+        try:
+            data = _post_json(url, payload_data, timeout_sec=60)
+            if data.get("code") in [500, 503]:
+                text = f"AskCOS {engine_name} 服務端錯誤：{data.get('message', '預測失敗')}"
+                cache.set(cache_key, text, outcome=cache.OUTCOME_TRANSIENT_ERROR)
+                return text
+            parsed = _parse_retro_response(data)
+            cache.set(cache_key, parsed, outcome=_retro_outcome(parsed))
+            return parsed
+        except http_transport.TransportError as e:
+            error_output = e.stderr if e.stderr else f"Curl 退出代碼: {e.returncode}"
+            text = f"調用 AskCOS {engine_name} API 失敗，請檢查服務日誌。錯誤詳情:\n{error_output}"
+            cache.set(cache_key, text, outcome=cache.OUTCOME_TRANSIENT_ERROR)
+            return text
+        except Exception as e:
+            return f"AskCOS {engine_name} 發生未知錯誤或 JSON 解析失敗: {e}"
+
+    cached = cache.get_or_revalidate(cache_key, lambda: singleflight.run(cache_key, _fetch))
+    if isinstance(cached, dict):
         print(f"  -> 命中快取：AskCOS 逆合成 {engine_name}")
+        return _summarize_retro_results(engine_name, cached, max_routes=max_routes)
+    if isinstance(cached, str) and cached.strip():
+        # 短期負向快取：剛失敗過的請求不重打引擎
         return cached
 
+    result = singleflight.run(cache_key, _fetch, lookup=singleflight.record_lookup(cache_key))
+    if isinstance(result, dict):
+        return _summarize_retro_results(engine_name, result, max_routes=max_routes)
+    return result
+
+
+_ENGINE_ALIASES = {
+    "uspto": "uspto_full",
+    "pistachio_23q3": "pistachio",
+    "template_enumeration": "template_enum",
+}
+
+
+def _resolve_batch_engines(engines: Any) -> List[str]:
+    """引擎名稱（可用別名，未指定為全部）→ RETRO_ENGINES key；含未知名稱時拋 ValueError 並列出。"""
+    if not engines:
+        return list(RETRO_ENGINES.keys())
+    if isinstance(engines, str):
+        engines = [x for x in engines.replace(",", " ").split() if x]
+    out = []
+    unknown = []
+    for name in engines:
+        key = str(name).strip().lower()
+        key = _ENGINE_ALIASES.get(key, key)
+        if key not in RETRO_ENGINES:
+            unknown.append(str(name).strip())
+        elif key not in out:
+            out.append(key)
+    if unknown:
+        raise ValueError(
+            f"未知的逆合成引擎：{', '.join(unknown)}"
+            f"（可用：{', '.join([*RETRO_ENGINES, *_ENGINE_ALIASES])}）"
+        )
+    return out
+
+
+def _run_retro_chunk(engine_key: str, chunk: List[str], max_routes: int) -> List[Dict[str, Any]]:
+    engine_name, url = RETRO_ENGINES[engine_key]
     try:
-        data = _post_json(url, payload_data, timeout_sec=60)
-        if data.get("code") in [500, 503]:
-            return f"AskCOS {engine_name} 服務端錯誤：{data.get('message', '預測失敗')}"
-        final_summary = _summarize_retro_results(engine_name, data, max_routes=max_routes)
-        cache.set(cache_key, final_summary)
-        return final_summary
-    except subprocess.CalledProcessError as e:
+        results = _post_json_list(url, {"smiles": chunk}, timeout_sec=60 + 2 * len(chunk))
+    except http_transport.TransportError as e:
         error_output = e.stderr if e.stderr else f"Curl 退出代碼: {e.returncode}"
-        return f"調用 AskCOS {engine_name} API 失敗，請檢查服務日誌。錯誤詳情:\n{error_output}"
+        text = f"調用 AskCOS {engine_name} API 失敗，請檢查服務日誌。錯誤詳情:\n{error_output}"
+        return [{"engine": engine_name, "smiles": smi, "text": text, "cached": False, "ok": False} for smi in chunk]
     except Exception as e:
-        return f"AskCOS {engine_name} 發生未知錯誤或 JSON 解析失敗: {e}"
+        text = f"AskCOS {engine_name} 發生未知錯誤或 JSON 解析失敗: {e}"
+        return [{"engine": engine_name, "smiles": smi, "text": text, "cached": False, "ok": False} for smi in chunk]
+
+    first = results[0] if results and isinstance(results[0], dict) else {}
+    if len(results) == 1 and first.get("code") in [500, 503]:
+        text = f"AskCOS {engine_name} 服務端錯誤：{first.get('message', '預測失敗')}"
+        return [{"engine": engine_name, "smiles": smi, "text": text, "cached": False, "ok": False} for smi in chunk]
+    if len(results) != len(chunk):
+        text = f"AskCOS {engine_name} 批次回應數量不符（送出 {len(chunk)}，收到 {len(results)}）。"
+        return [{"engine": engine_name, "smiles": smi, "text": text, "cached": False, "ok": False} for smi in chunk]
+
+    out = []
+    records: Dict[str, Dict[str, Dict[str, Any]]] = {cache.OUTCOME_SUCCESS: {}, cache.OUTCOME_EMPTY: {}}
+    for smi, item in zip(chunk, results):
+        data = item if isinstance(item, dict) else {"precursors": item if isinstance(item, list) else []}
+        parsed = _parse_retro_response(data)
+        records[_retro_outcome(parsed)][_retro_cache_key(engine_name, url, [smi])] = parsed
+        text = _summarize_retro_results(engine_name, parsed, max_routes=max_routes)
+        out.append({"engine": engine_name, "smiles": smi, "text": text, "cached": False, "ok": True})
+    for outcome, items in records.items():
+        cache.set_many(items, outcome=outcome)
+    return out
+
+
+def _fan_out(item: Dict[str, Any], aliases: Dict[str, List[str]]) -> Iterator[Dict[str, Any]]:
+    for smi in aliases.get(item["smiles"], [item["smiles"]]):
+        yield {**item, "smiles": smi}
+
+
+def iter_retrosynthesis_batch(
+    smiles_list: Any,
+    engines: Any = None,
+    chunk_size: Optional[int] = None,
+    max_routes: int = 3,
+    max_workers: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    批次逆合成，逐目標串流回傳 {"engine", "smiles", "text", "cached", "ok"}。
+
+    每個目標各自查快取（key 與單目標工具相同，兩邊可互相命中），
+    只把未命中的目標切成 chunk 並行送到各引擎；chunk 完成即 yield。
+    正規化後相同的輸入（例如 "OCC" 與 "CCO"）只送一次，結果對每個原始寫法各 yield 一筆。
+    engines 含未知名稱時拋 ValueError。
+    """
+    groups: Dict[str, List[str]] = {}
+    for smi in _normalize_smiles_input(smiles_list=smiles_list):
+        members = groups.setdefault(chem_canon.canonical_smiles(smi) or smi, [])
+        if smi not in members:
+            members.append(smi)
+    # 代表寫法 -> 同一分子的所有原始寫法
+    aliases = {members[0]: members for members in groups.values()}
+    targets = list(aliases)
+    size = max(1, int(chunk_size or BATCH_CHUNK_SIZE))
+
+    jobs = []
+    for engine_key in _resolve_batch_engines(engines):
+        engine_name, url = RETRO_ENGINES[engine_key]
+        keys = {smi: _retro_cache_key(engine_name, url, [smi]) for smi in targets}
+        hits = cache.get_many(list(keys.values()))
+        misses = []
+        for smi in targets:
+            cached = hits.get(keys[smi])
+            if isinstance(cached, dict):
+                text = _summarize_retro_results(engine_name, cached, max_routes=max_routes)
+                item = {"engine": engine_name, "smiles": smi, "text": text, "cached": True, "ok": True}
+                yield from _fan_out(item, aliases)
+            elif isinstance(cached, str) and cached.strip():
+                item = {"engine": engine_name, "smiles": smi, "text": cached, "cached": True, "ok": False}
+                yield from _fan_out(item, aliases)
+            else:
+                misses.append(smi)
+        for i in range(0, len(misses), size):
+            jobs.append((engine_key, misses[i : i + size]))
+
+    if not jobs:
+        return
+    workers = max(1, min(len(jobs), int(max_workers or BATCH_MAX_WORKERS)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="askllm-retro-batch") as pool:
+        futures = [pool.submit(_run_retro_chunk, engine_key, chunk, max_routes) for engine_key, chunk in jobs]
+        for fut in as_completed(futures):
+            for item in fut.result():
+                yield from _fan_out(item, aliases)
+
+
+def run_askcos_retrosynthesis_batch(
+    smiles_list: Any = None,
+    engines: Any = None,
+    chunk_size: int = 0,
+    max_routes: int = 3,
+) -> str:
+    try:
+        _resolve_batch_engines(engines)
+    except ValueError as e:
+        return f"錯誤：{e}"
+    results = list(
+        iter_retrosynthesis_batch(
+            smiles_list,
+            engines=engines,
+            chunk_size=chunk_size or None,
+            max_routes=max_routes,
+        )
+    )
+    if not results:
+        return "錯誤：未提供目標分子的 SMILES。"
+
+    order = {smi: i for i, smi in enumerate(_normalize_smiles_input(smiles_list=smiles_list))}
+    results.sort(key=lambda x: (order.get(x["smiles"], 0), x["engine"]))
+    hits = sum(1 for x in results if x["cached"])
+    failed = sum(1 for x in results if not x["ok"])
+    lines = [
+        f"AskCOS 批次逆合成完成：{len(order)} 個目標 × {len({x['engine'] for x in results})} 個引擎，"
+        f"共 {len(results)} 筆（快取命中 {hits}，失敗 {failed}）。"
+    ]
+    for item in results:
+        lines.append(f"=== {item['smiles']} | {item['engine']} ===\n{item['text']}")
+    return "\n\n".join(lines)
 
 
 def run_askcos_retrosynthesis(smiles_list: Any = None, target_smiles: str = "", max_routes: int = 3) -> str:
@@ -188,12 +396,16 @@ def run_askcos_retrosynthesis_compare(
     target_smiles: str = "",
     max_routes: int = 3,
 ) -> str:
-    sections = [
-        ("Reaxys", run_askcos_retrosynthesis(smiles_list=smiles_list, target_smiles=target_smiles, max_routes=max_routes)),
-        ("USPTO_FULL", run_askcos_retrosynthesis_uspto_full(smiles_list=smiles_list, target_smiles=target_smiles, max_routes=max_routes)),
-        ("PISTACHIO_23Q3", run_askcos_retrosynthesis_pistachio(smiles_list=smiles_list, target_smiles=target_smiles, max_routes=max_routes)),
-        ("TEMPLATE_ENUMERATION", run_askcos_retrosynthesis_template_enum(smiles_list=smiles_list, target_smiles=target_smiles, max_routes=max_routes)),
+    kwargs = {"smiles_list": smiles_list, "target_smiles": target_smiles, "max_routes": max_routes}
+    engines = [
+        ("Reaxys", run_askcos_retrosynthesis),
+        ("USPTO_FULL", run_askcos_retrosynthesis_uspto_full),
+        ("PISTACHIO_23Q3", run_askcos_retrosynthesis_pistachio),
+        ("TEMPLATE_ENUMERATION", run_askcos_retrosynthesis_template_enum),
     ]
+    sections = fanout.run_engines(
+        [(name, lambda fn=fn: fn(**kwargs), COMPARE_ENGINE_DEADLINE_SEC) for name, fn in engines]
+    )
     return "以下是多引擎逆合成比較結果，請比較各引擎的前體候選、得分與差異：\n\n" + "\n\n".join(
         [f"=== {name} ===\n{text}" for name, text in sections]
     )
\ No newline at end of file
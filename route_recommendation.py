@@ -2,12 +2,20 @@ import json
 import math
 import os
 import re
-import subprocess
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
+import atomic_io
 import cache_utils as cache
+import chem_canon
+import endpoint_registry
+import hazard_store
+import http_transport
+import rate_limit
+import singleflight
 from askcos_tree_utils import parse_uds_paths, route_summary
 
 
@@ -16,6 +24,12 @@ RISK_RULES_PATH = os.path.join(os.path.dirname(__file__), "risk_rules.json")
 CONSTRAINT_LOOP_LOG_PATH = os.path.join(os.path.dirname(__file__), "runtime_jobs", "constraint_loop_logs.jsonl")
 ROUTE_EVAL_LOG_PATH = os.path.join(os.path.dirname(__file__), "runtime_jobs", "route_eval_logs.jsonl")
 ROUTE_FEEDBACK_LOG_PATH = os.path.join(os.path.dirname(__file__), "runtime_jobs", "route_feedback_logs.jsonl")
+# 批次解析 CID 時同時在途的 PubChem 請求數（實際速率仍受 rate_limit.PUBCHEM 限制）
+PUBCHEM_MAX_WORKERS = int(os.environ.get("ASKLLM_PUBCHEM_MAX_WORKERS", "5"))
+# 整個 PubChem 危害檢查階段（CID 解析 + 危害查詢）的時間上限；逾時未查完的分子視為 unknown
+HAZARD_PHASE_DEADLINE_SEC = float(os.environ.get("ASKLLM_HAZARD_PHASE_DEADLINE_SEC", "90"))
+
+endpoint_registry.register(TREE_SEARCH_CONTROLLER_URL, tools=["run_askcos_route_recommendation"])
 
 
 def _safe_float(v: Any, default: float = 0.0) -> float:
@@ -117,28 +131,43 @@ def _build_payload(
     }
 
 
-def _call_tree_search(payload: Dict[str, Any], expansion_time: int) -> Dict[str, Any]:
-    result = subprocess.run(
-        [
-            "curl",
-            "-sS",
-            TREE_SEARCH_CONTROLLER_URL,
-            "--header",
-            "Content-Type: application/json",
-            "--request",
-            "POST",
-            "--data",
-            json.dumps(payload, ensure_ascii=False),
-        ],
-        capture_output=True,
-        text=True,
-        check=True,
-        timeout=max(300, expansion_time + 300),
+def _tree_search_key(payload: Dict[str, Any]) -> str:
+    target = chem_canon.canonical_smiles(payload.get("smiles"))
+    return cache.build_key(
+        "askcos:tree_search:v2",
+        url=TREE_SEARCH_CONTROLLER_URL,
+        payload=dict(payload, smiles=target, description=target),
     )
-    data = json.loads(result.stdout)
-    if int(data.get("status_code", 500)) != 200:
-        raise RuntimeError(f"Tree search API 回傳失敗: {data.get('message', 'unknown')}")
-    return data
+
+
+def _call_tree_search(payload: Dict[str, Any], expansion_time: int, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    同一 payload 的 tree search 只跑一次：結果快取，且同時進行中的相同請求
+    （不同 objective/constraint 的推薦共用同一棵樹）會等待第一個請求的結果。
+    """
+    key = _tree_search_key(payload)
+
+    def _lookup() -> Any:
+        hit = cache.get(key)
+        return hit if isinstance(hit, dict) else None
+
+    if use_cache:
+        hit = _lookup()
+        if hit is not None:
+            return hit
+
+    def _fetch() -> Dict[str, Any]:
+        data = http_transport.post_json(
+            TREE_SEARCH_CONTROLLER_URL,
+            payload,
+            timeout_sec=max(300, expansion_time + 300),
+        )
+        if int(data.get("status_code", 500)) != 200:
+            raise RuntimeError(f"Tree search API 回傳失敗: {data.get('message', 'unknown')}")
+        cache.set(key, data)
+        return data
+
+    return singleflight.run(key, _fetch, lookup=_lookup if use_cache else None)
 
 
 def _norm_inverse(x: float, lo: float, hi: float) -> float:
@@ -233,78 +262,219 @@ def _load_risk_rules() -> Dict[str, Any]:
         return default_rules
 
 
-def _collect_strings(obj: Any) -> List[str]:
-    out: List[str] = []
-    if isinstance(obj, str):
-        out.append(obj)
-    elif isinstance(obj, dict):
-        for v in obj.values():
-            out.extend(_collect_strings(v))
-    elif isinstance(obj, list):
-        for v in obj:
-            out.extend(_collect_strings(v))
-    return out
+# 只讀 "Hazards Identification" 章節內的 Information；這些名稱與危害判定無關，直接略過
+_HAZARD_SECTION_HEADING = "hazards identification"
+_HAZARD_SKIP_INFO_NAMES = {"precautionary statement codes"}
+
+
+def _extract_hazard_texts(payload: Dict[str, Any]) -> List[str]:
+    """
+    從 pug_view 回應中只抽出危害相關字串（StringWithMarkup 的 String 與 pictogram 名稱）。
+    找到 Hazards Identification 章節後只走它的子章節，不碰 Reference / Description 等其他分支。
+    """
+    record = payload.get("Record", {}) if isinstance(payload, dict) else {}
+    stack = [s for s in reversed(record.get("Section") or []) if isinstance(s, dict)]
+    target = None
+    while stack:
+        sec = stack.pop()
+        if str(sec.get("TOCHeading", "")).strip().lower() == _HAZARD_SECTION_HEADING:
+            target = sec
+            break
+        stack.extend(s for s in reversed(sec.get("Section") or []) if isinstance(s, dict))
+    if target is None:
+        return []
+
+    texts: List[str] = []
+    stack = [target]
+    while stack:
+        sec = stack.pop()
+        for info in sec.get("Information") or []:
+            if not isinstance(info, dict):
+                continue
+            if str(info.get("Name", "")).strip().lower() in _HAZARD_SKIP_INFO_NAMES:
+                continue
+            value = info.get("Value") if isinstance(info.get("Value"), dict) else {}
+            for swm in value.get("StringWithMarkup") or []:
+                if not isinstance(swm, dict):
+                    continue
+                if isinstance(swm.get("String"), str):
+                    texts.append(swm["String"])
+                for markup in swm.get("Markup") or []:
+                    if isinstance(markup, dict) and isinstance(markup.get("Extra"), str):
+                        texts.append(markup["Extra"])
+        stack.extend(s for s in reversed(sec.get("Section") or []) if isinstance(s, dict))
+    return texts
+
+
+class PubChemError(RuntimeError):
+    """PubChem 限流（ServerBusy）、非 2xx、Fault 或非預期回應；屬暫時性錯誤，結果不可寫入快取或 hazard_store。"""
+
+
+# PubChem 明確回答「查無」的 Fault；其餘 Fault 一律視為暫時性錯誤
+_PUBCHEM_NOT_FOUND_FAULTS = {"PUGREST.NotFound", "PUGVIEW.NotFound"}
+
+
+def _pubchem_get_json(url: str, params: Dict[str, Any], timeout_sec: float) -> Optional[Dict[str, Any]]:
+    """受限流的 PubChem GET；查無時回傳 None，其他失敗拋 PubChemError（不把錯誤本文當成資料）。"""
+    rate_limit.PUBCHEM.acquire()
+    status, data = http_transport.get_json_response(url, params=params, timeout_sec=timeout_sec)
+    fault = data.get("Fault") if isinstance(data, dict) else None
+    code = str(fault.get("Code") or "") if isinstance(fault, dict) else ""
+    if code in _PUBCHEM_NOT_FOUND_FAULTS:
+        return None
+    if fault is not None or not 200 <= status < 300 or not isinstance(data, dict):
+        raise PubChemError(f"PubChem HTTP {status} {code}".strip())
+    return data
+
+
+def _pubchem_cid_key(smiles: str) -> str:
+    return cache.build_key("pubchem:cid:v2", smiles=chem_canon.canonical_smiles(smiles))
 
 
 def _pubchem_cid_from_smiles(smiles: str) -> int:
-    key = cache.build_key("pubchem:cid:v1", smiles=smiles)
-    hit = cache.get(key)
+    key = _pubchem_cid_key(smiles)
+
+    def _lookup() -> Any:
+        hit = cache.get(key)
+        return hit if isinstance(hit, int) and hit > 0 else None
+
+    def _fetch() -> int:
+        data = _pubchem_get_json(
+            "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/smiles/cids/JSON",
+            params={"smiles": smiles},
+            timeout_sec=20,
+        )
+        if data is None:
+            cid = 0
+        elif isinstance(data.get("IdentifierList"), dict):
+            cid = int((data["IdentifierList"].get("CID") or [0])[0])
+        else:
+            raise PubChemError("PubChem CID 回應缺少 IdentifierList")
+        cache.set(key, cid, outcome=cache.OUTCOME_SUCCESS if cid > 0 else cache.OUTCOME_NOT_FOUND)
+        return cid
+
+    hit = cache.get_or_revalidate(key, lambda: singleflight.run(key, _fetch))
     if isinstance(hit, int):
         return hit
     if isinstance(hit, str) and hit.isdigit():
         return int(hit)
-    result = subprocess.run(
-        [
-            "curl",
-            "-sS",
-            "--get",
-            "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound/smiles/cids/JSON",
-            "--data-urlencode",
-            f"smiles={smiles}",
-        ],
-        capture_output=True,
-        text=True,
-        check=True,
-        timeout=20,
-    )
-    data = json.loads(result.stdout)
-    cid = int((data.get("IdentifierList", {}).get("CID") or [0])[0])
-    if cid > 0:
-        cache.set(key, cid)
-    return cid
+    return singleflight.run(key, _fetch, lookup=_lookup)
+
+
+def _pubchem_cids_from_smiles_batch(smiles_list: List[str], deadline_sec: Optional[float] = None) -> Dict[str, int]:
+    """
+    一次解析多個 SMILES 的 CID：先以 get_many 查 CID 快取（_pubchem_cid_key，pubchem:cid:v2，
+    key 為正規化 SMILES），再查 hazard_store 的 SMILES → CID 對照；都未命中的才以有界
+    worker pool 並行查詢（受 PubChem 限流），結果經 _pubchem_cid_from_smiles 寫回同一快取。
+    PUG-REST 的 SMILES 輸入一次只接受一個分子，因此「批次」是並行的單分子請求。
+    查詢失敗或超過 deadline_sec 的 SMILES 不會出現在回傳 dict 中（PubChem 確認查無 CID 則為 0）。
+    """
+    out: Dict[str, int] = {}
+    misses: List[str] = []
+    keys = {smi: _pubchem_cid_key(smi) for smi in dict.fromkeys(s for s in smiles_list if s)}
+    hits = cache.get_many(list(keys.values()))
+    for smi, key in keys.items():
+        hit = hits.get(key)
+        if isinstance(hit, int):
+            out[smi] = hit
+        elif isinstance(hit, str) and hit.isdigit():
+            out[smi] = int(hit)
+        else:
+            known = hazard_store.lookup_cid(smi)
+            if known is not None:
+                out[smi] = known
+            else:
+                misses.append(smi)
+    if not misses:
+        return out
 
+    def _resolve(smi: str) -> Tuple[str, Optional[int]]:
+        try:
+            return smi, _pubchem_cid_from_smiles(smi)
+        except Exception:
+            return smi, None
+
+    workers = max(1, min(len(misses), PUBCHEM_MAX_WORKERS))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="askllm-pubchem-cid")
+    try:
+        futures = [pool.submit(_resolve, smi) for smi in misses]
+        done, _ = wait(futures, timeout=deadline_sec)
+        for fut in done:
+            smi, cid = fut.result()
+            if cid is not None:
+                out[smi] = cid
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return out
+
+
+def _hazard_record_from_payload(cid: int, payload: Dict[str, Any], keywords: List[str]) -> Dict[str, Any]:
+    texts = _extract_hazard_texts(payload)
+    # 多個來源常重複同一句危害敘述，去重後保存，規則關鍵字變動時 hazard_store 可離線重新比對
+    statements = "\n".join(dict.fromkeys(t.strip().lower() for t in texts if t.strip()))
+    return {
+        "cid": int(cid),
+        "hcodes": hazard_store.extract_hcodes(" ".join(texts)),
+        "keywords": hazard_store.match_keywords(statements, keywords),
+        "statements": statements,
+        "fetched_at": int(time.time()),
+    }
 
-def _pubchem_hazard_payload(cid: int) -> Dict[str, Any]:
-    key = cache.build_key("pubchem:hazard_payload:v1", cid=cid)
-    hit = cache.get(key)
-    if isinstance(hit, dict):
-        return hit
-    result = subprocess.run(
-        [
-            "curl",
-            "-sS",
-            "--get",
-            f"https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/compound/{cid}/JSON",
-            "--data-urlencode",
-            "heading=Hazards Identification",
-        ],
-        capture_output=True,
-        text=True,
-        check=True,
-        timeout=25,
-    )
-    data = json.loads(result.stdout)
-    if isinstance(data, dict):
-        cache.set(key, data)
-    return data if isinstance(data, dict) else {}
 
+def _pubchem_hazard_record(cid: int, rules: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    取得精簡危害紀錄 {cid, hcodes, keywords, statements, fetched_at}；快取只存這份紀錄，不存整包 pug_view。
+    keywords 為 risk_rules.json 關鍵字中有命中者，關鍵字清單變動時 key 隨之改變。
+    舊版 pubchem:hazard_payload:v1 整包快取在第一次讀到時轉成紀錄並刪除。
+    """
+    keywords = hazard_store.rule_keywords(rules)
+    # v2：v1 可能存有把 PubChem 錯誤回應當成「無危害」的空紀錄
+    key = cache.build_key("pubchem:hazard_record:v2", cid=cid, keywords=keywords)
 
-def _pubchem_hazard_assess(smiles: str, rules: Dict[str, Any]) -> Dict[str, Any]:
-    key = cache.build_key("pubchem:hazard_assess:v1", smiles=smiles, rules=rules.get("pubchem", {}))
-    hit = cache.get(key)
+    def _lookup() -> Any:
+        hit = cache.get(key)
+        return hit if isinstance(hit, dict) else None
+
+    def _fetch() -> Dict[str, Any]:
+        data = _pubchem_get_json(
+            f"https://pubchem.ncbi.nlm.nih.gov/rest/pug_view/data/compound/{cid}/JSON",
+            params={"heading": "Hazards Identification"},
+            timeout_sec=25,
+        )
+        # None = PubChem 確認此 CID 沒有危害章節，空紀錄才是真的「無危害資料」
+        if data is not None and not isinstance(data.get("Record"), dict):
+            raise PubChemError("PubChem pug_view 回應缺少 Record")
+        record = _hazard_record_from_payload(cid, data or {}, keywords)
+        cache.set(key, record)
+        return record
+
+    hit = cache.get_or_revalidate(key, lambda: singleflight.run(key, _fetch))
     if isinstance(hit, dict):
         return hit
 
+    legacy_key = cache.build_key("pubchem:hazard_payload:v1", cid=cid)
+    legacy = cache.get(legacy_key)
+    if isinstance(legacy, dict):
+        cache.delete(legacy_key)
+        # 舊版整包快取也可能是 Fault 本文，只有真正的 pug_view 紀錄才轉換
+        if isinstance(legacy.get("Record"), dict):
+            record = _hazard_record_from_payload(cid, legacy, keywords)
+            cache.set(key, record)
+            return record
+
+    return singleflight.run(key, _fetch, lookup=_lookup)
+
+
+def _hazard_assess_key(smiles: str, rules: Dict[str, Any]) -> str:
+    return cache.build_key(
+        "pubchem:hazard_assess:v4",
+        smiles=chem_canon.canonical_smiles(smiles),
+        rules=rules.get("pubchem", {}),
+    )
+
+
+def _classify_hazard(hcodes: Set[str], keyword_hits: Set[str], rules: Dict[str, Any]) -> Dict[str, Any]:
+    """依 risk_rules.json 把 H-code / 關鍵字命中轉成 severity（H-code 優先，關鍵字補位）。"""
     pubchem_rules = rules.get("pubchem", {}) if isinstance(rules.get("pubchem", {}), dict) else {}
     high_h = set(pubchem_rules.get("high_hcodes", []) or [])
     med_h = set(pubchem_rules.get("medium_hcodes", []) or [])
@@ -313,80 +483,140 @@ def _pubchem_hazard_assess(smiles: str, rules: Dict[str, Any]) -> Dict[str, Any]
     med_kw = [x.lower() for x in (pubchem_rules.get("medium_keywords", []) or [])]
     low_kw = [x.lower() for x in (pubchem_rules.get("low_keywords", []) or [])]
 
-    try:
-        cid = _pubchem_cid_from_smiles(smiles)
-        if cid <= 0:
-            out = {"severity": "unknown", "reason": "pubchem_no_cid", "hits": []}
+    high_hcode_hits = sorted(list(hcodes.intersection(high_h)))
+    med_hcode_hits = sorted(list(hcodes.intersection(med_h)))
+    low_hcode_hits = sorted(list(hcodes.intersection(low_h)))
+    high_hits = list(high_hcode_hits)
+    med_hits = list(med_hcode_hits)
+    low_hits = list(low_hcode_hits)
+    if not high_hits:
+        high_hits.extend([kw for kw in high_kw if kw in keyword_hits][:3])
+    if not med_hits:
+        med_hits.extend([kw for kw in med_kw if kw in keyword_hits][:3])
+    if not low_hits:
+        low_hits.extend([kw for kw in low_kw if kw in keyword_hits][:3])
+
+    if high_hits:
+        severity, reason, hits = "high", "pubchem_high", high_hits
+    elif med_hits:
+        severity, reason, hits = "medium", "pubchem_medium", med_hits
+    elif low_hits:
+        severity, reason, hits = "low", "pubchem_low", low_hits
+    else:
+        severity, reason, hits = "none", "pubchem_no_hazard_hit", []
+    return {
+        "severity": severity,
+        "reason": reason,
+        "hits": hits,
+        "high_hcode_hits": high_hcode_hits,
+        "med_hcode_hits": med_hcode_hits,
+        "low_hcode_hits": low_hcode_hits,
+    }
+
+
+def _pubchem_hazard_assess(smiles: str, rules: Dict[str, Any], cid: Optional[int] = None) -> Dict[str, Any]:
+    """
+    cid 可由 _pubchem_cids_from_smiles_batch 預先解析後傳入，省去逐一查詢。
+    先查本地 hazard_store，查無才打 PubChem，並把抓到的 H-code / 關鍵字寫回 hazard_store。
+    """
+    key = _hazard_assess_key(smiles, rules)
+
+    def _lookup() -> Any:
+        hit = cache.get(key)
+        return hit if isinstance(hit, dict) else None
+
+    def _assess() -> Dict[str, Any]:
+        keywords = hazard_store.rule_keywords(rules)
+        # 帶目前規則的關鍵字：規則變動後舊紀錄會重新比對 statements，無法比對者視為查無
+        record = hazard_store.lookup(smiles=smiles, cid=cid, keywords=keywords)
+        if record is not None:
+            out = _classify_hazard(set(record["hcodes"]), set(record["keywords"]), rules)
             cache.set(key, out)
             return out
-        payload = _pubchem_hazard_payload(cid)
-        texts = [t for t in _collect_strings(payload) if isinstance(t, str)]
-        merged = " ".join(texts).lower()
-        hcodes = set(re.findall(r"\bH\\d{3}\b", " ".join(texts).upper()))
-
-        high_hcode_hits = sorted(list(hcodes.intersection(high_h)))
-        med_hcode_hits = sorted(list(hcodes.intersection(med_h)))
-        low_hcode_hits = sorted(list(hcodes.intersection(low_h)))
-        high_hits = list(high_hcode_hits)
-        med_hits = list(med_hcode_hits)
-        low_hits = list(low_hcode_hits)
-        if not high_hits:
-            high_hits.extend([kw for kw in high_kw if kw in merged][:3])
-        if not med_hits:
-            med_hits.extend([kw for kw in med_kw if kw in merged][:3])
-        if not low_hits:
-            low_hits.extend([kw for kw in low_kw if kw in merged][:3])
-
-        if high_hits:
-            out = {
-                "severity": "high",
-                "reason": "pubchem_high",
-                "hits": high_hits,
-                "high_hcode_hits": high_hcode_hits,
-                "med_hcode_hits": med_hcode_hits,
-                "low_hcode_hits": low_hcode_hits,
-            }
-        elif med_hits:
-            out = {
-                "severity": "medium",
-                "reason": "pubchem_medium",
-                "hits": med_hits,
-                "high_hcode_hits": high_hcode_hits,
-                "med_hcode_hits": med_hcode_hits,
-                "low_hcode_hits": low_hcode_hits,
-            }
-        elif low_hits:
-            out = {
-                "severity": "low",
-                "reason": "pubchem_low",
-                "hits": low_hits,
-                "high_hcode_hits": high_hcode_hits,
-                "med_hcode_hits": med_hcode_hits,
-                "low_hcode_hits": low_hcode_hits,
-            }
-        else:
+
+        try:
+            resolved_cid = cid
+            if resolved_cid is None:
+                resolved_cid = hazard_store.lookup_cid(smiles)
+            if resolved_cid is None:
+                resolved_cid = _pubchem_cid_from_smiles(smiles)
+            resolved_cid = int(resolved_cid)
+            if resolved_cid <= 0:
+                # 查無 CID 只靠快取的 not_found TTL 記住，不寫進 hazard_store（避免永久負向紀錄）
+                out = {"severity": "unknown", "reason": "pubchem_no_cid", "hits": []}
+                cache.set(key, out, outcome=cache.OUTCOME_NOT_FOUND)
+                return out
+            record = _pubchem_hazard_record(resolved_cid, rules)
+            hazard_store.put(
+                resolved_cid,
+                record["hcodes"],
+                record["keywords"],
+                smiles=smiles,
+                source="pubchem",
+                fetched_at=record.get("fetched_at"),
+                statements=record.get("statements"),
+                kw_hash=hazard_store.keywords_hash(keywords),
+            )
+            out = _classify_hazard(set(record["hcodes"]), set(record["keywords"]), rules)
+            cache.set(key, out)
+            return out
+        except Exception as e:
             out = {
-                "severity": "none",
-                "reason": "pubchem_no_hazard_hit",
+                "severity": "unknown",
+                "reason": f"pubchem_error:{str(e)[:120]}",
                 "hits": [],
-                "high_hcode_hits": high_hcode_hits,
-                "med_hcode_hits": med_hcode_hits,
-                "low_hcode_hits": low_hcode_hits,
+                "high_hcode_hits": [],
+                "med_hcode_hits": [],
+                "low_hcode_hits": [],
             }
-        cache.set(key, out)
-        return out
-    except Exception as e:
-        out = {
-            "severity": "unknown",
-            "reason": f"pubchem_error:{str(e)[:120]}",
-            "hits": [],
-            "high_hcode_hits": [],
-            "med_hcode_hits": [],
-            "low_hcode_hits": [],
-        }
-        cache.set(key, out)
+            cache.set(key, out, outcome=cache.OUTCOME_TRANSIENT_ERROR)
+            return out
+
+    hit = cache.get_or_revalidate(key, lambda: singleflight.run(key, _assess))
+    if isinstance(hit, dict):
+        return hit
+    return singleflight.run(key, _assess, lookup=_lookup)
+
+
+def _pubchem_hazard_assess_many(
+    smiles_list: List[str],
+    rules: Dict[str, Any],
+    deadline_sec: float,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    並行評估多個分子的 PubChem 危害（有界 worker pool + rate_limit.PUBCHEM 限流）。
+    整個階段共用 deadline_sec；時間到仍未完成的分子不列入回傳，由呼叫端當作 not_checked。
+    背景未完成的查詢會繼續跑完並寫入快取，下次推薦即可命中。
+    """
+    started = time.monotonic()
+    out: Dict[str, Dict[str, Any]] = {}
+    pending: List[str] = []
+    keys = {smi: _hazard_assess_key(smi, rules) for smi in smiles_list}
+    hits = cache.get_many(list(keys.values()))
+    for smi in smiles_list:
+        hit = hits.get(keys[smi])
+        if isinstance(hit, dict):
+            out[smi] = hit
+        else:
+            pending.append(smi)
+    if not pending:
         return out
 
+    cid_map = _pubchem_cids_from_smiles_batch(pending, deadline_sec=deadline_sec)
+    remaining = max(0.0, started + deadline_sec - time.monotonic())
+    workers = max(1, min(len(pending), PUBCHEM_MAX_WORKERS))
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="askllm-pubchem-hazard")
+    try:
+        futures = {pool.submit(_pubchem_hazard_assess, smi, rules, cid_map.get(smi)): smi for smi in pending}
+        done, not_done = wait(futures, timeout=remaining)
+        for fut in done:
+            out[futures[fut]] = fut.result()
+        if not_done:
+            print(f"  -> PubChem 危害檢查逾時（{deadline_sec:.0f} 秒），{len(not_done)} 個分子標記為 not_checked")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return out
+
 
 def _safety_agent(
     routes: List[Dict[str, Any]],
@@ -394,6 +624,7 @@ def _safety_agent(
     enable_pubchem_hazard: bool = True,
     hazard_leaf_only: bool = True,
     max_unique_hazard_checks: int = 120,
+    hazard_deadline_sec: Optional[float] = None,
 ) -> Tuple[Dict[int, Dict[str, Any]], Dict[int, List[str]], Dict[int, Dict[str, Any]]]:
     rules = _load_risk_rules()
     weights = rules.get("severity_weights", {})
@@ -424,8 +655,11 @@ def _safety_agent(
             if s not in seen:
                 uniq.append(s)
                 seen.add(s)
-        for smi in uniq[: max(0, int(max_unique_hazard_checks))]:
-            pubchem_map[smi] = _pubchem_hazard_assess(smi, rules)
+        pubchem_map = _pubchem_hazard_assess_many(
+            uniq[: max(0, int(max_unique_hazard_checks))],
+            rules,
+            deadline_sec=HAZARD_PHASE_DEADLINE_SEC if hazard_deadline_sec is None else float(hazard_deadline_sec),
+        )
 
     scores: Dict[int, Dict[str, Any]] = {}
     rejects: Dict[int, List[str]] = {}
@@ -841,18 +1075,14 @@ def _relaxed_constraints(hard_constraints: Dict[str, Any], soft_constraints: Dic
 
 def _append_constraint_loop_log(record: Dict[str, Any]) -> None:
     try:
-        os.makedirs(os.path.dirname(CONSTRAINT_LOOP_LOG_PATH), exist_ok=True)
-        with open(CONSTRAINT_LOOP_LOG_PATH, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        atomic_io.append_jsonl(CONSTRAINT_LOOP_LOG_PATH, record)
     except Exception:
         pass
 
 
 def _append_jsonl(path: str, record: Dict[str, Any]) -> None:
     try:
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        atomic_io.append_jsonl(path, record)
     except Exception:
         pass
 
@@ -957,9 +1187,10 @@ def run_askcos_route_recommendation(
         threshold=threshold,
         fast_filter_threshold=fast_filter_threshold,
     )
+    canonical_target = chem_canon.canonical_smiles(target_smiles)
     cache_key = cache.build_key(
-        "askcos:route_reco:v1",
-        payload=payload,
+        "askcos:route_reco:v2",
+        payload=dict(payload, smiles=canonical_target, description=canonical_target),
         objective=objective,
         top_n=top_n,
         banned_tokens=banned_tokens or [],
@@ -982,8 +1213,8 @@ def run_askcos_route_recommendation(
             return hit
 
     try:
-        data = _call_tree_search(payload, expansion_time=expansion_time)
-    except subprocess.TimeoutExpired:
+        data = _call_tree_search(payload, expansion_time=expansion_time, use_cache=use_cache)
+    except http_transport.TransportTimeout:
         return f"路線推薦逾時：expansion_time={expansion_time}，請提高到 240~420 秒後再試。"
     except Exception as e:
         return f"路線推薦失敗：{e}"
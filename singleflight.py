@@ -0,0 +1,163 @@
+"""
+相同請求的 singleflight 合併：同一個 cache key 同時只讓一個呼叫真正打到 AskCOS / PubChem，
+其他重複呼叫等待它的結果（例如多個 Flask session 同時對同一目標跑 300 秒的 tree search）。
+
+- 同行程：後到的 thread 等 leader 完成，直接共用其回傳值（例外也一併拋出）。
+- 跨行程（Flask worker / async job）：leader 持有 <cache dir>/singleflight/<hash>.lock 的 flock；
+  其他行程拿到鎖後先用 lookup() 重查快取，命中就返回，未命中（leader 失敗、沒寫快取）才自己算。
+  鎖檔每次取得時更新 mtime；快取 sweeper 刪除閒置且沒人持有的鎖檔（cache_utils.sweep），
+  取得鎖後若發現鎖檔已被刪除 / 重建就改鎖新檔，不會出現兩個 leader。
+  沒有 lookup 的呼叫（例如 use_cache=False）只做同行程合併；無 fcntl 的平台亦同。
+
+環境變數：
+  ASKLLM_SINGLEFLIGHT=0               關閉合併
+  ASKLLM_SINGLEFLIGHT_WAIT_SEC        跨行程等鎖上限（預設 900；逾時改為自行計算）
+"""
+
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+import atomic_io
+import cache_utils as cache
+
+
+ENABLED = os.environ.get("ASKLLM_SINGLEFLIGHT", "1") == "1"
+WAIT_SEC = float(os.environ.get("ASKLLM_SINGLEFLIGHT_WAIT_SEC", "900"))
+_POLL_SEC = 0.2
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_lock = threading.Lock()
+_calls: Dict[str, _Call] = {}
+
+
+def text_lookup(key: str) -> Callable[[], Optional[str]]:
+    """工具摘要文字的快取查詢（非空字串才算命中），給 run(lookup=...) 使用。"""
+
+    def _lookup() -> Optional[str]:
+        hit = cache.get(key)
+        return hit if isinstance(hit, str) and hit.strip() else None
+
+    return _lookup
+
+
+def record_lookup(key: str) -> Callable[[], Optional[Dict[str, Any]]]:
+    """解析後引擎回應（dict）的快取查詢，給 run(lookup=...) 使用。"""
+
+    def _lookup() -> Optional[Dict[str, Any]]:
+        hit = cache.get(key)
+        return hit if isinstance(hit, dict) else None
+
+    return _lookup
+
+
+def _lock_path(key: str) -> str:
+    lock_dir = cache.SINGLEFLIGHT_LOCK_DIR
+    os.makedirs(lock_dir, exist_ok=True)
+    return os.path.join(lock_dir, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.lock")
+
+
+def _acquire_file_lock(key: str) -> Optional[int]:
+    """取得跨行程鎖並回傳 fd；等到 WAIT_SEC 仍拿不到（或無法建立鎖檔）回傳 None。"""
+    path = _lock_path(key)
+    deadline = time.monotonic() + WAIT_SEC
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError:
+        return None
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                os.close(fd)
+                return None
+            time.sleep(_POLL_SEC)
+        except OSError:
+            os.close(fd)
+            return None
+        else:
+            if atomic_io.lock_is_current(fd, path):
+                try:
+                    os.utime(fd)  # 標記使用中，sweeper 只刪閒置的鎖檔
+                except OSError:
+                    pass
+                return fd
+            # 等鎖期間鎖檔被 sweeper 刪除：這把鎖已無人會來搶，改開新檔重來
+            _release_file_lock(fd)
+            try:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError:
+                return None
+            continue
+
+
+def _release_file_lock(fd: int) -> None:
+    try:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def _run_leader(key: str, compute: Callable[[], Any], lookup: Optional[Callable[[], Any]]) -> Any:
+    if lookup is None or fcntl is None or cache.DISABLE:
+        return compute()
+    fd = _acquire_file_lock(key)
+    if fd is None:
+        return compute()
+    try:
+        hit = lookup()
+        if hit is not None:
+            return hit
+        return compute()
+    finally:
+        _release_file_lock(fd)
+
+
+def run(key: str, compute: Callable[[], Any], lookup: Optional[Callable[[], Any]] = None) -> Any:
+    """
+    以 key 合併重複呼叫並回傳 compute() 的結果。
+
+    lookup() 在取得跨行程鎖後呼叫，回傳非 None 即視為其他行程已算好；
+    呼叫端應自行先查一次快取（維持原本的命中訊息），這裡只負責等待期間的補查。
+    """
+    if not ENABLED:
+        return compute()
+
+    with _lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _Call()
+            _calls[key] = call
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    try:
+        call.value = _run_leader(key, compute, lookup)
+        return call.value
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            _calls.pop(key, None)
+        call.done.set()
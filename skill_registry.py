@@ -0,0 +1,148 @@
+"""
+skills/*.md 的記憶體內登錄：啟動時整批讀入，之後依 mtime / size 偵測變更才重讀；
+組好的系統指令依「選中的 skill 檔組合 + 記憶段落 hash」快取，每回合不再重開檔、重新 join。
+
+- 系統指令 = skill 前綴（依選檔組合快取）+ 記憶段落（cmem 摘要、主題記憶）。前綴放最前面且在
+  skill 檔未變更時逐位元組相同，供應商端的 prompt caching 可直接沿用。
+- 檢查變更最多每 CHECK_INTERVAL_SEC 一次（scandir 一次，不逐檔 stat）；有變更時整個快取作廢。
+- 可多 thread 共用（threaded Flask API）。
+
+環境變數：
+  ASKLLM_SKILL_RELOAD_CHECK_SEC   檢查 skill 檔變更的最短間隔（預設 2；0 = 每次組裝都檢查）
+  ASKLLM_SKILL_INSTRUCTION_CACHE  組好的系統指令最多快取幾組（預設 64）
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+
+CHECK_INTERVAL_SEC = float(os.environ.get("ASKLLM_SKILL_RELOAD_CHECK_SEC", "2"))
+INSTRUCTION_CACHE_SIZE = int(os.environ.get("ASKLLM_SKILL_INSTRUCTION_CACHE", "64"))
+
+SKILL_SUFFIX = ".md"
+
+
+class SkillRegistry:
+    def __init__(
+        self,
+        directory: str,
+        check_interval_sec: float = CHECK_INTERVAL_SEC,
+        cache_size: int = INSTRUCTION_CACHE_SIZE,
+    ):
+        self.directory = directory
+        self.check_interval_sec = check_interval_sec
+        self.cache_size = max(1, cache_size)
+        self.generation = 0
+        self._texts: Dict[str, str] = {}
+        self._stamps: Dict[str, Tuple[int, int]] = {}
+        self._prefixes: Dict[Tuple[str, ...], str] = {}
+        self._instructions: "OrderedDict[Tuple[Tuple[str, ...], str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self.refresh(force=True)
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        stamps = {}
+        try:
+            it = os.scandir(self.directory)
+        except OSError:
+            return stamps
+        with it:
+            for item in it:
+                if not item.name.endswith(SKILL_SUFFIX):
+                    continue
+                try:
+                    st = item.stat()
+                except OSError:
+                    continue
+                stamps[item.name] = (st.st_mtime_ns, st.st_size)
+        return stamps
+
+    def _read(self, filename: str) -> str:
+        try:
+            with open(os.path.join(self.directory, filename), "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except (OSError, UnicodeDecodeError):
+            return ""
+
+    def refresh(self, force: bool = False) -> bool:
+        """重讀新增 / 變更的 skill 檔並移除已刪除者；有變更回傳 True（組好的指令全部作廢）。"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval_sec:
+            return False
+        with self._lock:
+            if not force and now - self._checked_at < self.check_interval_sec:
+                return False
+            self._checked_at = now
+            stamps = self._scan()
+            if stamps == self._stamps:
+                return False
+            self._texts = {
+                name: self._texts[name] if self._stamps.get(name) == stamp else self._read(name)
+                for name, stamp in stamps.items()
+            }
+            self._stamps = stamps
+            self._prefixes.clear()
+            self._instructions.clear()
+            self.generation += 1
+            return True
+
+    def text(self, filename: str) -> str:
+        self.refresh()
+        return self._texts.get(filename, "")
+
+    def _prefix(self, files: Tuple[str, ...], fallback_file: Optional[str], default: str) -> str:
+        cached = self._prefixes.get(files)
+        if cached is not None:
+            return cached
+        fragments = [f"[SKILL:{name}]\n{self._texts[name]}" for name in files if self._texts.get(name)]
+        if not fragments and fallback_file and self._texts.get(fallback_file):
+            fragments.append(self._texts[fallback_file])
+        if not fragments and default:
+            fragments.append(default)
+        prefix = "\n\n".join(fragments)
+        if len(self._prefixes) >= self.cache_size:
+            self._prefixes.clear()
+        self._prefixes[files] = prefix
+        return prefix
+
+    def assemble(
+        self,
+        files: Sequence[str],
+        suffix_parts: Sequence[str] = (),
+        fallback_file: Optional[str] = None,
+        default: str = "",
+    ) -> str:
+        """
+        依序串接選中 skill 檔的 [SKILL:名稱] 片段與 suffix_parts（空白段落略過）。
+        沒有任何 skill 內容時改用 fallback_file，再沒有才用 default。
+        """
+        self.refresh()
+        key_files = tuple(files)
+        suffix = [part for part in suffix_parts if part and part.strip()]
+        digest = hashlib.sha256("\0".join(suffix).encode("utf-8")).hexdigest()
+        key = (key_files, digest)
+        with self._lock:
+            cached = self._instructions.get(key)
+            if cached is not None:
+                self._instructions.move_to_end(key)
+                return cached
+            prefix = self._prefix(key_files, fallback_file, default)
+            instruction = "\n\n".join([part for part in [prefix, *suffix] if part.strip()])
+            self._instructions[key] = instruction
+            while len(self._instructions) > self.cache_size:
+                self._instructions.popitem(last=False)
+            return instruction
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "skills": len(self._texts),
+                "generation": self.generation,
+                "prefixes": len(self._prefixes),
+                "instructions": len(self._instructions),
+            }
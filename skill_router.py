@@ -0,0 +1,341 @@
+"""
+本地學習式 skill 路由：hashed 字元 / 詞 n-gram + 每個 skill 檔一個 logistic regression（純 Python），
+取代每輪一次、只為了從 skills/ 挑幾個檔案的 LLM 呼叫；分類器沒把握時才交給 LLM 路由。
+
+- predict(prompt)：回傳選中的 skill 檔名；模型不存在、或任一 skill 的機率落在 (LOW, HIGH)
+  之間時回傳 None（沒把握），呼叫端改走 LLM 路由。有把握的預測也有 AUDIT_RATE 的機率
+  回傳 None 交給 LLM 抽查，模型上線後仍持續取得新標註（含分類器自認有把握的那一類查詢）。
+- record_decision(prompt, files)：記下 LLM 路由的結果，作為下次訓練的標註。
+- 訓練資料只用 LLM 路由紀錄。關鍵字規則（policies.CONDITIONAL_SKILL_RULES）在
+  _select_skill_files 本來就會套用，不拿來當標註：否則模型只學會模仿關鍵字，關鍵字沒命中的
+  查詢反而被自信地判成「不需額外 skill」，正好跳過 LLM 路由存在的理由。
+
+模型檔為 JSON（labels、雜湊維度、各 label 的 bias 與非零權重），通常數十 KB；
+執行中依 mtime 自動重新載入，重新訓練後不必重啟服務。
+
+CLI：
+  python skill_router.py train [--epochs 20] [--l2 1e-5]   訓練並寫入模型檔
+  python skill_router.py eval                               路由紀錄 80/20 holdout：與 LLM 決策一致率、覆蓋率
+  python skill_router.py predict "查詢文字"                 各 skill 機率與是否需要 LLM
+
+環境變數：
+  ASKLLM_SKILL_CLASSIFIER=0              停用本地分類器（每輪都走 LLM 路由）
+  ASKLLM_SKILL_CLASSIFIER_PATH           模型檔（預設 <memory dir>/skill_router_model.json）
+  ASKLLM_SKILL_CLASSIFIER_LOG_PATH       LLM 路由紀錄（預設 <memory dir>/skill_router_logs.jsonl）
+  ASKLLM_SKILL_CLASSIFIER_LOW / _HIGH    信心區間（預設 0.2 / 0.8；所有 skill 都在區間外才採用）
+  ASKLLM_SKILL_CLASSIFIER_MIN_EXAMPLES   LLM 路由紀錄少於此數時不訓練（預設 30）
+  ASKLLM_SKILL_CLASSIFIER_AUDIT_RATE     有把握的預測仍交給 LLM 抽查的比例（預設 0.05）
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import atomic_io
+import persistent_memory as pmem
+from policies import CONDITIONAL_SKILL_RULES
+
+
+ENABLED = os.environ.get("ASKLLM_SKILL_CLASSIFIER", "1") == "1"
+MODEL_PATH = os.environ.get(
+    "ASKLLM_SKILL_CLASSIFIER_PATH",
+    os.path.join(pmem.MEMORY_DIR, "skill_router_model.json"),
+)
+LOG_PATH = os.environ.get(
+    "ASKLLM_SKILL_CLASSIFIER_LOG_PATH",
+    os.path.join(pmem.MEMORY_DIR, "skill_router_logs.jsonl"),
+)
+LOW = float(os.environ.get("ASKLLM_SKILL_CLASSIFIER_LOW", "0.2"))
+HIGH = float(os.environ.get("ASKLLM_SKILL_CLASSIFIER_HIGH", "0.8"))
+MIN_EXAMPLES = int(os.environ.get("ASKLLM_SKILL_CLASSIFIER_MIN_EXAMPLES", "30"))
+AUDIT_RATE = float(os.environ.get("ASKLLM_SKILL_CLASSIFIER_AUDIT_RATE", "0.05"))
+
+HASH_BITS = 18
+# 模型檔 mtime 最多每隔這麼久檢查一次
+_RELOAD_CHECK_SEC = 5.0
+
+_WORD_RE = re.compile(r"[a-z0-9][a-z0-9\-]*")
+
+Features = Dict[int, float]
+Example = Tuple[str, List[str]]
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _features(text: str, bits: int = HASH_BITS) -> Features:
+    """字元 1–3-gram（中文不需斷詞）+ 英數詞 unigram / bigram，以 crc32 雜湊到 2^bits 維並 L2 正規化。"""
+    normalized = " ".join(str(text or "").lower().split())
+    mask = (1 << bits) - 1
+    grams: List[str] = []
+    padded = f" {normalized} "
+    for n in (1, 2, 3):
+        grams.extend(padded[i : i + n] for i in range(len(padded) - n + 1))
+    words = _WORD_RE.findall(normalized)
+    grams.extend(f"w:{w}" for w in words)
+    grams.extend(f"b:{a} {b}" for a, b in zip(words, words[1:]))
+
+    counts: Dict[int, float] = {}
+    for gram in grams:
+        idx = zlib.crc32(gram.encode("utf-8")) & mask
+        counts[idx] = counts.get(idx, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {idx: v / norm for idx, v in counts.items()}
+
+
+def _sigmoid(z: float) -> float:
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+
+class SkillClassifier:
+    def __init__(self, labels: List[str], bits: int, bias: Dict[str, float], weights: Dict[str, Dict[int, float]]):
+        self.labels = labels
+        self.bits = bits
+        self.bias = bias
+        self.weights = weights
+
+    def probabilities(self, text: str) -> Dict[str, float]:
+        feats = _features(text, self.bits)
+        out = {}
+        for label in self.labels:
+            w = self.weights.get(label, {})
+            z = self.bias.get(label, 0.0) + sum(v * w.get(idx, 0.0) for idx, v in feats.items())
+            out[label] = _sigmoid(z)
+        return out
+
+    def to_json(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "version": 1,
+            "labels": self.labels,
+            "bits": self.bits,
+            "bias": {k: round(v, 6) for k, v in self.bias.items()},
+            "weights": {
+                label: {str(idx): round(v, 5) for idx, v in w.items() if abs(v) >= 1e-4}
+                for label, w in self.weights.items()
+            },
+            "meta": meta,
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "SkillClassifier":
+        return cls(
+            labels=list(data["labels"]),
+            bits=int(data.get("bits", HASH_BITS)),
+            bias={k: float(v) for k, v in data.get("bias", {}).items()},
+            weights={
+                label: {int(idx): float(v) for idx, v in w.items()}
+                for label, w in data.get("weights", {}).items()
+            },
+        )
+
+
+def train(
+    examples: List[Example],
+    labels: List[str],
+    epochs: int = 20,
+    l2: float = 1e-5,
+    lr: float = 2.0,
+    seed: int = 0,
+) -> SkillClassifier:
+    """(查詢, 正確 skill 檔) → 每個 label 一個二元 logistic regression（SGD，稀疏 L2）。"""
+    rng = random.Random(seed)
+    featurized = [(_features(text), set(files)) for text, files in examples]
+    bias = {label: 0.0 for label in labels}
+    weights: Dict[str, Dict[int, float]] = {label: {} for label in labels}
+    order = list(range(len(featurized)))
+    for epoch in range(epochs):
+        rng.shuffle(order)
+        step = lr / math.sqrt(1.0 + epoch)
+        for i in order:
+            feats, positives = featurized[i]
+            for label in labels:
+                w = weights[label]
+                z = bias[label] + sum(v * w.get(idx, 0.0) for idx, v in feats.items())
+                grad = _sigmoid(z) - (1.0 if label in positives else 0.0)
+                bias[label] -= step * grad
+                for idx, v in feats.items():
+                    current = w.get(idx, 0.0)
+                    w[idx] = current - step * (grad * v + l2 * current)
+    return SkillClassifier(labels, HASH_BITS, bias, weights)
+
+
+_model_lock = threading.Lock()
+_model: Optional[SkillClassifier] = None
+_model_mtime = 0.0
+_model_checked_at = 0.0
+
+
+def _load_model() -> Optional[SkillClassifier]:
+    """目前的模型（mtime 變了才重讀）；檔案不存在或格式錯誤回傳 None。"""
+    global _model, _model_mtime, _model_checked_at
+    now = time.monotonic()
+    if now - _model_checked_at < _RELOAD_CHECK_SEC:
+        return _model
+    with _model_lock:
+        _model_checked_at = now
+        try:
+            mtime = os.stat(MODEL_PATH).st_mtime
+        except OSError:
+            _model, _model_mtime = None, 0.0
+            return None
+        if mtime != _model_mtime:
+            data = atomic_io.read_json(MODEL_PATH)
+            try:
+                _model = SkillClassifier.from_json(data) if isinstance(data, dict) else None
+            except (KeyError, TypeError, ValueError):
+                _model = None
+            _model_mtime = mtime
+        return _model
+
+
+def _decide(probs: Dict[str, float]) -> Optional[List[str]]:
+    """任一 skill 的機率落在 (LOW, HIGH) 就沒把握（None），否則回傳機率 ≥ HIGH 的 skill。"""
+    if any(LOW < p < HIGH for p in probs.values()):
+        return None
+    return [label for label, p in probs.items() if p >= HIGH]
+
+
+def predict(text: str, available: Optional[List[str]] = None) -> Optional[List[str]]:
+    """本地分類器選出的 skill 檔；停用、沒有模型、沒把握或被抽中交給 LLM 抽查時回傳 None。"""
+    if not ENABLED:
+        return None
+    model = _load_model()
+    if model is None:
+        return None
+    probs = model.probabilities(text)
+    if available is not None:
+        probs = {k: v for k, v in probs.items() if k in available}
+    decision = _decide(probs)
+    if decision is not None and random.random() < AUDIT_RATE:
+        return None
+    return decision
+
+
+def record_decision(text: str, files: List[str], available: List[str], model: str = "") -> None:
+    """記下 LLM 路由結果（下次訓練的標註）；寫入失敗不影響回合。"""
+    try:
+        atomic_io.append_jsonl(
+            LOG_PATH,
+            {"ts": _utc_now(), "query": text, "files": list(files), "available": list(available), "model": model},
+        )
+    except OSError:
+        pass
+
+
+def _read_jsonl(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(item, dict):
+                out.append(item)
+    return out
+
+
+def load_examples() -> List[Example]:
+    """LLM 路由紀錄轉成訓練樣本；同一查詢以最後一次決策為準。"""
+    labels = [filename for filename, _ in CONDITIONAL_SKILL_RULES]
+    gold: Dict[str, List[str]] = {}
+    for item in _read_jsonl(LOG_PATH):
+        query = str(item.get("query") or "").strip()
+        if query:
+            gold[query] = [f for f in item.get("files", []) if f in labels]
+    return list(gold.items())
+
+
+def _evaluate(model: SkillClassifier, examples: List[Example]) -> Dict[str, float]:
+    exact = confident = confident_exact = 0
+    for text, files in examples:
+        probs = model.probabilities(text)
+        chosen = {label for label, p in probs.items() if p >= 0.5}
+        hit = chosen == set(files)
+        exact += hit
+        if not any(LOW < p < HIGH for p in probs.values()):
+            confident += 1
+            confident_exact += hit
+    n = max(1, len(examples))
+    return {
+        "examples": len(examples),
+        "exact_match": exact / n,
+        "coverage": confident / n,
+        "confident_exact_match": confident_exact / max(1, confident),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="本地 skill 路由分類器")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("train", "eval"):
+        p = sub.add_parser(name)
+        p.add_argument("--epochs", type=int, default=20)
+        p.add_argument("--l2", type=float, default=1e-5)
+    p_predict = sub.add_parser("predict")
+    p_predict.add_argument("text")
+    args = parser.parse_args()
+
+    labels = [filename for filename, _ in CONDITIONAL_SKILL_RULES]
+    if args.command == "predict":
+        model = _load_model()
+        if model is None:
+            print(f"找不到模型檔：{MODEL_PATH}")
+            return
+        started = time.perf_counter()
+        probs = model.probabilities(args.text)
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        for label, p in probs.items():
+            print(f"{label:<28} {p:.3f}")
+        decision = _decide(probs)
+        print(f"決策：{'交給 LLM 路由' if decision is None else decision}（{elapsed_us:.0f} µs）")
+        return
+
+    examples = load_examples()
+    if len(examples) < MIN_EXAMPLES:
+        print(f"LLM 路由紀錄只有 {len(examples)} 筆（至少 {MIN_EXAMPLES} 筆才訓練）：{LOG_PATH}")
+        return
+    if args.command == "eval":
+        ordered = sorted(examples, key=lambda e: zlib.crc32(e[0].encode("utf-8")))
+        cut = max(1, len(ordered) // 5)
+        holdout, train_part = ordered[:cut], ordered[cut:]
+        model = train(train_part, labels, epochs=args.epochs, l2=args.l2)
+        result = _evaluate(model, holdout)
+        print(
+            f"holdout {result['examples']} 筆：與 LLM 一致 {result['exact_match']:.1%}，"
+            f"有把握（不需 LLM）{result['coverage']:.1%}，其中一致 {result['confident_exact_match']:.1%}"
+        )
+        return
+
+    started = time.time()
+    model = train(examples, labels, epochs=args.epochs, l2=args.l2)
+    meta = {
+        "trained_at": _utc_now(),
+        "examples": len(examples),
+        "epochs": args.epochs,
+        "l2": args.l2,
+    }
+    atomic_io.write_json(MODEL_PATH, model.to_json(meta), indent=None)
+    train_result = _evaluate(model, examples)
+    print(
+        f"已寫入 {MODEL_PATH}（{os.path.getsize(MODEL_PATH) / 1024:.0f} KiB，{time.time() - started:.1f} 秒）；"
+        f"訓練集與 LLM 一致 {train_result['exact_match']:.1%}、覆蓋率 {train_result['coverage']:.1%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
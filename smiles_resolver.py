@@ -3,9 +3,18 @@ import json
 from typing import Optional
 from urllib.parse import quote # 用於 URL 編碼
 import cache_utils as cache
+import singleflight
 
 PUBCHEM_API_BASE = "https://pubchem.ncbi.nlm.nih.gov/rest/pug/compound"
 
+
+def _name_cache_key(compound_name: str) -> str:
+    return cache.build_key(
+        "pubchem:smiles_from_name:v2",
+        compound_name=compound_name.strip().lower(),
+    )
+
+
 def resolve_smiles_from_name(compound_name: str) -> str:
     """
     使用 PubChem PUG-REST API 將化合物名稱轉換為 SMILES 字符串。
@@ -24,55 +33,65 @@ def resolve_smiles_from_name(compound_name: str) -> str:
     encoded_name = quote(compound_name)
     
     url = f"{PUBCHEM_API_BASE}/name/{encoded_name}/property/SMILES/JSON"
-    cache_key = cache.build_key(
-        "pubchem:smiles_from_name:v2",
-        compound_name=compound_name.strip().lower(),
-    )
-    cached = cache.get(cache_key)
+    cache_key = _name_cache_key(compound_name)
+
+    def _fetch() -> str:
+        print(f" 正在請求 PubChem API 解析化合物名稱: {compound_name}...")
+
+        try:
+            # 發送請求
+            response = requests.get(url, timeout=10)
+            response.raise_for_status() # 檢查 HTTP 錯誤
+
+            data = response.json()
+
+            # 解析 PubChem API 響應
+            properties = data.get("PropertyTable", {}).get("Properties", [])
+
+            if properties:
+                # 提取 Canonical SMILES
+                smiles = properties[0].get("SMILES")
+                if smiles:
+                    print(f"  -> 成功解析 SMILES: {smiles}")
+                    final_text = (
+                    f"【SMILES 解析結果】:\n"
+                    f"化合物的英文名稱是 '{compound_name}'。\n"
+                    f"其標準 SMILES 字符串是: **{smiles}**\n"
+                    f"請根據此 SMILES 結果，以繁體中文向用戶生成最終的答案。"
+                    )
+                    cache.set(cache_key, final_text)
+                    return final_text
+
+            # 檢查是否有 PubChem API 錯誤信息
+            if data.get("Fault"):
+                message = data["Fault"]["Message"]
+                return f"PubChem API 錯誤：{message}"
+
+            return f"PubChem API 成功響應，但未找到 SMILES 屬性。"
+
+        except requests.exceptions.HTTPError as http_err:
+            if response.status_code == 404:
+                text = f"化合物 '{compound_name}' 在 PubChem 數據庫中未找到 (404 Error)。"
+                cache.set(cache_key, text, outcome=cache.OUTCOME_NOT_FOUND)
+                return text
+            text = f"HTTP 錯誤：{http_err} (狀態碼: {response.status_code})"
+            if response.status_code >= 500 or response.status_code == 429:
+                cache.set(cache_key, text, outcome=cache.OUTCOME_TRANSIENT_ERROR)
+            return text
+        except requests.exceptions.ConnectionError:
+            text = "連接錯誤：無法連接到 PubChem API。"
+            cache.set(cache_key, text, outcome=cache.OUTCOME_TRANSIENT_ERROR)
+            return text
+        except requests.exceptions.Timeout:
+            text = "請求超時：連接到 PubChem API 超時。"
+            cache.set(cache_key, text, outcome=cache.OUTCOME_TRANSIENT_ERROR)
+            return text
+        except Exception as e:
+            return f"發生未知錯誤: {e}"
+
+    cached = cache.get_or_revalidate(cache_key, lambda: singleflight.run(cache_key, _fetch))
     if isinstance(cached, str) and cached.strip():
         print(f"  -> 命中快取：PubChem 名稱解析 {compound_name}")
         return cached
-    
-    print(f" 正在請求 PubChem API 解析化合物名稱: {compound_name}...")
-    
-    try:
-        # 發送請求
-        response = requests.get(url, timeout=10)
-        response.raise_for_status() # 檢查 HTTP 錯誤
-        
-        data = response.json()
-        
-        # 解析 PubChem API 響應
-        properties = data.get("PropertyTable", {}).get("Properties", [])
-        
-        if properties:
-            # 提取 Canonical SMILES
-            smiles = properties[0].get("SMILES")
-            if smiles:
-                print(f"  -> 成功解析 SMILES: {smiles}")
-                final_text = (
-                f"【SMILES 解析結果】:\n"
-                f"化合物的英文名稱是 '{compound_name}'。\n"
-                f"其標準 SMILES 字符串是: **{smiles}**\n"
-                f"請根據此 SMILES 結果，以繁體中文向用戶生成最終的答案。"
-                )
-                cache.set(cache_key, final_text)
-                return final_text
-            
-        # 檢查是否有 PubChem API 錯誤信息
-        if data.get("Fault"):
-            message = data["Fault"]["Message"]
-            return f"PubChem API 錯誤：{message}"
-            
-        return f"PubChem API 成功響應，但未找到 SMILES 屬性。"
-        
-    except requests.exceptions.HTTPError as http_err:
-        if response.status_code == 404:
-            return f"化合物 '{compound_name}' 在 PubChem 數據庫中未找到 (404 Error)。"
-        return f"HTTP 錯誤：{http_err} (狀態碼: {response.status_code})"
-    except requests.exceptions.ConnectionError:
-        return "連接錯誤：無法連接到 PubChem API。"
-    except requests.exceptions.Timeout:
-        return "請求超時：連接到 PubChem API 超時。"
-    except Exception as e:
-        return f"發生未知錯誤: {e}"
\ No newline at end of file
+
+    return singleflight.run(cache_key, _fetch, lookup=singleflight.text_lookup(cache_key))